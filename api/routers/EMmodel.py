@@ -1,19 +1,22 @@
 # Backend/api/routers/EMmodel.py
 
-from fastapi import APIRouter, HTTPException, BackgroundTasks
+from fastapi import APIRouter, HTTPException, BackgroundTasks, Request
 from pydantic import BaseModel
 from typing import List
 import json
-import asyncio
 from fastapi.responses import StreamingResponse
 
 # 从服务层导入所需函数和数据
 from services.EmbServ import (
     get_local_supported_models,
     get_active_model_name,
-    update_active_model,
     download_model_from_hub,
-    get_download_progress
+    get_download_progress,
+    swap_active_model,
+    get_model_swap_progress,
+    download_publisher,
+    model_swap_publisher,
+    MODEL_SWAP_KEY
 )
 
 router = APIRouter(
@@ -65,37 +68,66 @@ async def get_model_download_progress(model_name: str):
 
 @router.get("/download-progress-sse/{model_name:path}")
 async def get_model_download_progress_sse(model_name: str):
-    """通过SSE实时获取指定模型的下载进度"""
+    """通过SSE实时获取指定模型的下载进度（由下载线程推送，等待期间不轮询）"""
     async def event_generator():
-        last_progress = -1
-        while True:
-            progress_info = get_download_progress(model_name)
-            if progress_info['status'] in ['completed', 'error']:
+        progress_queue = download_publisher.subscribe(model_name)
+        try:
+            while True:
+                progress_info = await progress_queue.get()
                 yield f"data: {json.dumps(progress_info)}\n\n"
-                break
-            if progress_info['progress'] != last_progress:
-                yield f"data: {json.dumps(progress_info)}\n\n"
-                last_progress = progress_info['progress']
-            await asyncio.sleep(0.01)  # 避免过于频繁的检查
+                if progress_info['status'] in ['completed', 'error']:
+                    break
+        finally:
+            download_publisher.unsubscribe(model_name, progress_queue)
     
     return StreamingResponse(event_generator(), media_type="text/event-stream")
 
 @router.post("/active")
-async def set_active_model(request: ModelUpdateRequest):
+async def set_active_model(request: ModelUpdateRequest, fastapi_request: Request):
     """
-    更新 .env 文件来切换活动模型。
-    注意：此操作完成后，需要重启后端服务才能加载新模型。
+    热切换活动模型：新模型在后台加载并预热，期间当前模型继续提供服务。
+    切换完成后自动写入 .env，无需重启后端。可通过 /swap-progress-sse 跟踪进度。
     """
+    def _on_swapped(new_model):
+        fastapi_request.app.state.embedding_model = new_model
+
     try:
-        success = update_active_model(request.model_name)
-        if success:
-            return {
-                "message": "活动模型配置已更新。",
-                "new_active_model": request.model_name,
-                "notice": "请务必重启后端服务以使更改生效。"
-            }
+        swap_active_model(request.model_name, on_swapped=_on_swapped)
+        return {
+            "message": "模型切换任务已在后台启动，当前模型在切换完成前继续提供服务。",
+            "new_active_model": request.model_name,
+            "progress_url": "/api/Embedding/swap-progress-sse"
+        }
     except ValueError as e:
         # 捕获不支持模型的错误
         raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        # 已有切换任务正在进行
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"更新配置文件失败: {e}")
+        raise HTTPException(status_code=500, detail=f"启动模型切换失败: {e}")
+
+@router.get("/swap-progress")
+async def get_active_model_swap_progress():
+    """获取模型热切换的进度"""
+    return get_model_swap_progress()
+
+@router.get("/swap-progress-sse")
+async def get_active_model_swap_progress_sse():
+    """通过SSE实时获取模型热切换的进度"""
+    async def event_generator():
+        current = get_model_swap_progress()
+        if current['status'] in ['completed', 'error', 'idle']:
+            yield f"data: {json.dumps(current)}\n\n"
+            return
+        progress_queue = model_swap_publisher.subscribe(MODEL_SWAP_KEY)
+        try:
+            while True:
+                progress_info = await progress_queue.get()
+                yield f"data: {json.dumps(progress_info)}\n\n"
+                if progress_info['status'] in ['completed', 'error']:
+                    break
+        finally:
+            model_swap_publisher.unsubscribe(MODEL_SWAP_KEY, progress_queue)
+
+    return StreamingResponse(event_generator(), media_type="text/event-stream")
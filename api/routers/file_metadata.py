@@ -150,32 +150,37 @@ async def get_file_status_in_dual_index(file_id: str):
     获取文件在双层索引中的状态
     """
     from services.db_service import DBService
-    from services.vector_store_service import VectorStoreService
+    from services.chunk_counters import chunk_counter_service
+    from services.search_cache import index_generation
     db_service = DBService()
-    vector_service = VectorStoreService()
     
     # 从数据库获取文件信息
     file_info = db_service.get_file_info_by_id(file_id)
     if not file_info:
         raise HTTPException(status_code=404, detail="File not found in database")
     
-    # 检查向量存储中是否包含此文件
-    large_results = vector_service.query_by_file_id(
-        file_id=file_id,
-        collection_name="knowledge_base_large",
-        n_results=1  # 只需要确认存在性
-    )
-    
-    small_results = vector_service.query_by_file_id(
-        file_id=file_id,
-        collection_name="knowledge_base_small",
-        n_results=1  # 只需要确认存在性
-    )
+    # 计数与当前索引代号同步时直接读取，否则（如有绕过 vector_ingest 的写入）回退为查询向量存储
+    collection_names = ("knowledge_base_large", "knowledge_base_small")
+    if chunk_counter_service.is_synced(collection_names, index_generation.current()):
+        counts = chunk_counter_service.get_file_counts(file_id)
+    else:
+        from services.vector_store_service import VectorStoreService
+        vector_service = VectorStoreService()
+        counts = {
+            name: len(vector_service.query_by_file_id(
+                file_id=file_id,
+                collection_name=name,
+                n_results=1  # 只需要确认存在性
+            ).get('documents', []))
+            for name in collection_names
+        }
+    num_large = counts.get("knowledge_base_large", 0)
+    num_small = counts.get("knowledge_base_small", 0)
     
     return {
         "file_info": file_info,
-        "stored_in_large_collection": len(large_results.get('documents', [])) > 0,
-        "stored_in_small_collection": len(small_results.get('documents', [])) > 0,
-        "num_chunks_in_large": len(large_results.get('documents', [])),
-        "num_chunks_in_small": len(small_results.get('documents', []))
+        "stored_in_large_collection": num_large > 0,
+        "stored_in_small_collection": num_small > 0,
+        "num_chunks_in_large": num_large,
+        "num_chunks_in_small": num_small
     }
\ No newline at end of file
@@ -1,9 +1,10 @@
 # api/routers/search.py
 
 from fastapi import APIRouter, Depends, status, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from sentence_transformers import SentenceTransformer
-import chromadb,time,os,logging
+import chromadb,time,os,logging,json
 from typing import Optional, List, Dict, Any
 
 # 从你项目中的错误处理模块导入自定义异常
@@ -11,6 +12,24 @@ from .HandleError import APIException
 from services.config import is_path_in_knowledge_base_work_area
 from services.filter_utils import build_where_clause
 from services.search_service import SearchService
+from services.hybrid_search import hybrid_search
+from services.lexical_index import lexical_index
+from services.search_cache import cached_search, make_search_key, search_result_cache
+from services.batch_search import batch_dense_search
+from services.streaming_search import stream_search_events
+from services.retrieval import dense_query, get_default_embedder
+from services.parent_context import parent_chunk_resolver
+from services.mmr import is_mmr_requested, mmr_rerank
+from services.reranker import get_reranker
+from services.chunk_counters import chunk_counter_service
+from services.semantic_cache import SemanticQueryCache, semantic_query_cache
+from services.search_cache import index_generation
+from services.singleflight import search_singleflight
+from services.search_cursor import page_from_cursor, search_cursor_store
+from services.hnsw_tuning import hnsw_params_store, tune_collection
+from services.simhash import collapse_near_duplicates
+from services.EmbServ import get_active_model_name
+from services.config import SEARCH_CONFIG
 
 # --- 1. 创建路由器实例 ---
 router = APIRouter(
@@ -29,6 +48,34 @@ class SearchRequest(BaseModel):
     query: str
     n_results: int = 10
     filters: Optional[SearchFilters] = None
+    # 检索模式："semantic"（默认，纯向量）或 "hybrid"（向量 + BM25，倒数排名融合）
+    mode: Optional[str] = None
+    # 混合检索中两路结果的融合权重，未指定时使用 SEARCH_CONFIG
+    dense_weight: Optional[float] = None
+    lexical_weight: Optional[float] = None
+    # 由细到粗检索：把命中的小块映射为所属的大块并去重，返回更完整的上下文
+    parent_context: bool = False
+    # 用交叉编码器重排前 K 条结果（受单次请求的时间预算限制）
+    rerank: bool = False
+    # 折叠 SimHash 指纹相近的近重复结果（版本导出、复制的日志、重复上传的文件等）
+    collapse_duplicates: bool = False
+
+class PagedSearchRequest(SearchRequest):
+    # 每页结果数；n_results 在分页请求中不使用
+    page_size: int = 10
+    # 上一页返回的 next_cursor；为空时执行第一页检索
+    cursor: Optional[str] = None
+
+class HnswTuneRequest(BaseModel):
+    collection_name: str = "knowledge_base_small"
+    m: int = 16
+    construction_ef: int = 100
+    search_ef: int = 10
+    # recall@k 的 k 与留出查询数，为空时使用 SEARCH_CONFIG 中的默认值
+    k: Optional[int] = None
+    num_queries: Optional[int] = None
+    # 为 True 时用新参数替换原集合并保存参数，否则只评估
+    apply: bool = False
 
 # --- 3. 定义依赖项 (Dependencies) ---
 def get_embedding_model() -> SentenceTransformer:
@@ -38,6 +85,38 @@ def get_search_service(request: Request) -> SearchService:
     # 直接从 app.state 返回在启动时创建的单例
     return request.app.state.search_service
 
+def search_options(request: SearchRequest, source: str = "search") -> Dict[str, Any]:
+    """
+    影响检索结果的选项，同时作为结果缓存键的一部分。
+    source 标明产出结果的检索实现（"search" 单条流水线 / "batch" 批量检索），
+    不同实现的结果不共享缓存条目。
+    """
+    return {
+        "source": source,
+        "mode": request.mode or "semantic",
+        "dense_weight": request.dense_weight,
+        "lexical_weight": request.lexical_weight,
+        "parent_context": request.parent_context,
+        "collapse_duplicates": request.collapse_duplicates
+    }
+
+def expand_parent_context(results: List[Dict[str, Any]], search_service: SearchService) -> List[Dict[str, Any]]:
+    """把小块结果映射为去重后的大块上下文。"""
+    large_collection = search_service.vector_store_service.get_collection("knowledge_base_large")
+    return parent_chunk_resolver.expand(results, large_collection)
+
+def validate_result_paths(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """进行安全验证，只保留路径在知识库工作区域内的结果。"""
+    validated_results = []
+    for result in results:
+        source_path_str = result.get("source_file")
+        try:
+            is_path_in_knowledge_base_work_area(source_path_str)
+            validated_results.append(result)
+        except (ValueError, TypeError) as e:
+            continue
+    return validated_results
+
 # --- 4. 定义 API 端点 ---
 
 @router.get("/count")
@@ -46,11 +125,13 @@ def get_document_count(
 ):
     """
     返回当前向量数据库中小块集合的文档总数。
+    计数与当前索引代号同步时直接读取计数，否则（如有绕过 vector_ingest 的写入）回退为 Chroma 的 count()。
     """
     try:
-        collection = search_service.vector_store_service.get_collection("knowledge_base_small")
-        # 修复：使用LangChain Chroma实例的count方法
-        count = collection._collection.count() if hasattr(collection, '_collection') and collection._collection else 0
+        count = chunk_counter_service.get_collection_count("knowledge_base_small", index_generation.current())
+        if count is None:
+            collection = search_service.vector_store_service.get_collection("knowledge_base_small")
+            count = collection._collection.count()
         return {"count": count}
     except Exception as e:
         raise APIException(
@@ -58,6 +139,188 @@ def get_document_count(
             message=f"Failed to get document count: {str(e)}"
         )
 
+@router.post("/count/reconcile")
+def reconcile_chunk_counts(
+    search_service: SearchService = Depends(get_search_service)
+):
+    """
+    从 Chroma 全量重建小块与大块集合的文本块计数，用于修正中断入库等情况造成的偏差。
+    """
+    try:
+        return {
+            name: chunk_counter_service.reconcile(search_service.vector_store_service.get_collection(name), name)
+            for name in ("knowledge_base_small", "knowledge_base_large")
+        }
+    except Exception as e:
+        raise APIException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            message=f"Failed to reconcile chunk counts: {str(e)}"
+        )
+
+@router.post("/lexical-index/rebuild")
+def rebuild_lexical_index(
+    search_service: SearchService = Depends(get_search_service)
+):
+    """
+    从小块集合全量重建词法索引，用于为启用混合检索之前入库的文档补建索引。
+    """
+    try:
+        collection = search_service.vector_store_service.get_collection("knowledge_base_small")
+        indexed = lexical_index.rebuild_from_collection(collection, "knowledge_base_small")
+        return {"indexed": indexed, "tokenizer": lexical_index.tokenizer}
+    except Exception as e:
+        raise APIException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            message=f"Failed to rebuild lexical index: {str(e)}"
+        )
+
+@router.post("/hnsw/tune")
+def tune_hnsw_params(
+    request: HnswTuneRequest,
+    http_request: Request,
+    search_service: SearchService = Depends(get_search_service)
+):
+    """
+    以给定的 M / construction_ef / search_ef 重建集合，报告相对 NumPy 精确检索的 recall@k
+    与 p50 / p95 延迟（同时给出当前集合的对照值）；apply 为 True 时应用并保存参数。
+    """
+    if request.collection_name not in ("knowledge_base_small", "knowledge_base_large"):
+        raise APIException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            message="collection_name must be knowledge_base_small or knowledge_base_large."
+        )
+    chroma_client = getattr(http_request.app.state, "chroma_client", None)
+    if chroma_client is None:
+        raise APIException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            message="ChromaDB client not initialized."
+        )
+    try:
+        return tune_collection(
+            chroma_client,
+            search_service.vector_store_service.get_collection(request.collection_name),
+            m=request.m,
+            construction_ef=request.construction_ef,
+            search_ef=request.search_ef,
+            k=request.k,
+            num_queries=request.num_queries,
+            apply=request.apply,
+            app_state=http_request.app.state
+        )
+    except ValueError as e:
+        raise APIException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            message=str(e)
+        )
+    except Exception as e:
+        raise APIException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            message=f"Failed to tune HNSW parameters: {str(e)}"
+        )
+
+@router.get("/hnsw/params")
+def get_hnsw_params():
+    """返回各集合已应用的 HNSW 参数及应用时的评估结果（未调优过的集合为 null）。"""
+    return {
+        name: hnsw_params_store.get(name)
+        for name in ("knowledge_base_small", "knowledge_base_large")
+    }
+
+def run_search_pipeline(request: SearchRequest, search_service: SearchService,
+                        require_chunk_ids: bool = False) -> List[Dict[str, Any]]:
+    """
+    执行一次完整的搜索流程：检索（含各类缓存与请求合并）、路径安全验证与可选的重排。
+    require_chunk_ids 为 True 时总是直接查询集合，保证结果带有文本块 id（游标分页需要）。
+    """
+    search_filters = request.filters.dict(exclude_none=True) if request.filters else None
+    options = search_options(request)
+    if require_chunk_ids:
+        options["with_chunk_ids"] = True
+
+    use_mmr = is_mmr_requested(search_filters)
+    # 折叠近重复结果后仍需凑够 n_results 条，先多取一些
+    target = request.n_results * SEARCH_CONFIG["simhash_candidate_multiplier"] if request.collapse_duplicates \
+        else request.n_results
+    # MMR 需要在更大的候选集合中挑选 target 条结果
+    candidates = target * SEARCH_CONFIG["mmr_candidate_multiplier"] if use_mmr else target
+
+    def run_search(query_embedding=None):
+        where = build_where_clause(search_filters) if search_filters else None
+        # 带过滤条件时也直接查询小块集合，以便经过元数据预过滤规划；
+        # 语义缓存算出的查询向量只在直接查询时复用，不改变检索路径
+        if request.mode != "hybrid" and not (request.parent_context or use_mmr or where or require_chunk_ids
+                                             or request.collapse_duplicates):
+            # 调用新的服务层进行小块集合的语义搜索
+            return search_service.semantic_search(
+                query=request.query,
+                n_results=request.n_results,
+                filters=search_filters
+            )
+
+        # 父块映射与 MMR 需要文本块 id、元数据与向量，直接查询小块集合
+        collection = search_service.vector_store_service.get_collection("knowledge_base_small")
+        if query_embedding is None:
+            query_embedding = get_default_embedder().embed_query_array(request.query)
+        if request.mode == "hybrid":
+            results = hybrid_search(
+                collection,
+                query=request.query,
+                n_results=candidates,
+                filters=search_filters,
+                dense_weight=request.dense_weight,
+                lexical_weight=request.lexical_weight,
+                query_embedding=query_embedding
+            )
+        else:
+            results = dense_query(collection, query_embedding, candidates, where=where, include_embeddings=use_mmr)[0]
+        if use_mmr:
+            results = mmr_rerank(collection, results, query_embedding, target)
+        if request.collapse_duplicates:
+            results = collapse_near_duplicates(results)[:request.n_results]
+        return results
+
+    def run_search_with_context():
+        query_embedding, context, generation = None, None, None
+        if semantic_query_cache.enabled and request.mode != "hybrid":
+            # 措辞略有不同的相似查询直接复用结果；混合检索的词法得分取决于字面内容，不参与
+            generation = index_generation.current()
+            query_embedding = get_default_embedder().embed_query_array(request.query)
+            context = SemanticQueryCache.make_context(
+                search_filters, request.n_results, get_active_model_name(), **options
+            )
+            similar = semantic_query_cache.get(query_embedding, context, generation)
+            if similar is not None:
+                return similar
+
+        results = run_search(query_embedding)
+        if request.parent_context:
+            results = expand_parent_context(results, search_service)
+        if query_embedding is not None:
+            semantic_query_cache.put(query_embedding, context, generation, results)
+        return results
+
+    # 相同查询在索引未变化时直接复用缓存结果；同时到达的相同请求只计算一次
+    flight_key = make_search_key(request.query, search_filters, request.n_results, **options)
+    results, coalesced = search_singleflight.do(
+        flight_key,
+        lambda: cached_search(
+            request.query, search_filters, request.n_results, run_search_with_context,
+            **options
+        )
+    )
+    if coalesced:
+        # 合并的请求共享同一结果，复制后再交给后续可能修改结果的步骤
+        results = [dict(r) for r in results]
+
+    # 进行安全验证，确保路径在知识库工作区域内
+    validated_results = validate_result_paths(results)
+
+    # 重排在结果缓存之外进行：部分重排的结果不会被缓存，重复查询则直接命中重排分数缓存
+    if request.rerank:
+        validated_results, _ = get_reranker().rerank(request.query, validated_results)
+
+    return validated_results
+
 @router.post("/")
 def perform_search(
     request: SearchRequest,
@@ -79,27 +342,213 @@ def perform_search(
 
     query_start_time = time.time()
 
-    # 调用新的服务层进行小块集合的语义搜索
-    search_filters = request.filters.dict(exclude_none=True) if request.filters else None
-    results = search_service.semantic_search(
-        query=request.query,
-        n_results=request.n_results,
-        filters=search_filters
-    )
+    validated_results = run_search_pipeline(request, search_service)
 
-    query_end_time = time.time()
     pass  # [自动清理] 已移除输出语句
+    return validated_results
 
-    # 进行安全验证，确保路径在知识库工作区域内
-    validated_results = []
-    for result in results:
-        source_path_str = result.get("source_file")
+@router.post("/page")
+def perform_paged_search(
+    request: PagedSearchRequest,
+    search_service: SearchService = Depends(get_search_service)
+):
+    """
+    游标分页搜索。
+    第一页（cursor 为空）一次性检索 page_size × SEARCH_CURSOR_MAX_PAGES 条候选，
+    并把排序后的结果保存在短期有效的游标下；之后的页面凭 next_cursor 从中切片，
+    不再重新编码查询或执行 ANN 检索。
+    """
+    page_size = max(1, min(request.page_size, SEARCH_CONFIG["cursor_max_page_size"]))
+
+    if request.cursor:
         try:
-            is_path_in_knowledge_base_work_area(source_path_str)
-            validated_results.append(result)
-        except (ValueError, TypeError) as e:
-            pass  # [自动清理] 已移除输出语句
-            continue
+            token, offset = search_cursor_store.decode(request.cursor)
+        except ValueError:
+            raise APIException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                message="Invalid cursor."
+            )
+        state = search_cursor_store.get(token)
+        if state is None:
+            raise APIException(
+                status_code=status.HTTP_410_GONE,
+                message="Cursor has expired, please run the search again."
+            )
+        results = validate_result_paths(page_from_cursor(
+            search_service.vector_store_service.get_collection, state, offset, page_size
+        ))
+        next_offset = offset + page_size
+        has_more = next_offset < len(state.results)
+        return {
+            "results": results,
+            "next_cursor": search_cursor_store.encode(token, next_offset) if has_more else None,
+            "total": len(state.results)
+        }
 
-    pass  # [自动清理] 已移除输出语句
-    return validated_results
+    if not request.query or not request.query.strip():
+        raise APIException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            message="Query text cannot be empty."
+        )
+    wide_request = SearchRequest(**request.dict(exclude={"page_size", "cursor", "n_results"}),
+                                 n_results=page_size * SEARCH_CONFIG["cursor_max_pages"])
+    ranked = run_search_pipeline(wide_request, search_service, require_chunk_ids=True)
+
+    next_cursor = None
+    if len(ranked) > page_size:
+        # 父块上下文结果带有 matched_chunks，来自大块集合；其余结果来自小块集合
+        token = search_cursor_store.create(
+            ranked,
+            lambda r: "knowledge_base_large" if "matched_chunks" in r else "knowledge_base_small"
+        )
+        next_cursor = search_cursor_store.encode(token, page_size)
+    return {
+        "results": ranked[:page_size],
+        "next_cursor": next_cursor,
+        "total": len(ranked)
+    }
+
+@router.post("/stream")
+def perform_streaming_search(
+    request: SearchRequest,
+    format: str = "ndjson",
+    search_service: SearchService = Depends(get_search_service)
+):
+    """
+    流式搜索：每条结果通过路径安全验证后立即发送，随后发送最终排名 / 分数更新。
+    format 为 "ndjson"（每行一个 JSON 事件）或 "sse"（text/event-stream）。
+    """
+    if not request.query or not request.query.strip():
+        raise APIException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            message="Query text cannot be empty."
+        )
+    if format not in ("ndjson", "sse"):
+        raise APIException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            message="format must be 'ndjson' or 'sse'."
+        )
+
+    collection = search_service.vector_store_service.get_collection("knowledge_base_small")
+    search_filters = request.filters.dict(exclude_none=True) if request.filters else None
+
+    def event_generator():
+        try:
+            events = stream_search_events(
+                collection,
+                query=request.query,
+                n_results=request.n_results,
+                filters=search_filters,
+                validate=validate_result_paths,
+                mode=request.mode,
+                dense_weight=request.dense_weight,
+                lexical_weight=request.lexical_weight,
+                expand=(lambda results: expand_parent_context(results, search_service))
+                if request.parent_context else None,
+                rerank=request.rerank,
+                collapse_duplicates=request.collapse_duplicates
+            )
+            for event in events:
+                payload = json.dumps(event, ensure_ascii=False, default=str)
+                yield f"data: {payload}\n\n" if format == "sse" else f"{payload}\n"
+        except Exception as e:
+            payload = json.dumps({"type": "error", "detail": str(e)}, ensure_ascii=False)
+            yield f"data: {payload}\n\n" if format == "sse" else f"{payload}\n"
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(event_generator(), media_type=media_type)
+
+@router.post("/batch")
+def perform_batch_search(
+    requests: List[SearchRequest],
+    search_service: SearchService = Depends(get_search_service)
+):
+    """
+    批量搜索：接收多条 SearchRequest，按顺序返回每条查询的结果列表。
+    未命中缓存的查询在一次模型调用中统一编码，过滤条件相同的语义检索合并为一次多查询 ANN 调用，
+    每条查询仍分别应用自己的过滤条件与路径安全验证。
+    """
+    if not requests:
+        return []
+    if len(requests) > SEARCH_CONFIG["batch_max_queries"]:
+        raise APIException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            message=f"Too many queries in one batch (max {SEARCH_CONFIG['batch_max_queries']})."
+        )
+    for item in requests:
+        if not item.query or not item.query.strip():
+            raise APIException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                message="Query text cannot be empty."
+            )
+
+    collection = search_service.vector_store_service.get_collection("knowledge_base_small")
+    all_filters = [item.filters.dict(exclude_none=True) if item.filters else None for item in requests]
+    keys = [
+        make_search_key(item.query, item_filters, item.n_results, **search_options(item, source="batch"))
+        for item, item_filters in zip(requests, all_filters)
+    ]
+    results: List[Optional[List[Dict[str, Any]]]] = [search_result_cache.get(key) for key in keys]
+    pending = [i for i, cached in enumerate(results) if cached is None]
+
+    if pending:
+        start_time = time.perf_counter()
+        # 所有未命中缓存的查询一次性编码
+        query_embeddings = get_default_embedder().embed_queries_array([requests[i].query for i in pending])
+        position = {i: p for p, i in enumerate(pending)}
+
+        use_mmr = [is_mmr_requested(query_filters) for query_filters in all_filters]
+        # 与单条搜索相同：折叠近重复结果时先多取，MMR 再在更大的候选集合中挑选
+        targets = [
+            item.n_results * SEARCH_CONFIG["simhash_candidate_multiplier"] if item.collapse_duplicates
+            else item.n_results
+            for item in requests
+        ]
+        candidates = [
+            target * SEARCH_CONFIG["mmr_candidate_multiplier"] if mmr else target
+            for target, mmr in zip(targets, use_mmr)
+        ]
+
+        semantic = [i for i in pending if requests[i].mode != "hybrid"]
+        semantic_results = batch_dense_search(
+            collection,
+            [requests[i].query for i in semantic],
+            [candidates[i] for i in semantic],
+            [all_filters[i] for i in semantic],
+            query_embeddings=query_embeddings[[position[i] for i in semantic]] if semantic else None,
+            include_embeddings=[use_mmr[i] for i in semantic]
+        )
+        for i, query_results in zip(semantic, semantic_results):
+            results[i] = query_results
+
+        for i in pending:
+            if requests[i].mode == "hybrid":
+                results[i] = hybrid_search(
+                    collection,
+                    query=requests[i].query,
+                    n_results=candidates[i],
+                    filters=all_filters[i],
+                    dense_weight=requests[i].dense_weight,
+                    lexical_weight=requests[i].lexical_weight,
+                    query_embedding=query_embeddings[position[i]]
+                )
+
+        for i in pending:
+            if use_mmr[i]:
+                results[i] = mmr_rerank(collection, results[i], query_embeddings[position[i]], targets[i])
+            if requests[i].collapse_duplicates:
+                results[i] = collapse_near_duplicates(results[i])
+            results[i] = results[i][:requests[i].n_results]
+            if requests[i].parent_context:
+                results[i] = expand_parent_context(results[i], search_service)
+
+        # 批量检索的耗时按查询数均摊后计入缓存
+        elapsed = (time.perf_counter() - start_time) / len(pending)
+        for i in pending:
+            search_result_cache.put(keys[i], results[i], elapsed)
+
+    validated = [validate_result_paths(query_results) for query_results in results]
+    for i, item in enumerate(requests):
+        if item.rerank:
+            validated[i], _ = get_reranker().rerank(item.query, validated[i])
+    return validated
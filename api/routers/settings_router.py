@@ -5,6 +5,10 @@ from schemas.settings import Settings
 from services.settings_service import settings_service
 from services.db_service import DBService
 from services.vector_store_service import VectorStoreService
+from services.lexical_index import lexical_index
+from services.search_cache import index_generation
+from services.config import invalidate_validated_paths
+from services.chunk_counters import chunk_counter_service
 
 router = APIRouter()
 
@@ -59,6 +63,12 @@ async def clear_knowledge_base_cache(request: Request):
         
         # 清空ChromaDB集合
         vector_result = vector_store_service.clear_all_collections()
+
+        # 清空词法索引
+        lexical_index.clear()
+        generation = index_generation.bump()
+        invalidate_validated_paths()
+        chunk_counter_service.clear(generation)
         
         return {
             "message": "知识库缓存已成功清除",
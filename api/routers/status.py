@@ -2,6 +2,17 @@ from fastapi import APIRouter, Request
 from pydantic import BaseModel
 from typing import Dict, Any
 
+from api.monitoring import metrics_tracker
+from services.EmbServ import get_query_batcher_stats, get_embedding_cache_stats, get_embedding_pool_stats
+from services.search_cache import search_result_cache
+from services.config import get_path_validation_stats
+from services.parent_context import parent_chunk_resolver
+from services.reranker import get_reranker_stats
+from services.prefilter import filter_planner
+from services.semantic_cache import semantic_query_cache
+from services.singleflight import search_singleflight
+from services.search_cursor import search_cursor_store
+
 router = APIRouter(
     prefix="/api/status",
     tags=["Status"],
@@ -48,4 +59,26 @@ async def get_backend_status(request: Request):
             chroma_db_initialized=False,
             search_service_initialized=False,
             status="error"
-        )
\ No newline at end of file
+        )
+
+@router.get("/metrics")
+async def get_performance_metrics() -> Dict[str, Any]:
+    """获取 API 调用、搜索与嵌入模型相关的性能指标"""
+    return {
+        "api": metrics_tracker.get_stats(),
+        "search": {
+            "result_cache": search_result_cache.get_stats(),
+            "semantic_cache": semantic_query_cache.get_stats(),
+            "singleflight": search_singleflight.get_stats(),
+            "cursors": search_cursor_store.get_stats(),
+            "path_validation": get_path_validation_stats(),
+            "parent_context": parent_chunk_resolver.get_stats(),
+            "rerank": get_reranker_stats(),
+            "prefilter": filter_planner.get_stats()
+        },
+        "embedding": {
+            "query_batching": get_query_batcher_stats(),
+            "document_cache": get_embedding_cache_stats(),
+            "worker_pool": get_embedding_pool_stats()
+        }
+    }
@@ -41,33 +41,42 @@ else:
 
 import logging,sys,json,uvicorn
 from fastapi import FastAPI
-from contextlib import asynccontextmanager
-from api.lifespan import lifespan
-from api.routers.HandleError import APIException, api_exception_handler
-from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
-from fastapi import Request
 
-app = FastAPI(
-    title="Local Mind API",
-    description="API for interacting with a local Ollama instance and semantic search",
-    version="1.0.0",
-    lifespan=lifespan
-)
 
+def create_app() -> FastAPI:
+    """构建 FastAPI 应用：注册生命周期、中间件与全部路由。"""
+    from api.lifespan import lifespan
+    from services.vector_ingest import install_ingest_hooks
 
+    # 已编译的 VectorStoreService 经 LangChain Chroma 写入向量库，在 chromadb 的写入方法上挂载入库钩子
+    install_ingest_hooks()
 
-# 从 middleware 模块配置中间件
-from api.middleware import configure_middleware
-configure_middleware(app)
+    app = FastAPI(
+        title="Local Mind API",
+        description="API for interacting with a local Ollama instance and semantic search",
+        version="1.0.0",
+        lifespan=lifespan
+    )
 
-# 从 routers_config 模块配置路由
-from api.routers_config import configure_routers
-configure_routers(app)
+    # 从 middleware 模块配置中间件
+    from api.middleware import configure_middleware
+    configure_middleware(app)
 
-@app.get("/", tags=["Root"])
-async def read_root():
-    return {"message": "Welcome to the Ollama Chat API"}
+    # 从 routers_config 模块配置路由
+    from api.routers_config import configure_routers
+    configure_routers(app)
+
+    @app.get("/", tags=["Root"])
+    async def read_root():
+        return {"message": "Welcome to the Ollama Chat API"}
+
+    return app
+
+
+# 以 spawn 方式启动的子进程（嵌入工作池等）会把本文件作为 __mp_main__ 重新导入，
+# 子进程不需要应用及其服务，此时跳过构建
+if __name__ != "__mp_main__":
+    app = create_app()
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -1,63 +1,155 @@
 # Backend/services/EmbServ.py
 
-import os,time,shutil,sys,threading
+from __future__ import annotations
+
+import os,time,shutil,sys,threading,queue,gc,platform,atexit,logging
+from contextlib import contextmanager
+from collections import Counter, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
 from dotenv import load_dotenv
-from sentence_transformers import SentenceTransformer
-from huggingface_hub import scan_cache_dir,snapshot_download
 from pathlib import Path
-from typing import List
+from typing import List, TYPE_CHECKING
 from langchain_core.embeddings import Embeddings
 from services.config import ENV_PATH
+from services.progress_publisher import ProgressPublisher
+
+logger = logging.getLogger(__name__)
+
+# sentence_transformers 会连带导入 torch，开销很大，仅在真正加载模型时才导入
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
 load_dotenv(dotenv_path=ENV_PATH)
-# 添加用于跟踪下载进度的字典
-download_progress = {}
+# 模型下载进度发布器（按模型名称区分，支持多个模型同时下载）
+download_publisher = ProgressPublisher()
 
 # 用于存储已加载模型的全局单例
 embedding_model_instance = None
+# 全局模型实例对应的模型名称，与 embedding_model_instance 在同一把锁下同时切换
+embedding_model_name = None
+# 全局模型实例加载时使用的推理后端标识（含量化配置），向量缓存据此区分不同推理路径产生的向量
+embedding_model_backend = None
 
 # 用于更新模型列表的锁
 model_list_lock = threading.Lock()
 
+
+def get_hf_cache_dir() -> Path:
+    """返回 Hugging Face Hub 缓存目录。"""
+    from huggingface_hub.constants import HF_HUB_CACHE
+    return Path(HF_HUB_CACHE)
+
+
+class ModelRegistry:
+    """
+    本地模型注册表。
+    首次访问时才扫描 Hugging Face 缓存；之后每次访问只比较缓存根目录和各模型目录的 mtime，
+    仅重新统计发生变化的模型目录，避免反复遍历整个缓存。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._root_mtime = None
+        # 模型目录名 -> (目录签名, 模型信息)
+        self._entries = {}
+        self._models = None
+
+    def invalidate(self):
+        """显式失效，下次访问时完整重建（例如模型下载完成后）。"""
+        with self._lock:
+            self._root_mtime = None
+            self._entries = {}
+            self._models = None
+
+    @staticmethod
+    def _repo_signature(repo_dir: Path):
+        signature = []
+        for path in (repo_dir, repo_dir / "blobs", repo_dir / "snapshots", repo_dir / "refs"):
+            try:
+                signature.append(path.stat().st_mtime_ns)
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    @staticmethod
+    def _build_model_info(repo_dir: Path) -> dict:
+        # 与 scan_cache_dir 一致：磁盘占用按 blobs 目录下的文件大小统计
+        size_on_disk = 0
+        blobs_dir = repo_dir / "blobs"
+        if blobs_dir.is_dir():
+            with os.scandir(blobs_dir) as it:
+                for entry in it:
+                    try:
+                        if entry.is_file():
+                            size_on_disk += entry.stat().st_size
+                    except OSError:
+                        continue
+        repo_id = repo_dir.name[len("models--"):].replace("--", "/")
+        return {
+            "name": repo_id,
+            "description": f"HuggingFace缓存模型，占用磁盘 {size_on_disk / (1024**2):.2f} MB。",
+            "url": f"https://huggingface.co/{repo_id}",
+            "location": "huggingface_cache"
+        }
+
+    def get_models(self) -> list:
+        """返回本地缓存中的模型列表，必要时增量刷新。"""
+        cache_dir = get_hf_cache_dir()
+        with self._lock:
+            try:
+                root_mtime = cache_dir.stat().st_mtime_ns
+            except OSError:
+                self._root_mtime, self._entries, self._models = None, {}, []
+                return []
+
+            changed = False
+            if root_mtime != self._root_mtime:
+                # 根目录变化说明有模型目录被新增或删除，重新列出目录
+                repo_dirs = {}
+                with os.scandir(cache_dir) as it:
+                    for entry in it:
+                        if entry.name.startswith("models--") and entry.is_dir():
+                            repo_dirs[entry.name] = Path(entry.path)
+                for name in list(self._entries):
+                    if name not in repo_dirs:
+                        del self._entries[name]
+                        changed = True
+                self._root_mtime = root_mtime
+            else:
+                repo_dirs = {name: cache_dir / name for name in self._entries}
+
+            for name, repo_dir in repo_dirs.items():
+                signature = self._repo_signature(repo_dir)
+                cached = self._entries.get(name)
+                if cached is None or cached[0] != signature:
+                    self._entries[name] = (signature, self._build_model_info(repo_dir))
+                    changed = True
+
+            if changed or self._models is None:
+                self._models = [info for _, info in sorted(self._entries.values(), key=lambda e: e[1]["name"])]
+            return list(self._models)
+
+
+# 全局模型注册表（惰性扫描）
+model_registry = ModelRegistry()
+
 def get_local_supported_models():
     """
-    扫描本地Hugging Face缓存，动态生成支持的模型列表。
+    返回本地Hugging Face缓存中的模型列表（由模型注册表按需增量刷新）。
     """
     try:
-        pass  # [自动清理] 已移除输出语句
-        local_models = []
-        
-        # 扫描HuggingFace缓存中的模型
-        cached_models = scan_cache_dir()
-        for repo in cached_models.repos:
-            if repo.repo_type == 'model':
-                local_models.append({
-                    "name": repo.repo_id,
-                    "description": f"HuggingFace缓存模型，占用磁盘 {repo.size_on_disk / (1024**2):.2f} MB。",
-                    "url": f"https://huggingface.co/{repo.repo_id}",
-                    "location": "huggingface_cache"
-                })
-        
-        if not local_models:
-             pass  # [自动清理] 已移除输出语句
-        
-        pass  # [自动清理] 已移除输出语句
-        return local_models
+        return model_registry.get_models()
     except Exception as e:
         pass  # [自动清理] 已移除输出语句
         return []  # 返回空列表而不是默认模型，因为默认模型可能并未实际下载
 
-# 动态生成支持的模型列表
-SUPPORTED_MODELS = get_local_supported_models()
-
 def refresh_supported_models():
     """
-    重新扫描本地模型并更新 SUPPORTED_MODELS 全局变量
+    使模型注册表失效，下次访问时重新扫描本地模型
     """
-    global SUPPORTED_MODELS
     with model_list_lock:
-        pass  # [自动清理] 已移除输出语句
-        SUPPORTED_MODELS = get_local_supported_models()
-        pass  # [自动清理] 已移除输出语句
+        model_registry.invalidate()
 
 # 注释：要启用自定义模型目录功能，请在 .env 文件中添加以下行：
 # CUSTOM_MODEL_DIR=/path/to/your/custom/models/directory
@@ -69,21 +161,162 @@ class ModelNotFoundError(Exception):
     pass
 
 def get_active_model_name() -> str:
-    """从 .env 文件读取并返回当前激活的模型名称。"""
-
+    """
+    返回当前激活的模型名称。
+    全局模型已加载时以内存中与模型实例一同切换的名称为准，否则从 .env 文件读取。
+    """
+    if embedding_model_name is not None:
+        return embedding_model_name
     return os.getenv("ACTIVE_MODEL_NAME", "Qwen/Qwen3-Embedding-0.6B")
 
+def get_query_batch_window_ms() -> float:
+    """从 .env 文件读取查询微批处理的收集窗口（毫秒）。设为 0 表示关闭微批处理。"""
+    try:
+        return max(0.0, float(os.getenv("EMBED_QUERY_BATCH_WINDOW_MS", "3")))
+    except ValueError:
+        return 3.0
+
+def get_query_batch_max_size() -> int:
+    """从 .env 文件读取单个查询批次的最大条数，达到该数量时立即编码，不再等待窗口结束。"""
+    try:
+        return max(1, int(os.getenv("EMBED_QUERY_BATCH_MAX_SIZE", "32")))
+    except ValueError:
+        return 32
+
+def is_embedding_cache_enabled() -> bool:
+    """从 .env 文件读取是否启用文本块向量的持久化缓存，默认启用。"""
+    return os.getenv("EMBED_CACHE_ENABLED", "true").strip().lower() in ("1", "true", "yes", "on")
+
+def get_embedding_cache_max_entries() -> int:
+    """从 .env 文件读取向量缓存的最大条目数，超出后按最近最少使用淘汰。"""
+    try:
+        return max(1, int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "200000")))
+    except ValueError:
+        return 200000
+
+def get_batch_token_budget() -> int:
+    """从 .env 文件读取文档向量化时单个批次的 token 预算（按补齐后的长度计算）。"""
+    try:
+        return max(1, int(os.getenv("EMBED_BATCH_TOKEN_BUDGET", "16384")))
+    except ValueError:
+        return 16384
+
+def get_batch_max_size() -> int:
+    """从 .env 文件读取文档向量化时单个批次的最大条数。"""
+    try:
+        return max(1, int(os.getenv("EMBED_BATCH_MAX_SIZE", "64")))
+    except ValueError:
+        return 64
+
+def get_embedding_pool_workers() -> int:
+    """从 .env 文件读取嵌入工作池的进程数，0 表示不启用工作池（默认）。"""
+    try:
+        return max(0, int(os.getenv("EMBED_POOL_WORKERS", "0")))
+    except ValueError:
+        return 0
+
+def get_embedding_pool_threads_per_worker() -> int:
+    """从 .env 文件读取每个工作进程的 torch 线程数，未设置时按 CPU 核心数平均分配。"""
+    workers = max(1, get_embedding_pool_workers())
+    default_threads = max(1, (os.cpu_count() or 1) // workers)
+    try:
+        return max(1, int(os.getenv("EMBED_POOL_THREADS_PER_WORKER", str(default_threads))))
+    except ValueError:
+        return default_threads
+
+# 支持的推理后端：
+#   torch      - 原始 fp32 SentenceTransformer（默认）
+#   torch-int8 - 对 Linear 层做 PyTorch 动态 int8 量化
+#   onnx       - 导出为 ONNX 并通过 onnxruntime 推理
+#   onnx-int8  - 在 ONNX 基础上做动态 int8 量化
+SUPPORTED_INFERENCE_BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+
+def get_inference_backend() -> str:
+    """从 .env 文件读取嵌入模型的推理后端，未知取值回退到 torch。"""
+    backend = os.getenv("EMBED_INFERENCE_BACKEND", "torch").strip().lower()
+    return backend if backend in SUPPORTED_INFERENCE_BACKENDS else "torch"
+
+def get_output_dim() -> int | None:
+    """
+    从 .env 文件读取输出向量维度。Qwen3-Embedding 等 Matryoshka 模型的前 N 维即可独立使用，
+    截断后会重新归一化。未设置或为 0 时保留模型的完整维度。
+    """
+    try:
+        dim = int(os.getenv("EMBED_OUTPUT_DIM", "0"))
+    except ValueError:
+        return None
+    return dim if dim > 0 else None
+
+def get_inference_backend_identity(backend: str | None = None) -> str:
+    """推理后端及其量化配置的标识，例如 torch、torch-int8、onnx-int8:avx2。"""
+    backend = backend or get_inference_backend()
+    return f"{backend}:{_get_onnx_quantization_config()}" if backend == "onnx-int8" else backend
+
+def get_vector_precision() -> str:
+    """从 .env 文件读取向量精度（fp32 / fp16），用于输出向量与本地向量缓存的存储。"""
+    precision = os.getenv("EMBED_VECTOR_PRECISION", "fp32").strip().lower()
+    return precision if precision in ("fp32", "fp16") else "fp32"
+
 def get_custom_model_dir() -> str:
     """从 .env 文件读取并返回自定义模型存储目录。如果未设置，则返回 None。"""
     model_dir = os.getenv("CUSTOM_MODEL_DIR", "")
     return model_dir if model_dir.strip() != "" else None
 
-def _load_embedding_model_from_local():
+def get_onnx_export_dir(model_name: str) -> Path:
+    """返回模型 ONNX 导出产物的缓存目录，位于 Hugging Face 缓存目录旁。"""
+    return get_hf_cache_dir().parent / "local_mind_onnx" / model_name.replace("/", "--")
+
+def _get_onnx_quantization_config() -> str:
+    """按 CPU 架构选择 onnxruntime 动态量化配置。"""
+    machine = platform.machine().lower()
+    return "arm64" if machine in ("arm64", "aarch64") else "avx2"
+
+def _load_onnx_model(source: str, model_name: str, quantize: bool) -> SentenceTransformer:
     """
-    加载 .env 文件中指定的嵌入模型。
+    加载 ONNX 后端模型。首次使用时从本地模型导出 ONNX（及量化版本），之后直接复用缓存的产物。
+    """
+    from sentence_transformers import SentenceTransformer
+    export_dir = get_onnx_export_dir(model_name)
+    onnx_file = export_dir / "onnx" / "model.onnx"
+    if not onnx_file.exists():
+        exported = SentenceTransformer(source, backend="onnx", local_files_only=True)
+        exported.save_pretrained(str(export_dir))
+        del exported
+
+    if not quantize:
+        return SentenceTransformer(str(export_dir), backend="onnx", local_files_only=True)
+
+    quant_config = _get_onnx_quantization_config()
+    quant_file = f"onnx/model_qint8_{quant_config}.onnx"
+    if not (export_dir / quant_file).exists():
+        from sentence_transformers import export_dynamic_quantized_onnx_model
+        base = SentenceTransformer(str(export_dir), backend="onnx", local_files_only=True)
+        export_dynamic_quantized_onnx_model(base, quant_config, str(export_dir))
+        del base
+    return SentenceTransformer(
+        str(export_dir), backend="onnx", local_files_only=True, model_kwargs={"file_name": quant_file}
+    )
+
+def _instantiate_model(source: str, model_name: str, backend: str) -> SentenceTransformer:
+    """按指定推理后端实例化模型，source 为本地目录或 Hugging Face 仓库名。"""
+    if backend in ("onnx", "onnx-int8"):
+        return _load_onnx_model(source, model_name, quantize=(backend == "onnx-int8"))
+
+    from sentence_transformers import SentenceTransformer
+    model = SentenceTransformer(source, local_files_only=True)
+    if backend == "torch-int8":
+        import torch
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+def _load_embedding_model_from_local(model_name: str | None = None, backend: str | None = None):
+    """
+    加载指定的嵌入模型，未指定时加载 .env 文件中配置的模型。
     首先尝试从自定义目录加载，如果未找到或未设置自定义目录，则尝试从本地文件加载。
+    推理后端由 EMBED_INFERENCE_BACKEND 决定，也可通过 backend 参数显式指定。
     """
-    model_name = get_active_model_name()
+    model_name = model_name or get_active_model_name()
+    backend = backend or get_inference_backend()
     custom_model_dir = get_custom_model_dir()
     
     pass  # [自动清理] 已移除输出语句
@@ -94,7 +327,7 @@ def _load_embedding_model_from_local():
         if os.path.exists(custom_model_path):
             pass  # [自动清理] 已移除输出语句
             try:
-                model = SentenceTransformer(custom_model_path, local_files_only=True)
+                model = _instantiate_model(custom_model_path, model_name, backend)
                 pass  # [自动清理] 已移除输出语句
                 return model
             except Exception as e:
@@ -103,7 +336,7 @@ def _load_embedding_model_from_local():
     
     # 如果自定义目录加载失败或未设置自定义目录，尝试从HuggingFace缓存加载
     try:
-        model = SentenceTransformer(model_name, local_files_only=True)
+        model = _instantiate_model(model_name, model_name, backend)
         pass  # [自动清理] 已移除输出语句
         return model
     except OSError:
@@ -120,9 +353,15 @@ def _load_embedding_model_from_local():
 
 def initialize_global_model():
     """加载嵌入模型并将其存储在全局变量中。此函数应在应用启动时调用。"""
-    global embedding_model_instance
+    global embedding_model_instance, embedding_model_name, embedding_model_backend
     if embedding_model_instance is None:
-        embedding_model_instance = _load_embedding_model_from_local()
+        model_name = get_active_model_name()
+        backend = get_inference_backend()
+        model = _load_embedding_model_from_local(model_name, backend=backend)
+        with _model_condition:
+            embedding_model_instance = model
+            embedding_model_name = model_name
+            embedding_model_backend = get_inference_backend_identity(backend)
     else:
         pass  # [自动清理] 已移除输出语句
 
@@ -132,6 +371,117 @@ def get_embedding_model():
         raise RuntimeError("模型尚未在应用启动时初始化，请检查 main.py 中的 lifespan 配置。")
     return embedding_model_instance
 
+# 记录每个模型实例上正在进行的编码请求数，热切换后据此等待旧模型上的请求完成
+_model_condition = threading.Condition()
+_in_flight_requests = {}
+
+@contextmanager
+def lease_embedding_model(model: SentenceTransformer | None = None):
+    """
+    在一次编码期间持有模型实例。
+    未指定模型时取当前全局实例；热切换只会替换全局指针，已持有旧实例的请求仍在旧模型上完成。
+    """
+    with _model_condition:
+        target = model if model is not None else get_embedding_model()
+        _in_flight_requests[id(target)] = _in_flight_requests.get(id(target), 0) + 1
+    try:
+        yield target
+    finally:
+        with _model_condition:
+            remaining = _in_flight_requests.get(id(target), 1) - 1
+            if remaining <= 0:
+                _in_flight_requests.pop(id(target), None)
+                _model_condition.notify_all()
+            else:
+                _in_flight_requests[id(target)] = remaining
+
+def get_active_name_for_model(model: SentenceTransformer) -> str | None:
+    """
+    返回模型实例对应的激活模型名称；模型已不是（或从来不是）全局实例时返回 None。
+    向量缓存与工作池只服务激活模型，调用方据此决定能否使用它们。
+    """
+    with _model_condition:
+        return embedding_model_name if model is embedding_model_instance else None
+
+# 模型热切换进度（同一时间只有一个切换任务，统一使用 MODEL_SWAP_KEY）
+model_swap_publisher = ProgressPublisher()
+MODEL_SWAP_KEY = "active"
+_model_swap_lock = threading.Lock()
+
+# 热切换时用于预热新模型的样例文本
+_WARMUP_TEXTS = [
+    "warm up",
+    "本地知识库语义检索预热文本。",
+    "Local Mind embeds document chunks and queries into the same vector space for semantic search.",
+]
+
+def get_model_swap_progress() -> dict:
+    """获取当前（或最近一次）模型热切换的进度"""
+    return model_swap_publisher.get(MODEL_SWAP_KEY, {'status': 'idle', 'progress': 0, 'model_name': None})
+
+def swap_active_model(model_name: str, on_swapped=None, drain_timeout: float = 60.0):
+    """
+    在不重启后端的情况下切换激活的嵌入模型。
+    新模型在后台线程中加载并预热，期间旧模型继续提供服务；
+    就绪后原子地替换全局模型指针并写入 .env，然后等待旧模型上的请求完成再释放它。
+
+    Args:
+        model_name: 要切换到的模型名称
+        on_swapped: 指针替换完成后的回调，参数为新模型实例
+        drain_timeout: 等待旧模型请求完成的最长时间（秒）
+
+    Raises:
+        ValueError: 如果模型名称不受支持。
+        RuntimeError: 如果已有切换任务正在进行。
+    """
+    supported_names = [m['name'] for m in get_local_supported_models()]
+    if model_name not in supported_names:
+        raise ValueError(f"不支持的模型: {model_name}。请先下载该模型或检查模型名称是否正确。")
+    if not _model_swap_lock.acquire(blocking=False):
+        raise RuntimeError("已有模型切换任务正在进行，请稍后再试。")
+
+    model_swap_publisher.publish(MODEL_SWAP_KEY, {'status': 'loading', 'progress': 0, 'model_name': model_name})
+
+    def _do_swap():
+        global embedding_model_instance, embedding_model_name, embedding_model_backend
+        try:
+            backend = get_inference_backend()
+            new_model = _load_embedding_model_from_local(model_name, backend=backend)
+            model_swap_publisher.update(MODEL_SWAP_KEY, status='warming_up', progress=50)
+            new_model.encode(_WARMUP_TEXTS)
+
+            model_swap_publisher.update(MODEL_SWAP_KEY, status='switching', progress=80)
+            # 先持久化到 .env；get_active_model_name 以内存中的名称为准，随后与模型实例一起切换
+            update_active_model(model_name)
+            with _model_condition:
+                old_model = embedding_model_instance
+                embedding_model_instance = new_model
+                embedding_model_name = model_name
+                embedding_model_backend = get_inference_backend_identity(backend)
+            if on_swapped is not None:
+                on_swapped(new_model)
+
+            if old_model is not None and old_model is not new_model:
+                model_swap_publisher.update(MODEL_SWAP_KEY, status='draining', progress=90)
+                with _model_condition:
+                    drained = _model_condition.wait_for(lambda: id(old_model) not in _in_flight_requests,
+                                                        timeout=drain_timeout)
+                release_query_batcher(old_model)
+                if drained:
+                    # 旧模型上已没有请求，替换下来的向量缓存与工作池不会再被使用
+                    release_retired_embedding_resources()
+                del old_model
+                gc.collect()
+
+            model_swap_publisher.update(MODEL_SWAP_KEY, status='completed', progress=100)
+        except Exception as e:
+            model_swap_publisher.update(MODEL_SWAP_KEY, status='error', progress=0, error=str(e))
+        finally:
+            _model_swap_lock.release()
+
+    swap_thread = threading.Thread(target=_do_swap, name="model-hot-swap", daemon=True)
+    swap_thread.start()
+
 def update_active_model(model_name: str) -> bool:
     """
     更新 .env 文件中的 ACTIVE_MODEL_NAME。
@@ -173,97 +523,174 @@ def update_active_model(model_name: str) -> bool:
 
     with open(ENV_PATH, 'w', encoding='utf-8') as f:
         f.writelines(new_lines)
+
+    # 同步到进程环境变量，使 get_active_model_name 立即返回新值
+    os.environ["ACTIVE_MODEL_NAME"] = model_name
     
     return True
 
-def get_folder_size(path: str) -> int:
-    """计算文件夹总大小"""
-    total = 0
-    if os.path.exists(path):
-        for root, dirs, files in os.walk(path):
-            for f in files:
-                fp = os.path.join(root, f)
-                if os.path.exists(fp):
-                    total += os.path.getsize(fp)
-    return total
+# 单个模型下载时并行下载的文件数
+_DOWNLOAD_MAX_WORKERS = 4
+
+# 下载线程的上下文：hf_hub_download 在调用线程中执行，进度回调据此找到对应的模型和文件
+_download_context = threading.local()
+_hf_progress_hook_lock = threading.Lock()
+_hf_progress_tqdm_class = None
+_hf_progress_mode = None
+
+def _make_callback_tqdm(base_tqdm):
+    """基于 base_tqdm 创建把每次写入的字节数回调给当前线程下载跟踪器的 tqdm 子类。"""
+
+    class _CallbackTqdm(base_tqdm):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self._lm_tracker = getattr(_download_context, "tracker", None)
+            self._lm_filename = getattr(_download_context, "filename", None)
+            if self._lm_tracker is not None and kwargs.get("initial"):
+                # 断点续传时已下载的部分
+                self._lm_tracker.add_bytes(self._lm_filename, kwargs["initial"])
+
+        def update(self, n=1):
+            result = super().update(n)
+            if self._lm_tracker is not None and n:
+                self._lm_tracker.add_bytes(self._lm_filename, n)
+            return result
+
+    return _CallbackTqdm
+
+def _install_hf_progress_hook():
+    """
+    准备字节级下载进度回调，返回应传给 hf_hub_download 的 tqdm_class（无需传入时为 None）。
+    新版 huggingface_hub 的 hf_hub_download 接受 tqdm_class 参数，进度条均由 huggingface_hub.utils.tqdm 派生；
+    旧版只能替换 file_download 模块中的 tqdm。两者都不可用时记录日志，退化为按文件完成粒度上报进度。
+    """
+    global _hf_progress_tqdm_class, _hf_progress_mode
+    with _hf_progress_hook_lock:
+        if _hf_progress_mode is not None:
+            return _hf_progress_tqdm_class
+        import inspect
+        from huggingface_hub import file_download, hf_hub_download
+        from huggingface_hub.utils import tqdm as hf_tqdm
+        if "tqdm_class" in inspect.signature(hf_hub_download).parameters:
+            _hf_progress_tqdm_class = _make_callback_tqdm(hf_tqdm)
+            _hf_progress_mode = "tqdm_class"
+        elif isinstance(getattr(file_download, "tqdm", None), type):
+            file_download.tqdm = _make_callback_tqdm(file_download.tqdm)
+            _hf_progress_mode = "module_patch"
+        else:
+            _hf_progress_mode = "per_file"
+            logger.warning("当前 huggingface_hub 版本不支持字节级下载进度回调，模型下载进度将按文件完成粒度上报。")
+        return _hf_progress_tqdm_class
+
+
+class _DownloadTracker:
+    """汇总单个模型各文件的字节级进度，并节流地发布到 download_publisher。"""
+
+    def __init__(self, model_name: str, file_sizes: dict, publish_interval: float = 0.25):
+        self.model_name = model_name
+        self.files = {name: {'downloaded': 0, 'total': size, 'status': 'pending'} for name, size in file_sizes.items()}
+        self.total_bytes = sum(file_sizes.values())
+        self.publish_interval = publish_interval
+        self._lock = threading.Lock()
+        self._last_publish = 0.0
+        self._last_progress = -1
+
+    def add_bytes(self, filename: str, n: int):
+        with self._lock:
+            entry = self.files.setdefault(filename, {'downloaded': 0, 'total': 0, 'status': 'pending'})
+            entry['downloaded'] += n
+            entry['status'] = 'downloading'
+            self._maybe_publish()
+
+    def file_done(self, filename: str):
+        with self._lock:
+            entry = self.files.setdefault(filename, {'downloaded': 0, 'total': 0, 'status': 'pending'})
+            entry['downloaded'] = max(entry['downloaded'], entry['total'])
+            entry['status'] = 'completed'
+            self._maybe_publish(force=True)
+
+    def _progress(self) -> int:
+        if self.total_bytes > 0:
+            downloaded = sum(min(f['downloaded'], f['total'] or f['downloaded']) for f in self.files.values())
+            return int(min(99, downloaded / self.total_bytes * 100))
+        done = sum(1 for f in self.files.values() if f['status'] == 'completed')
+        return int(min(99, done / max(1, len(self.files)) * 100))
+
+    def _maybe_publish(self, force: bool = False):
+        progress = self._progress()
+        now = time.monotonic()
+        if not force and progress == self._last_progress and now - self._last_publish < self.publish_interval:
+            return
+        self._last_progress = progress
+        self._last_publish = now
+        download_publisher.publish(self.model_name, self.snapshot(progress))
+
+    def snapshot(self, progress: int | None = None) -> dict:
+        return {
+            'model_name': self.model_name,
+            'progress': self._progress() if progress is None else progress,
+            'status': 'downloading',
+            'downloaded_bytes': sum(f['downloaded'] for f in self.files.values()),
+            'total_bytes': self.total_bytes,
+            'files': {name: dict(entry) for name, entry in self.files.items()},
+        }
+
 
 def download_model_from_hub(model_name: str, use_custom_dir: bool = False):
     """
     从 Hugging Face Hub 下载模型。
+    按文件并行调用 hf_hub_download，下载进度由字节级回调推送给订阅者，不再轮询下载目录。
     
     Args:
         model_name: 要下载的模型名称
         use_custom_dir: 是否下载到自定义目录，默认为 False（下载到HuggingFace缓存）
     """
+    current = download_publisher.get(model_name)
+    if current is not None and current.get('status') == 'downloading':
+        # 同一模型已有下载任务在进行
+        return
+
     # 初始化进度跟踪
-    download_progress[model_name] = {'progress': 0, 'status': 'downloading'}
+    download_publisher.publish(model_name, {'model_name': model_name, 'progress': 0, 'status': 'downloading', 'files': {}})
     
     def _download_with_progress():
 
         try:
+            from huggingface_hub import HfApi, hf_hub_download
             pass  # [自动清理] 已移除输出语句
 
-            # 使用 model_size_utils 中的方法获取模型大小
-            total_size, success = get_model_size_with_fs(model_name)
-            if success and total_size > 0:
-                pass  # [自动清理] 已移除输出语句
-            else:
-                pass  # [自动清理] 已移除输出语句
-                total_size = None
+            # 获取仓库文件列表及各文件大小
+            info = HfApi().model_info(model_name, files_metadata=True)
+            file_sizes = {s.rfilename: (getattr(s, "size", None) or 0) for s in (info.siblings or [])}
+            tracker = _DownloadTracker(model_name, file_sizes)
+            download_publisher.publish(model_name, tracker.snapshot(0))
+            tqdm_class = _install_hf_progress_hook()
+            download_kwargs = {"tqdm_class": tqdm_class} if tqdm_class is not None else {}
 
-            # 根据模型名称计算预期的下载路径
-            expected_path = os.path.join(os.path.expanduser("~/.cache/huggingface/hub"), f"models--{model_name.replace('/', '--')}")
+            def _download_file(filename: str):
+                _download_context.tracker = tracker
+                _download_context.filename = filename
+                try:
+                    hf_hub_download(repo_id=model_name, filename=filename, **download_kwargs)
+                finally:
+                    _download_context.tracker = None
+                    _download_context.filename = None
+                tracker.file_done(filename)
 
-            # 在一个线程中执行下载
-            def do_download():
-                pass  # [自动清理] 已移除输出语句
-                snapshot_download(
-                    repo_id=model_name,
-                    resume_download=True
-                )
-
-            # 启动下载线程
-            download_thread = threading.Thread(target=do_download)
-            download_thread.start()
-
-            # 在主线程中轮询已下载大小
-            last_known_size = 0
-            while download_thread.is_alive():
-                # 计算当前已下载的大小
-                current_size = get_folder_size(expected_path)
-                
-                # 更新已知大小
-                if current_size > last_known_size:
-                    last_known_size = current_size
-                
-                # 计算进度百分比
-                if total_size and total_size > 0:
-                    progress_percent = min(99.9, (current_size / total_size) * 100)
-                    download_progress[model_name]['progress'] = int(progress_percent)  # 取整
-                else:
-                    # 如果无法获取总大小，则使用本地扫描方法估算进度
-                    # 由于我们不知道总大小，使用模拟进度，但会参考已知的下载大小
-                    if current_size > 0:
-                        # 假设模型大小为1.21GB作为估算基准（Qwen/Qwen3-Embedding-0.6B的实际大小）
-                        estimated_total_size = 1.21 * 1024 * 1024 * 1024  # 1.21GB in bytes
-                        progress_percent = (current_size / estimated_total_size) * 100
-                        if progress_percent <= 100:
-                            download_progress[model_name]['progress'] = int(min(progress_percent, 99.9))  # 取整
-                        else:
-                            download_progress[model_name]['progress'] = 99
-                
-                time.sleep(0.5)  # 每0.5秒更新一次进度
+            with ThreadPoolExecutor(max_workers=_DOWNLOAD_MAX_WORKERS) as executor:
+                list(executor.map(_download_file, file_sizes))
 
             # 下载完成后将进度更新为100%
-            download_progress[model_name]['progress'] = 100
-            download_progress[model_name]['status'] = 'completed'
+            state = tracker.snapshot(100)
+            state['status'] = 'completed'
+            download_publisher.publish(model_name, state)
             pass  # [自动清理] 已移除输出语句
             
             # 在模型下载完成后，刷新支持的模型列表
             refresh_supported_models()
             
         except Exception as e:
-            download_progress[model_name] = {'progress': 0, 'status': 'error', 'error': str(e)}
+            download_publisher.publish(model_name, {'model_name': model_name, 'progress': 0, 'status': 'error', 'error': str(e)})
             pass  # [自动清理] 已移除输出语句
             raise
 
@@ -274,18 +701,17 @@ def download_model_from_hub(model_name: str, use_custom_dir: bool = False):
 
 def get_download_progress(model_name: str):
     """获取指定模型的下载进度"""
-    return download_progress.get(model_name, {'progress': 0, 'status': 'not_found'})
+    return download_publisher.get(model_name, {'progress': 0, 'status': 'not_found'})
 
 
 # 从 model_size_utils.py 引入的函数
-from huggingface_hub import HfFileSystem, HfApi
-
 def get_model_size_with_fs(model_name: str, token: str | None = None):
     """
     使用 HfFileSystem 获取模型大小。
     model_name 示例: "Qwen/Qwen3-Embedding-0.6B"
     如果仓库受限，请传入 huggingface 访问 token。
     """
+    from huggingface_hub import HfFileSystem, HfApi
     # 1) 优先用 HfFileSystem（fsspec 接口）
     fs = HfFileSystem(token=token) if token else HfFileSystem()
     path = f"hf://{model_name}"  # models 不加前缀，直接放在 hf:// 后面
@@ -317,14 +743,567 @@ def get_model_size_with_fs(model_name: str, token: str | None = None):
             return 0, False
 
 
-class CustomEmbeddingFunction(Embeddings):
-    def __init__(self, model: SentenceTransformer):
+def postprocess_embeddings(vectors, output_dim: int | None = None, precision: str | None = None) -> np.ndarray:
+    """
+    按配置对模型输出做后处理：Matryoshka 维度截断、截断后重新 L2 归一化、转换存储精度。
+    接受一维（单条）或二维（多条）向量。
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    single = vectors.ndim == 1
+    if single:
+        vectors = vectors.reshape(1, -1)
+
+    output_dim = output_dim if output_dim is not None else get_output_dim()
+    if output_dim and output_dim < vectors.shape[1]:
+        vectors = vectors[:, :output_dim]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.maximum(norms, 1e-12)
+
+    if (precision or get_vector_precision()) == "fp16":
+        vectors = vectors.astype(np.float16)
+    return vectors[0] if single else vectors
+
+def evaluate_dimension_recall(model: SentenceTransformer, documents: List[str], queries: List[str],
+                              dims: List[int] | None = None, k: int = 10) -> List[dict]:
+    """
+    评估不同输出维度与精度下的检索召回率。
+    以完整维度 fp32 向量的精确 top-k 结果为基准，计算每种配置的 recall@k，并给出每条向量的存储字节数。
+    """
+    doc_vectors = np.asarray(encode_length_bucketed(model, documents), dtype=np.float32)
+    query_vectors = np.asarray(model.encode(queries), dtype=np.float32)
+    full_dim = doc_vectors.shape[1]
+    k = min(k, len(documents))
+
+    def _top_k(docs, qs):
+        docs = docs / np.maximum(np.linalg.norm(docs, axis=1, keepdims=True), 1e-12)
+        qs = qs / np.maximum(np.linalg.norm(qs, axis=1, keepdims=True), 1e-12)
+        scores = qs @ docs.T
+        return np.argpartition(-scores, k - 1, axis=1)[:, :k]
+
+    truth = _top_k(doc_vectors, query_vectors)
+    candidates = dims or [d for d in (32, 64, 128, 256, 512, 768, 1024, 2048, 4096) if d < full_dim]
+    results = []
+    for dim in sorted(set(candidates + [full_dim])):
+        for precision in ("fp32", "fp16"):
+            docs = postprocess_embeddings(doc_vectors, dim, precision).astype(np.float32)
+            qs = postprocess_embeddings(query_vectors, dim, precision).astype(np.float32)
+            found = _top_k(docs, qs)
+            hits = sum(len(set(found[i]) & set(truth[i])) for i in range(len(queries)))
+            results.append({
+                "dim": dim,
+                "precision": precision,
+                f"recall@{k}": round(hits / (len(queries) * k), 4),
+                "bytes_per_vector": dim * (2 if precision == "fp16" else 4),
+            })
+    return results
+
+def estimate_token_lengths(model: SentenceTransformer, texts: List[str]) -> List[int]:
+    """
+    估算每条文本在模型中的 token 长度（已按 max_seq_length 截断）。
+    模型没有可用的分词器时，按每 4 个字符约 1 个 token 粗略估计。
+    """
+    max_len = getattr(model, "max_seq_length", None) or 512
+    tokenizer = getattr(model, "tokenizer", None)
+    if tokenizer is not None:
+        try:
+            encoded = tokenizer(texts, add_special_tokens=True, truncation=True, max_length=max_len)
+            return [len(ids) for ids in encoded["input_ids"]]
+        except Exception:
+            pass
+    return [min(max_len, max(1, len(t) // 4)) for t in texts]
+
+def plan_length_buckets(lengths: List[int], token_budget: int, max_batch_size: int) -> List[List[int]]:
+    """
+    按 token 长度规划批次。
+    先将文本按长度升序排列，再依次装入批次；批次的代价按 "最长文本长度 × 条数"（即补齐后的 token 数）计算，
+    超出预算或达到最大条数时开启新批次。返回每个批次包含的原始下标。
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    buckets = []
+    current = []
+    for i in order:
+        # 升序遍历，新加入的文本就是当前批次中最长的
+        padded_cost = max(1, lengths[i]) * (len(current) + 1)
+        if current and (padded_cost > token_budget or len(current) >= max_batch_size):
+            buckets.append(current)
+            current = []
+        current.append(i)
+    if current:
+        buckets.append(current)
+    return buckets
+
+def encode_length_bucketed(model: SentenceTransformer, texts: List[str],
+                           token_budget: int | None = None, max_batch_size: int | None = None) -> np.ndarray:
+    """
+    按长度分桶后编码文本，返回与输入顺序一致的向量矩阵。
+    长短文本分开成批，短文本不会被同批中的长文本补齐到同一长度，从而减少无效计算。
+    """
+    if not texts:
+        return np.empty((0, 0), dtype=np.float32)
+    token_budget = token_budget or get_batch_token_budget()
+    max_batch_size = max_batch_size or get_batch_max_size()
+
+    lengths = estimate_token_lengths(model, texts)
+    buckets = plan_length_buckets(lengths, token_budget, max_batch_size)
+
+    output = None
+    for bucket in buckets:
+        vectors = model.encode([texts[i] for i in bucket], batch_size=len(bucket))
+        if output is None:
+            output = np.empty((len(texts), vectors.shape[1]), dtype=vectors.dtype)
+        output[bucket] = vectors
+    return output
+
+def benchmark_length_bucketing(model: SentenceTransformer, texts: List[str], repeats: int = 3) -> dict:
+    """
+    比较默认编码路径（按原顺序整体交给 encode）与长度分桶路径的耗时，并校验两者结果一致。
+    """
+    def _best_of(fn):
+        best = None
+        result = None
+        for _ in range(repeats):
+            start = time.perf_counter()
+            result = fn()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best, result
+
+    baseline_time, baseline = _best_of(lambda: model.encode(texts))
+    bucketed_time, bucketed = _best_of(lambda: encode_length_bucketed(model, texts))
+
+    cosine = np.sum(baseline * bucketed, axis=1) / (
+        np.linalg.norm(baseline, axis=1) * np.linalg.norm(bucketed, axis=1) + 1e-12
+    )
+    return {
+        "num_texts": len(texts),
+        "baseline_seconds": round(baseline_time, 4),
+        "bucketed_seconds": round(bucketed_time, 4),
+        "speedup": round(baseline_time / bucketed_time, 2) if bucketed_time > 0 else None,
+        "min_cosine_similarity": float(cosine.min()),
+    }
+
+
+def check_backend_parity(texts: List[str], backend: str, model_name: str | None = None) -> dict:
+    """
+    校验指定推理后端与 fp32 torch 路径的一致性：逐条计算两者输出向量的余弦相似度。
+    """
+    reference = _load_embedding_model_from_local(model_name, backend="torch")
+    candidate = _load_embedding_model_from_local(model_name, backend=backend)
+    expected = np.asarray(reference.encode(texts), dtype=np.float32)
+    actual = np.asarray(candidate.encode(texts), dtype=np.float32)
+    cosine = np.sum(expected * actual, axis=1) / (
+        np.linalg.norm(expected, axis=1) * np.linalg.norm(actual, axis=1) + 1e-12
+    )
+    return {
+        "backend": backend,
+        "num_texts": len(texts),
+        "min_cosine_similarity": float(cosine.min()),
+        "mean_cosine_similarity": float(cosine.mean()),
+    }
+
+def benchmark_inference_backends(texts: List[str], backends: List[str] | None = None,
+                                 model_name: str | None = None, repeats: int = 3) -> List[dict]:
+    """对比各推理后端编码同一批文本的吞吐量（条/秒）。"""
+    results = []
+    for backend in backends or list(SUPPORTED_INFERENCE_BACKENDS):
+        try:
+            model = _load_embedding_model_from_local(model_name, backend=backend)
+        except Exception as e:
+            results.append({"backend": backend, "error": str(e)})
+            continue
+        model.encode(texts[:8])  # 预热
+        best = None
+        for _ in range(repeats):
+            start = time.perf_counter()
+            encode_length_bucketed(model, texts)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results.append({
+            "backend": backend,
+            "seconds": round(best, 4),
+            "texts_per_second": round(len(texts) / best, 2) if best > 0 else None,
+        })
+        del model
+        gc.collect()
+    return results
+
+
+class QueryMicroBatcher:
+    """
+    查询向量化的微批处理器。
+    在一个很短的时间窗口内收集并发到达的查询，合并为一次 encode 调用，
+    再把每一行向量分发回对应的调用方，避免并发搜索时模型执行大量 batch=1 的前向计算。
+    """
+
+    def __init__(self, model: SentenceTransformer, window_ms: float | None = None, max_batch_size: int | None = None):
         self.model = model
+        self.window = (get_query_batch_window_ms() if window_ms is None else window_ms) / 1000.0
+        self.max_batch_size = max_batch_size or get_query_batch_max_size()
+
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self._closed = False
+
+        # 指标：批大小分布、排队延迟、编码耗时
+        self._stats_lock = threading.Lock()
+        self._batch_size_counts = Counter()
+        self._queue_delays = deque(maxlen=1000)
+        self._encode_times = deque(maxlen=1000)
+        self._total_queries = 0
+        self._total_batches = 0
+
+    def embed(self, text: str):
+        """
+        提交一条查询并阻塞等待其向量（numpy 一维数组）。
+        处理器已关闭时（例如模型切换后仍有请求到达）直接对这条查询单独编码，不再入队。
+        """
+        future = None
+        # 入队与 close() 的关闭标记在同一把锁下检查，保证不会在停止标记之后入队
+        with self._worker_lock:
+            if not self._closed:
+                self._ensure_worker_locked()
+                future = Future()
+                self._queue.put((text, time.perf_counter(), future))
+        if future is None:
+            return self.model.encode([text])[0]
+        return future.result()
+
+    def close(self):
+        """停止后台线程，已入队的查询会在退出前被处理完；仍未处理的查询以异常结束，调用方不会永久阻塞。"""
+        with self._worker_lock:
+            self._closed = True
+            worker = self._worker
+            self._worker = None
+            if worker is not None and worker.is_alive():
+                self._queue.put(None)
+        if worker is not None:
+            worker.join()
+        self._fail_pending(RuntimeError("查询微批处理器已关闭。"))
+
+    def _fail_pending(self, error: Exception):
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not None and not item[2].done():
+                item[2].set_exception(error)
+
+    def _ensure_worker_locked(self):
+        # 调用方需持有 _worker_lock
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name="query-micro-batcher", daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.perf_counter() + self.window
+            # 在窗口内继续收集，直到超时或批次已满
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    next_item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if next_item is None:
+                    stop = True
+                    break
+                batch.append(next_item)
+            self._process_batch(batch)
+
+    def _process_batch(self, batch):
+        dequeued_at = time.perf_counter()
+        texts = [text for text, _, _ in batch]
+        try:
+            vectors = self.model.encode(texts)
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        encode_time = time.perf_counter() - dequeued_at
+
+        with self._stats_lock:
+            self._total_batches += 1
+            self._total_queries += len(batch)
+            self._batch_size_counts[len(batch)] += 1
+            self._encode_times.append(encode_time)
+            for _, enqueued_at, _ in batch:
+                self._queue_delays.append(dequeued_at - enqueued_at)
+
+        for i, (_, _, future) in enumerate(batch):
+            future.set_result(vectors[i])
+
+    def get_stats(self) -> dict:
+        """返回批大小分布与排队延迟等统计信息（时间单位为毫秒）。"""
+        with self._stats_lock:
+            delays = sorted(self._queue_delays)
+            encode_times = list(self._encode_times)
+            return {
+                "window_ms": round(self.window * 1000, 3),
+                "max_batch_size": self.max_batch_size,
+                "total_queries": self._total_queries,
+                "total_batches": self._total_batches,
+                "avg_batch_size": round(self._total_queries / self._total_batches, 2) if self._total_batches else 0.0,
+                "batch_size_distribution": dict(sorted(self._batch_size_counts.items())),
+                "avg_queue_delay_ms": round(sum(delays) / len(delays) * 1000, 3) if delays else 0.0,
+                "p95_queue_delay_ms": round(delays[int(0.95 * (len(delays) - 1))] * 1000, 3) if delays else 0.0,
+                "avg_encode_time_ms": round(sum(encode_times) / len(encode_times) * 1000, 3) if encode_times else 0.0,
+            }
+
+
+# 每个模型实例共享一个微批处理器，保证所有 CustomEmbeddingFunction 的查询汇入同一个批次
+_query_batchers = {}
+_query_batchers_lock = threading.Lock()
+
+def get_query_batcher(model: SentenceTransformer) -> QueryMicroBatcher | None:
+    """
+    获取（或创建）指定模型的查询微批处理器。窗口配置为 0 时返回 None，即不启用微批处理。
+    只为当前激活模型提供批处理器：热切换后仍持有旧模型的迟到请求得到 None 并直接编码，
+    不会为旧模型重建批处理线程而使其无法释放。
+    """
+    if get_query_batch_window_ms() <= 0:
+        return None
+    with _query_batchers_lock:
+        # 指针替换先于 release_query_batcher，在锁内检查可保证释放之后不会再为旧模型创建
+        if get_active_name_for_model(model) is None:
+            return None
+        batcher = _query_batchers.get(id(model))
+        if batcher is None or batcher.model is not model:
+            batcher = QueryMicroBatcher(model)
+            _query_batchers[id(model)] = batcher
+        return batcher
+
+def release_query_batcher(model: SentenceTransformer):
+    """关闭并移除指定模型的查询微批处理器。"""
+    with _query_batchers_lock:
+        batcher = _query_batchers.pop(id(model), None)
+    if batcher is not None:
+        batcher.close()
+
+def get_query_batcher_stats() -> list:
+    """返回所有查询微批处理器的统计信息。"""
+    with _query_batchers_lock:
+        batchers = list(_query_batchers.values())
+    return [batcher.get_stats() for batcher in batchers]
+
+
+# 当前激活模型对应的持久化向量缓存
+_embedding_cache = None
+_embedding_cache_lock = threading.Lock()
+
+# 被替换下来、可能仍有请求在使用的向量缓存与工作池，等旧模型上的请求完成后再关闭
+_retired_embedding_resources = []
+
+def release_retired_embedding_resources():
+    """关闭已被替换的向量缓存并停止已被替换的工作池。"""
+    with _embedding_cache_lock, _embedding_pool_lock:
+        retired = list(_retired_embedding_resources)
+        _retired_embedding_resources.clear()
+    for release in retired:
+        try:
+            release()
+        except Exception:
+            pass
+
+def get_embedding_cache(model_name: str | None = None):
+    """
+    获取指定模型（默认为当前激活模型）的向量缓存实例。
+    激活模型、推理后端（含量化方式）或存储精度变化时会重新打开缓存，旧向量随之作废；
+    被替换的缓存在旧模型的请求完成后才关闭。
+    model_name 不是当前激活模型（请求持有的是已被替换的旧模型）或缓存被禁用时返回 None。
+    """
+    global _embedding_cache
+    if not is_embedding_cache_enabled():
+        return None
+    model_name = model_name or get_active_model_name()
+    # 缓存保存模型的完整维度输出，维度截断在读取后进行；精度设置决定缓存的存储类型
+    dtype = "float16" if get_vector_precision() == "fp16" else "float32"
+    # 以激活模型实际加载时的后端为准；.env 中的设置要到下次加载模型才生效
+    backend = embedding_model_backend or get_inference_backend_identity()
+    with _embedding_cache_lock:
+        if model_name != get_active_model_name():
+            return None
+        if (_embedding_cache is None or _embedding_cache.model_name != model_name
+                or _embedding_cache.dtype.name != dtype or _embedding_cache.backend != backend):
+            from services.embedding_cache import EmbeddingCache
+            if _embedding_cache is not None:
+                _retired_embedding_resources.append(_embedding_cache.close)
+            _embedding_cache = EmbeddingCache(model_name, max_entries=get_embedding_cache_max_entries(), dtype=dtype,
+                                              backend=backend)
+        return _embedding_cache
+
+def get_embedding_cache_stats() -> dict | None:
+    """返回向量缓存的统计信息，缓存尚未打开时返回 None。"""
+    cache = _embedding_cache
+    return cache.get_stats() if cache is not None else None
+
+
+# 多进程嵌入工作池（按需启动）
+_embedding_pool = None
+_embedding_pool_lock = threading.Lock()
+
+def get_embedding_pool(model_name: str | None = None):
+    """
+    获取指定模型（默认为当前激活模型）的嵌入工作池，首次调用时启动工作进程。
+    EMBED_POOL_WORKERS 为 0 或 model_name 不是当前激活模型时返回 None；
+    激活模型变化时会重建工作池，旧工作池在旧模型的请求完成后才停止。
+    """
+    global _embedding_pool
+    num_workers = get_embedding_pool_workers()
+    if num_workers <= 0:
+        return None
+    model_name = model_name or get_active_model_name()
+    with _embedding_pool_lock:
+        if model_name != get_active_model_name():
+            return None
+        if _embedding_pool is not None and not _embedding_pool.is_alive():
+            # 工作进程已崩溃，不会再有请求能用上它
+            _embedding_pool.shutdown()
+            _embedding_pool = None
+        if _embedding_pool is not None and _embedding_pool.model_name != model_name:
+            _retired_embedding_resources.append(_embedding_pool.shutdown)
+            _embedding_pool = None
+        if _embedding_pool is None:
+            from services.embedding_pool import EmbeddingPool
+            pool = EmbeddingPool(model_name, num_workers, get_embedding_pool_threads_per_worker())
+            pool.start()
+            _embedding_pool = pool
+        return _embedding_pool
+
+def shutdown_embedding_pool():
+    """停止嵌入工作池，应在应用关闭时调用。"""
+    global _embedding_pool
+    with _embedding_pool_lock:
+        if _embedding_pool is not None:
+            _embedding_pool.shutdown()
+            _embedding_pool = None
+    release_retired_embedding_resources()
+
+# 进程退出时停止工作进程并释放共享内存段（应用的生命周期钩子位于已编译模块中，无法在其中注册）
+atexit.register(shutdown_embedding_pool)
+
+def get_embedding_pool_stats() -> dict | None:
+    """返回嵌入工作池的状态，未启用时返回 None。"""
+    pool = _embedding_pool
+    return pool.get_stats() if pool is not None else None
 
+
+class CustomEmbeddingFunction(Embeddings):
+    def __init__(self, model: SentenceTransformer | None = None, query_batcher: QueryMicroBatcher | None = None,
+                 use_pool: bool = True):
+        # 传入的是全局模型实例（或未传入）时始终跟随当前激活模型，热切换后无需重建本对象
+        self._pinned_model = None if model is None or model is embedding_model_instance else model
+        self._query_batcher = query_batcher
+        # 文档批量向量化是否允许交给多进程工作池（查询始终在本进程内完成）
+        self.use_pool = use_pool
+
+    @property
+    def model(self) -> SentenceTransformer:
+        return self._pinned_model if self._pinned_model is not None else get_embedding_model()
+
+    def _encode_documents(self, model: SentenceTransformer, texts: List[str], model_name: str | None) -> np.ndarray:
+        # 工作池和向量缓存都绑定激活模型，只有租用的正是全局模型时才能借用
+        pool = get_embedding_pool(model_name) if self.use_pool and model_name else None
+        if pool is not None:
+            return pool.encode(texts)
+        return encode_length_bucketed(model, texts)
+
+    # ------------------------------------------------------------------
+    # ndarray 接口：向量存储层可直接使用，不会为每个分量创建 Python float 对象
+    # ------------------------------------------------------------------
+    def embed_documents_array(self, texts: List[str]) -> np.ndarray:
+        """将文档编码为二维 ndarray（行顺序与输入一致），已完成维度截断与精度转换。"""
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        with lease_embedding_model(self._pinned_model) as model:
+            # 缓存与工作池按租用到的模型取得，而不是按此刻的激活模型名称
+            model_name = get_active_name_for_model(model)
+            cache = get_embedding_cache(model_name) if model_name else None
+            if cache is None:
+                return postprocess_embeddings(self._encode_documents(model, texts, model_name))
+
+            # 只对缓存未命中的文本调用模型，结果直接写入预分配的矩阵
+            cached = cache.get_many(texts)
+            missing = [i for i, vector in enumerate(cached) if vector is None]
+            encoded = None
+            if missing:
+                missing_texts = [texts[i] for i in missing]
+                encoded = self._encode_documents(model, missing_texts, model_name)
+                cache.put_many(missing_texts, encoded)
+
+            dim = encoded.shape[1] if encoded is not None else cached[0].shape[0]
+            vectors = np.empty((len(texts), dim), dtype=np.float32)
+            for i, vector in enumerate(cached):
+                if vector is not None:
+                    vectors[i] = vector
+            if encoded is not None:
+                vectors[missing] = encoded
+            return postprocess_embeddings(vectors)
+
+    def embed_query_array(self, text: str) -> np.ndarray:
+        """将单条查询编码为一维 ndarray。"""
+        with lease_embedding_model(self._pinned_model) as model:
+            batcher = self._query_batcher or get_query_batcher(model)
+            vector = model.encode(text) if batcher is None else batcher.embed(text)
+            return postprocess_embeddings(vector)
+
+    def embed_queries_array(self, texts: List[str]) -> np.ndarray:
+        """将多条查询在一次模型调用中编码为二维 ndarray。"""
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        with lease_embedding_model(self._pinned_model) as model:
+            return postprocess_embeddings(model.encode(list(texts)))
+
+    # ------------------------------------------------------------------
+    # LangChain Embeddings 接口
+    # ------------------------------------------------------------------
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        """Embed a list of documents."""
-        return self.model.encode(texts).tolist()
+        """
+        Embed a list of documents.
+        返回矩阵各行的 ndarray 视图而不是 Python float 列表：LangChain Chroma 只按行索引、原样转交给集合，
+        vector_ingest 的入库钩子再把它们合并为一个矩阵写入，整个入库过程不会为每个分量创建 float 对象。
+        """
+        if not texts:
+            return []
+        return list(self.embed_documents_array(texts))
 
     def embed_query(self, text: str) -> List[float]:
         """Embed a single query."""
-        return self.model.encode(text).tolist()
+        return self.embed_query_array(text).tolist()
+
+if __name__ == "__main__":
+    # 基准测试入口：
+    #   python -m services.EmbServ bucketing          长度分桶 vs 默认编码路径
+    #   python -m services.EmbServ backends           各推理后端的吞吐量与 fp32 一致性
+    #   python -m services.EmbServ dims               不同输出维度 / 精度下的 recall@10
+    import random
+    random.seed(0)
+    words = "local mind knowledge base semantic search embedding vector chunk document".split()
+    sample_texts = []
+    for _ in range(512):
+        # 大约 80% 的短块与 20% 的长块，模拟大小集合混合的语料
+        n_words = random.randint(10, 60) if random.random() < 0.8 else random.randint(300, 600)
+        sample_texts.append(" ".join(random.choice(words) for _ in range(n_words)))
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "bucketing"
+    if command == "backends":
+        for backend in SUPPORTED_INFERENCE_BACKENDS[1:]:
+            print(check_backend_parity(sample_texts[:64], backend))
+        for row in benchmark_inference_backends(sample_texts):
+            print(row)
+    elif command == "dims":
+        initialize_global_model()
+        sample_queries = [" ".join(random.choice(words) for _ in range(random.randint(3, 8))) for _ in range(64)]
+        for row in evaluate_dimension_recall(get_embedding_model(), sample_texts, sample_queries):
+            print(row)
+    else:
+        initialize_global_model()
+        print(benchmark_length_bucketing(get_embedding_model(), sample_texts))
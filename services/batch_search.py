@@ -0,0 +1,89 @@
+"""
+批量检索服务
+一次请求携带多条查询时，所有查询文本在一次模型调用中编码，
+过滤条件相同的查询合并为一次多查询 ANN 调用，避免逐条请求时重复的编码与检索开销。
+"""
+import json, time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from services.filter_utils import build_where_clause
+from services.mmr import strip_embedding
+from services.retrieval import dense_query, get_default_embedder
+from services.vector_ingest import get_raw_collection
+
+
+def batch_dense_search(collection, queries: List[str], n_results: List[int],
+                       filters: Optional[List[Optional[Dict[str, Any]]]] = None, embedder=None,
+                       query_embeddings: Optional[np.ndarray] = None,
+                       include_embeddings: Optional[List[bool]] = None) -> List[List[Dict[str, Any]]]:
+    """
+    批量执行向量检索。
+
+    Args:
+        collection: 检索的集合（chromadb Collection 或 LangChain Chroma）
+        queries: 查询文本列表
+        n_results: 每条查询返回的结果数
+        filters: 每条查询的过滤条件（SearchFilters 字典），可为 None
+        embedder: 嵌入函数，默认使用跟随激活模型的 CustomEmbeddingFunction
+        query_embeddings: 预先计算好的查询向量矩阵，提供时不再编码
+        include_embeddings: 每条查询的结果是否附带文本块向量（供 MMR 使用）
+
+    Returns:
+        与 queries 顺序一致的结果列表。
+    """
+    if not queries:
+        return []
+    filters = filters or [None] * len(queries)
+    include_embeddings = include_embeddings or [False] * len(queries)
+    raw = get_raw_collection(collection)
+    if query_embeddings is None:
+        query_embeddings = (embedder or get_default_embedder()).embed_queries_array(queries)
+    query_embeddings = np.asarray(query_embeddings, dtype=np.float32)
+
+    # Chroma 的一次多查询调用只能带一个 where 条件，因此按过滤条件分组
+    groups: Dict[str, List[int]] = {}
+    wheres: Dict[str, Optional[Dict[str, Any]]] = {}
+    for i, query_filters in enumerate(filters):
+        where = build_where_clause(query_filters) if query_filters else None
+        group_key = json.dumps(where, sort_keys=True)
+        groups.setdefault(group_key, []).append(i)
+        wheres[group_key] = where
+
+    results: List[List[Dict[str, Any]]] = [[] for _ in queries]
+    for group_key, indices in groups.items():
+        limit = max(n_results[i] for i in indices)
+        with_embeddings = any(include_embeddings[i] for i in indices)
+        group_results = dense_query(raw, query_embeddings[indices], limit, where=wheres[group_key],
+                                    include_embeddings=with_embeddings)
+        for i, query_results in zip(indices, group_results):
+            query_results = query_results[:n_results[i]]
+            if with_embeddings and not include_embeddings[i]:
+                query_results = [strip_embedding(r) for r in query_results]
+            results[i] = query_results
+    return results
+
+
+def benchmark_batch_search(collection, queries: List[str], n_results: int = 10, embedder=None) -> Dict[str, Any]:
+    """对比逐条检索与批量检索同一组查询的耗时。"""
+    embedder = embedder or get_default_embedder()
+    raw = get_raw_collection(collection)
+    # 预热，避免首次调用的模型初始化计入耗时
+    dense_query(raw, embedder.embed_query_array(queries[0]), n_results)
+
+    start_time = time.perf_counter()
+    for query in queries:
+        dense_query(raw, embedder.embed_query_array(query), n_results)
+    sequential = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    batch_dense_search(raw, queries, [n_results] * len(queries), embedder=embedder)
+    batched = time.perf_counter() - start_time
+
+    return {
+        "num_queries": len(queries),
+        "sequential_seconds": round(sequential, 4),
+        "batch_seconds": round(batched, 4),
+        "speedup": round(sequential / batched, 2) if batched > 0 else None,
+    }
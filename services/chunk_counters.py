@@ -0,0 +1,208 @@
+"""
+文本块计数服务
+在 SQLite 元数据库中维护每个集合、每个文件的文本块数量。
+计数由 services.vector_ingest 挂载在 chromadb 写入方法上的钩子在每次入库 / 删除后以单个事务增量更新，
+已编译的 VectorStoreService 的写入同样经过钩子。
+每个集合记录计数对应的索引代号（synced_generation）：只有它等于当前索引代号时计数才可信，
+其它进程的写入（或计数更新失败）会使二者不一致，此时调用方应回退为直接读取 Chroma。
+Chroma 与 SQLite 之间无法共享事务，进程中断等情况导致的偏差由 reconcile() 从 Chroma 全量重建修正。
+"""
+import logging
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+from .config import DB_PATH
+from .secure_db import get_db_connection, sqlite3
+
+logger = logging.getLogger(__name__)
+
+
+class ChunkCounterService:
+    def __init__(self, db_path: str = DB_PATH):
+        """
+        初始化文本块计数服务
+
+        Args:
+            db_path: SQLite 元数据库文件路径
+        """
+        self.db_path = db_path
+        self._init_db()
+
+    def _init_db(self):
+        """创建计数表"""
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        with get_db_connection(self.db_path) as conn:
+            c = conn.cursor()
+            c.execute("""
+                CREATE TABLE IF NOT EXISTS collection_chunk_counts (
+                    collection_name TEXT PRIMARY KEY,
+                    chunk_count INTEGER NOT NULL DEFAULT 0,
+                    reconciled_at TEXT,
+                    synced_generation INTEGER
+                )
+            """)
+            columns = {row[1] for row in c.execute("PRAGMA table_info(collection_chunk_counts)")}
+            if "synced_generation" not in columns:
+                c.execute("ALTER TABLE collection_chunk_counts ADD COLUMN synced_generation INTEGER")
+            c.execute("""
+                CREATE TABLE IF NOT EXISTS file_chunk_counts (
+                    collection_name TEXT NOT NULL,
+                    file_id TEXT NOT NULL,
+                    chunk_count INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (collection_name, file_id)
+                )
+            """)
+            c.execute("CREATE INDEX IF NOT EXISTS idx_file_chunk_counts_file ON file_chunk_counts (file_id)")
+            conn.commit()
+
+    def apply_delta(self, collection_name: str, added: Iterable[Optional[str]] = (),
+                    removed: Iterable[Optional[str]] = ()):
+        """
+        在一个事务中更新集合计数与文件计数。
+
+        Args:
+            collection_name: 集合名称
+            added: 新增文本块所属的 file_id（每个文本块一项，None 表示无文件归属）
+            removed: 删除文本块所属的 file_id
+        """
+        delta = Counter()
+        for file_id in added:
+            delta[file_id] += 1
+        for file_id in removed:
+            delta[file_id] -= 1
+        total = sum(delta.values())
+        if not delta:
+            return
+
+        with get_db_connection(self.db_path) as conn:
+            c = conn.cursor()
+            try:
+                c.execute("BEGIN IMMEDIATE")
+                c.execute("""
+                    INSERT INTO collection_chunk_counts (collection_name, chunk_count) VALUES (?, ?)
+                    ON CONFLICT(collection_name) DO UPDATE SET chunk_count = MAX(0, chunk_count + excluded.chunk_count)
+                """, (collection_name, total))
+                rows = [(collection_name, file_id, change) for file_id, change in delta.items()
+                        if file_id is not None and change != 0]
+                c.executemany("""
+                    INSERT INTO file_chunk_counts (collection_name, file_id, chunk_count) VALUES (?, ?, ?)
+                    ON CONFLICT(collection_name, file_id) DO UPDATE SET chunk_count = chunk_count + excluded.chunk_count
+                """, rows)
+                c.execute("DELETE FROM file_chunk_counts WHERE collection_name = ? AND chunk_count <= 0",
+                          (collection_name,))
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+
+    def get_collection_count(self, collection_name: str, generation: Optional[int] = None) -> Optional[int]:
+        """
+        返回集合的文本块数量；从未统计过的集合返回 None。
+        指定 generation 时，计数不是在该索引代号下同步的也返回 None。
+        """
+        with get_db_connection(self.db_path) as conn:
+            row = conn.execute(
+                "SELECT chunk_count, synced_generation FROM collection_chunk_counts WHERE collection_name = ?",
+                (collection_name,)
+            ).fetchone()
+        if not row or (generation is not None and row[1] != generation):
+            return None
+        return row[0]
+
+    def is_synced(self, collection_names: Iterable[str], generation: int) -> bool:
+        """给定集合的计数是否都在 generation 这一索引代号下同步。"""
+        names = list(collection_names)
+        with get_db_connection(self.db_path) as conn:
+            row = conn.execute(
+                f"SELECT COUNT(*) FROM collection_chunk_counts WHERE synced_generation = ? "
+                f"AND collection_name IN ({','.join('?' * len(names))})",
+                (generation, *names)
+            ).fetchone()
+        return row[0] == len(names)
+
+    def get_file_counts(self, file_id: str) -> Dict[str, int]:
+        """返回文件在各集合中的文本块数量（调用方应先用 is_synced 确认计数可信）。"""
+        with get_db_connection(self.db_path) as conn:
+            rows = conn.execute(
+                "SELECT collection_name, chunk_count FROM file_chunk_counts WHERE file_id = ?", (file_id,)
+            ).fetchall()
+        return {collection_name: count for collection_name, count in rows}
+
+    def mark_synced(self, from_generation: int, to_generation: int):
+        """
+        vector_ingest 写入并递增索引代号后调用：写入前已同步的计数已包含本次增量，
+        把它们的同步代号推进到新代号。写入前就不可信的计数保持不可信。
+        """
+        with get_db_connection(self.db_path) as conn:
+            conn.execute(
+                "UPDATE collection_chunk_counts SET synced_generation = ? WHERE synced_generation = ?",
+                (to_generation, from_generation)
+            )
+            conn.commit()
+
+    def reconcile(self, collection, collection_name: str, page_size: int = 5000) -> Dict[str, int]:
+        """
+        从 Chroma 集合全量重建该集合的计数。
+        重建结果记为扫描开始前的索引代号；扫描期间有写入时代号已变化，计数不会被误当作可信。
+
+        Returns:
+            {"chunks": 文本块总数, "files": 文件数}
+        """
+        from services.search_cache import index_generation
+        from services.vector_ingest import get_raw_collection
+        generation = index_generation.current()
+        raw = get_raw_collection(collection)
+        per_file = Counter()
+        total, offset = 0, 0
+        while True:
+            page = raw.get(include=["metadatas"], limit=page_size, offset=offset)
+            if not page["ids"]:
+                break
+            for metadata in page["metadatas"]:
+                file_id = (metadata or {}).get("file_id")
+                if file_id is not None:
+                    per_file[file_id] += 1
+            total += len(page["ids"])
+            offset += page_size
+
+        with get_db_connection(self.db_path) as conn:
+            c = conn.cursor()
+            try:
+                c.execute("BEGIN IMMEDIATE")
+                c.execute("DELETE FROM file_chunk_counts WHERE collection_name = ?", (collection_name,))
+                c.executemany(
+                    "INSERT INTO file_chunk_counts (collection_name, file_id, chunk_count) VALUES (?, ?, ?)",
+                    [(collection_name, file_id, count) for file_id, count in per_file.items()]
+                )
+                c.execute("""
+                    INSERT INTO collection_chunk_counts (collection_name, chunk_count, reconciled_at, synced_generation)
+                    VALUES (?, ?, datetime('now'), ?)
+                    ON CONFLICT(collection_name) DO UPDATE SET
+                        chunk_count = excluded.chunk_count, reconciled_at = excluded.reconciled_at,
+                        synced_generation = excluded.synced_generation
+                """, (collection_name, total, generation))
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+        logger.info(f"集合 {collection_name} 的文本块计数已重建: {total} 个文本块, {len(per_file)} 个文件")
+        return {"chunks": total, "files": len(per_file)}
+
+    def clear(self, generation: Optional[int] = None):
+        """
+        清空所有计数（清除知识库时调用），随后各集合计数为 0。
+
+        Args:
+            generation: 清空集合后的索引代号；计数记为在该代号下同步，省略时计数在下次 reconcile 前不可信
+        """
+        with get_db_connection(self.db_path) as conn:
+            c = conn.cursor()
+            c.execute("DELETE FROM file_chunk_counts")
+            c.execute("UPDATE collection_chunk_counts SET chunk_count = 0, reconciled_at = datetime('now'), "
+                      "synced_generation = ?", (generation,))
+            conn.commit()
+
+
+# --- 全局实例 ---
+chunk_counter_service = ChunkCounterService()
@@ -6,8 +6,11 @@
 import os
 import logging
 import sys
+import threading
+from collections import OrderedDict
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -44,6 +47,64 @@ ACTIVE_MODEL_NAME="Qwen/Qwen3-Embedding-0.6B"
 # 自定义模型目录（可选）
 # CUSTOM_MODEL_DIR=/path/to/your/custom/models/directory
 
+# 嵌入模型推理后端：torch / torch-int8 / onnx / onnx-int8
+EMBED_INFERENCE_BACKEND=torch
+
+# 输出向量维度（Matryoshka 截断，0 表示完整维度）与存储精度（fp32 / fp16）
+# 修改维度后需要重建知识库
+EMBED_OUTPUT_DIM=0
+EMBED_VECTOR_PRECISION=fp32
+
+# 查询微批处理：收集窗口（毫秒，0 表示关闭）与单批最大条数
+EMBED_QUERY_BATCH_WINDOW_MS=3
+EMBED_QUERY_BATCH_MAX_SIZE=32
+
+# 文本块向量持久化缓存
+EMBED_CACHE_ENABLED=true
+EMBED_CACHE_MAX_ENTRIES=200000
+
+# 文档向量化按长度分桶：单批 token 预算（补齐后）与最大条数
+EMBED_BATCH_TOKEN_BUDGET=16384
+EMBED_BATCH_MAX_SIZE=64
+
+# 多进程嵌入工作池：进程数（0 表示关闭）与每个进程的线程数（留空则按 CPU 核心数平均分配）
+EMBED_POOL_WORKERS=0
+# EMBED_POOL_THREADS_PER_WORKER=4
+
+# 混合检索（向量 + BM25）：倒数排名融合权重、常数 k 与每路候选数倍数
+SEARCH_HYBRID_DENSE_WEIGHT=1.0
+SEARCH_HYBRID_LEXICAL_WEIGHT=1.0
+SEARCH_RRF_K=60
+SEARCH_HYBRID_CANDIDATE_MULTIPLIER=3
+
+# 搜索结果缓存最大条目数（0 表示关闭），向量库有写入或删除时自动失效
+SEARCH_RESULT_CACHE_MAX_ENTRIES=512
+
+# 交叉编码器重排（需先将模型下载到本地缓存）：模型、候选数与单次请求时间预算（毫秒）
+SEARCH_RERANK_MODEL="BAAI/bge-reranker-base"
+SEARCH_RERANK_TOP_K=20
+SEARCH_RERANK_BUDGET_MS=300
+
+# 语义查询缓存：相似度超过阈值的查询复用已有结果（条目数为 0 表示关闭）
+SEARCH_SEMANTIC_CACHE_MAX_ENTRIES=0
+SEARCH_SEMANTIC_CACHE_THRESHOLD=0.95
+
+# 游标分页：第一页最多检索的页数、单页最大条数、保留的游标数、全部游标结果的总大小上限（MB）与游标有效期（秒）
+SEARCH_CURSOR_MAX_PAGES=10
+SEARCH_CURSOR_MAX_PAGE_SIZE=50
+SEARCH_CURSOR_MAX_ENTRIES=256
+SEARCH_CURSOR_MAX_TOTAL_MB=64
+SEARCH_CURSOR_TTL_SECONDS=300
+
+# HNSW 调优：recall@k 的 k、默认留出查询数与允许在线调优的最大文本块数（0 表示不限制）
+SEARCH_HNSW_TUNING_K=10
+SEARCH_HNSW_TUNING_QUERIES=200
+SEARCH_HNSW_TUNING_MAX_CHUNKS=500000
+
+# 近重复折叠：SimHash 汉明距离阈值（位数）与折叠前多取的候选倍数
+SEARCH_SIMHASH_HAMMING_THRESHOLD=3
+SEARCH_SIMHASH_CANDIDATE_MULTIPLIER=3
+
 # API配置
 API_HOST=0.0.0.0
 API_PORT=8000
@@ -77,6 +138,7 @@ BASE_DIRECTORIES = {
 # 数据库路径配置
 DB_PATH = str(DATA_ROOT / "file_info" / "meta.db")
 FILE_INFO_DB_PATH = str(DATA_ROOT / "file_info" / "file_info.db")
+LEXICAL_INDEX_DB_PATH = str(DATA_ROOT / "file_info" / "lexical_index.db")
 SETTINGS_FILE_PATH = DATA_ROOT / "settings.json"
 
 
@@ -117,42 +179,113 @@ def get_safe_path(path_str: str = "") -> Path:
         raise ValueError(f"不安全的路径: '{path_str}' 解析后超出了允许的范围。")
 
 
-def is_path_in_knowledge_base_work_area(path_str: str) -> Path:
-    """
-    专门为知识库构建流程验证路径，确保路径在允许的多个工作区内。
-    允许的目录包括: forRubbables, extracted_texts, chunked_outputs, 和 chroma_db。
-    """
-    allowed_bases = [
+@lru_cache(maxsize=1)
+def get_knowledge_base_allowed_bases() -> Tuple[Path, ...]:
+    """知识库允许的工作区目录（已解析为绝对路径），只在首次调用时访问文件系统。"""
+    return (
         BASE_DIRECTORIES["forRubbables"].resolve(),
         BASE_DIRECTORIES["extracted_texts"].resolve(),
         BASE_DIRECTORIES["chunked_outputs"].resolve(),
         Path(CHROMA_DB_CONFIG["persist_directory"]).resolve()
-    ]
+    )
+
+
+# 已通过验证的路径备忘：解析后的绝对路径 -> 同一路径，LRU 淘汰。
+# 以解析结果为键：符号链接改指向、文件被移动后解析结果随之变化，不会命中旧的验证结论
+VALIDATED_PATH_MEMO_MAX_ENTRIES = 4096
+_validated_path_memo: "OrderedDict[Path, Path]" = OrderedDict()
+_validated_path_lock = threading.Lock()
+_validated_path_stats = {"hits": 0, "misses": 0}
+
+
+def invalidate_validated_paths(paths=None) -> None:
+    """
+    使路径验证备忘失效。文件被移动或删除（包括从向量库删除其文本块）后调用，
+    paths 为受影响的原始路径字符串；为 None 时清空全部备忘。
+    """
+    if paths is None:
+        with _validated_path_lock:
+            _validated_path_memo.clear()
+        return
+    keys = []
+    for path_str in paths:
+        if not path_str:
+            continue
+        try:
+            keys.append(_resolve_candidate_path(path_str))
+        except (OSError, RuntimeError, ValueError):
+            continue
+    with _validated_path_lock:
+        for key in keys:
+            _validated_path_memo.pop(key, None)
+
+
+def get_path_validation_stats() -> Dict[str, int]:
+    with _validated_path_lock:
+        return {
+            "entries": len(_validated_path_memo),
+            "max_entries": VALIDATED_PATH_MEMO_MAX_ENTRIES,
+            **_validated_path_stats
+        }
 
+
+def is_path_in_knowledge_base_work_area(path_str: str) -> Path:
+    """
+    专门为知识库构建流程验证路径，确保路径在允许的多个工作区内。
+    允许的目录包括: forRubbables, extracted_texts, chunked_outputs, 和 chroma_db。
+    每次都会解析路径（跟随符号链接），已验证过的解析结果被记住，
+    再次出现时跳过工作区范围检查；按其他机器上的目录名重建的路径不进入备忘。
+    """
     if not path_str:
         raise ValueError("路径字符串不能为空。")
 
+    candidate = _resolve_candidate_path(path_str)
+    with _validated_path_lock:
+        if candidate in _validated_path_memo:
+            _validated_path_memo.move_to_end(candidate)
+            _validated_path_stats["hits"] += 1
+            return candidate
+        _validated_path_stats["misses"] += 1
+
+    # 未通过验证的路径会抛出异常，不会进入备忘
+    final_path = _resolve_knowledge_base_path(path_str, candidate)
+    if final_path == candidate:
+        # 解析结果本身位于工作区内，结论只取决于解析结果，可以安全复用
+        with _validated_path_lock:
+            _validated_path_memo[candidate] = candidate
+            while len(_validated_path_memo) > VALIDATED_PATH_MEMO_MAX_ENTRIES:
+                _validated_path_memo.popitem(last=False)
+    return final_path
+
+
+def _resolve_candidate_path(path_str: str) -> Path:
+    """把路径字符串解析为绝对路径：相对路径依次尝试各允许的基准目录，都不在其中时相对数据根目录。"""
+    allowed_bases = get_knowledge_base_allowed_bases()
+
     # 创建 Path 对象
     path_obj = Path(path_str)
     
     # 解析为绝对路径
     if path_obj.is_absolute():
-        final_path = path_obj.resolve()
-    else:
-        # 如果是相对路径，尝试在允许的基准目录中查找
-        final_path = None
-        for base in allowed_bases:
-            try_path = (base / path_obj).resolve()
-            try:
-                try_path.relative_to(base)
-                final_path = try_path
-                break
-            except ValueError:
-                continue
-        
-        # 如果在任何基准目录中都找不到，则使用相对于数据根目录的路径
-        if final_path is None:
-            final_path = (DATA_ROOT / path_obj).resolve()
+        return path_obj.resolve()
+
+    # 如果是相对路径，尝试在允许的基准目录中查找
+    for base in allowed_bases:
+        try_path = (base / path_obj).resolve()
+        try:
+            try_path.relative_to(base)
+            return try_path
+        except ValueError:
+            continue
+
+    # 如果在任何基准目录中都找不到，则使用相对于数据根目录的路径
+    return (DATA_ROOT / path_obj).resolve()
+
+
+def _resolve_knowledge_base_path(path_str: str, final_path: Optional[Path] = None) -> Path:
+    allowed_bases = get_knowledge_base_allowed_bases()
+    if final_path is None:
+        final_path = _resolve_candidate_path(path_str)
 
     # 检查 final_path 是否位于任何一个允许的基准目录内
     for base in allowed_bases:
@@ -239,6 +372,53 @@ CHROMA_DB_CONFIG = {
     "default_collection_name": "knowledge_base_main"
 }
 
+# 搜索配置
+SEARCH_CONFIG = {
+    # 混合检索中向量检索与词法检索（BM25）在倒数排名融合时的权重
+    "hybrid_dense_weight": float(os.getenv("SEARCH_HYBRID_DENSE_WEIGHT", 1.0)),
+    "hybrid_lexical_weight": float(os.getenv("SEARCH_HYBRID_LEXICAL_WEIGHT", 1.0)),
+    # 倒数排名融合常数 k
+    "rrf_k": int(os.getenv("SEARCH_RRF_K", 60)),
+    # 每个检索器召回的候选数量为 n_results 的倍数
+    "hybrid_candidate_multiplier": int(os.getenv("SEARCH_HYBRID_CANDIDATE_MULTIPLIER", 3)),
+    # 搜索结果缓存的最大条目数（0 表示关闭）
+    "result_cache_max_entries": int(os.getenv("SEARCH_RESULT_CACHE_MAX_ENTRIES", 512)),
+    # 批量搜索接口单次请求允许的最大查询数
+    "batch_max_queries": int(os.getenv("SEARCH_BATCH_MAX_QUERIES", 64)),
+    # 流式搜索第一阶段先取回并发送的结果数（0 表示不分阶段）
+    "stream_first_batch_size": int(os.getenv("SEARCH_STREAM_FIRST_BATCH_SIZE", 10)),
+    # 由细到粗检索中缓存的父块（大块）数量上限
+    "parent_cache_max_chunks": int(os.getenv("SEARCH_PARENT_CACHE_MAX_CHUNKS", 1024)),
+    # MMR 多样化（RelevanceSorting = "mmr"）：相关性与多样性的权衡系数，以及候选数为 n_results 的倍数
+    "mmr_lambda": float(os.getenv("SEARCH_MMR_LAMBDA", 0.5)),
+    "mmr_candidate_multiplier": int(os.getenv("SEARCH_MMR_CANDIDATE_MULTIPLIER", 4)),
+    # 交叉编码器重排：本地缓存的模型、重排候选数、单次请求时间预算（毫秒）、批大小与分数缓存条目数
+    "rerank_model": os.getenv("SEARCH_RERANK_MODEL", "BAAI/bge-reranker-base"),
+    "rerank_top_k": int(os.getenv("SEARCH_RERANK_TOP_K", 20)),
+    "rerank_budget_ms": float(os.getenv("SEARCH_RERANK_BUDGET_MS", 300)),
+    "rerank_batch_size": int(os.getenv("SEARCH_RERANK_BATCH_SIZE", 8)),
+    "rerank_cache_max_entries": int(os.getenv("SEARCH_RERANK_CACHE_MAX_ENTRIES", 20000)),
+    # 元数据预过滤：满足过滤条件的文本块不超过该数量时改为精确暴力打分（0 表示总是交给 Chroma 过滤）
+    "prefilter_brute_force_max_chunks": int(os.getenv("SEARCH_PREFILTER_BRUTE_FORCE_MAX_CHUNKS", 2000)),
+    # 语义查询缓存：保存的最近查询数（0 表示关闭，默认关闭）与复用结果所需的最小余弦相似度
+    # 相似度只反映语义接近，错误码、编号等只差几个字符的查询也会命中，需按语料评估后再开启
+    "semantic_cache_max_entries": int(os.getenv("SEARCH_SEMANTIC_CACHE_MAX_ENTRIES", 0)),
+    "semantic_cache_threshold": float(os.getenv("SEARCH_SEMANTIC_CACHE_THRESHOLD", 0.95)),
+    # 游标分页：第一页检索的最大页数、单页最大条数、同时保留的游标数与游标有效期（秒）
+    "cursor_max_pages": int(os.getenv("SEARCH_CURSOR_MAX_PAGES", 10)),
+    "cursor_max_page_size": int(os.getenv("SEARCH_CURSOR_MAX_PAGE_SIZE", 50)),
+    "cursor_max_entries": int(os.getenv("SEARCH_CURSOR_MAX_ENTRIES", 256)),
+    "cursor_max_total_mb": float(os.getenv("SEARCH_CURSOR_MAX_TOTAL_MB", 64)),
+    "cursor_ttl_seconds": float(os.getenv("SEARCH_CURSOR_TTL_SECONDS", 300)),
+    # HNSW 调优：recall@k 的 k、默认留出查询数与允许在线调优的最大文本块数
+    "hnsw_tuning_k": int(os.getenv("SEARCH_HNSW_TUNING_K", 10)),
+    "hnsw_tuning_queries": int(os.getenv("SEARCH_HNSW_TUNING_QUERIES", 200)),
+    "hnsw_tuning_max_chunks": int(os.getenv("SEARCH_HNSW_TUNING_MAX_CHUNKS", 500000)),
+    # 近重复折叠：SimHash 汉明距离阈值（位数）与折叠前多取的候选倍数
+    "simhash_hamming_threshold": int(os.getenv("SEARCH_SIMHASH_HAMMING_THRESHOLD", 3)),
+    "simhash_candidate_multiplier": int(os.getenv("SEARCH_SIMHASH_CANDIDATE_MULTIPLIER", 3)),
+}
+
 # 历史记录配置
 HISTORY_CONFIG = {
     "history_directory": str(BASE_DIRECTORIES["history"])
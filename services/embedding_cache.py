@@ -0,0 +1,292 @@
+"""
+嵌入向量持久化缓存
+以 (模型名称, 规范化文本哈希) 为键，将文本块的向量保存在 DATA_ROOT 下：
+向量以 float32（或 float16）紧凑存放在 numpy memmap 文件中，SQLite 负责键到行号的索引与 LRU 记录。
+重新构建知识库时，未变化的文本块直接命中缓存，无需再次经过模型。
+"""
+import hashlib, sqlite3, threading, time, unicodedata
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from .config import DATA_ROOT
+
+# 缓存根目录
+EMBEDDING_CACHE_DIR = DATA_ROOT / "embedding_cache"
+
+# memmap 文件初始容量（行数），容量不足时按倍数扩展
+_INITIAL_CAPACITY = 1024
+
+
+def normalize_text(text: str) -> str:
+    """规范化文本：统一 Unicode 表示与换行符，并去除首尾空白。"""
+    text = unicodedata.normalize("NFC", text)
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text.strip()
+
+
+def hash_text(text: str) -> str:
+    """计算规范化文本的 SHA-256 哈希，作为内容寻址的键。"""
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    基于 memmap + SQLite 的内容寻址向量缓存。
+    每个缓存目录只服务一个模型：打开时若发现记录的模型名称、推理后端（含量化方式）或存储精度
+    与当前不一致，整个缓存会被清空，避免 int8 / ONNX 路径与 fp32 torch 路径的向量混用。
+    """
+
+    def __init__(self, model_name: str, cache_dir: Path = EMBEDDING_CACHE_DIR, max_entries: int = 200_000,
+                 dtype: str = "float32", backend: str = "torch"):
+        self.model_name = model_name
+        self.backend = backend
+        self.dtype = np.dtype(dtype)
+        self.cache_dir = Path(cache_dir)
+        self.max_entries = max(1, max_entries)
+        self.index_path = self.cache_dir / "index.db"
+        # 文件后缀随存储精度变化：vectors.f32 / vectors.f16
+        self.vectors_path = self.cache_dir / f"vectors.f{self.dtype.itemsize * 8}"
+
+        self._lock = threading.Lock()
+        self._vectors = None
+        self._dim = None
+        self._capacity = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.index_path), check_same_thread=False)
+        self._init_db()
+
+    # ------------------------------------------------------------------
+    # 初始化与失效
+    # ------------------------------------------------------------------
+    def _init_db(self):
+        c = self._conn.cursor()
+        c.execute("CREATE TABLE IF NOT EXISTS cache_meta (key TEXT PRIMARY KEY, value TEXT)")
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                text_hash TEXT PRIMARY KEY,
+                slot INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_embedding_cache_access ON embedding_cache (last_access)")
+        self._conn.commit()
+
+        cached_model = self._get_meta("model_name")
+        cached_dtype = self._get_meta("dtype")
+        cached_backend = self._get_meta("backend")
+        if cached_model is not None and (cached_model != self.model_name or cached_dtype != self.dtype.name
+                                         or cached_backend != self.backend):
+            # 激活模型、推理后端或存储精度已变更（未记录后端的旧缓存来源不明），旧向量全部作废
+            self._reset()
+        elif cached_model is None:
+            self._set_meta("model_name", self.model_name)
+            self._set_meta("dtype", self.dtype.name)
+            self._set_meta("backend", self.backend)
+            self._conn.commit()
+
+        dim = self._get_meta("dim")
+        if dim is not None and not self.vectors_path.exists():
+            # 索引记录的向量文件不存在（例如旧版本把 float16 向量也写在 vectors.f32 中），整体作废
+            self._reset()
+            dim = None
+        if dim is not None:
+            self._dim = int(dim)
+            self._capacity = int(self._get_meta("capacity") or 0)
+            self._open_vectors()
+
+    def _reset(self):
+        """清空索引与向量文件，并把缓存绑定到当前模型。"""
+        c = self._conn.cursor()
+        c.execute("DELETE FROM embedding_cache")
+        c.execute("DELETE FROM cache_meta")
+        self._set_meta("model_name", self.model_name)
+        self._set_meta("dtype", self.dtype.name)
+        self._set_meta("backend", self.backend)
+        self._conn.commit()
+        self._vectors = None
+        self._dim = None
+        self._capacity = 0
+        # 同时删除其它精度留下的向量文件
+        for path in self.cache_dir.glob("vectors.f*"):
+            path.unlink()
+
+    def clear(self):
+        """手动清空缓存。"""
+        with self._lock:
+            self._reset()
+
+    def _get_meta(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM cache_meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value):
+        self._conn.execute("INSERT OR REPLACE INTO cache_meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    # ------------------------------------------------------------------
+    # memmap 管理
+    # ------------------------------------------------------------------
+    def _open_vectors(self):
+        if self._capacity <= 0:
+            self._vectors = None
+            return
+        self._vectors = np.memmap(self.vectors_path, dtype=self.dtype, mode="r+", shape=(self._capacity, self._dim))
+
+    def _ensure_capacity(self, required_rows: int):
+        """确保 memmap 至少能容纳 required_rows 行，不足时扩展文件。"""
+        if required_rows <= self._capacity:
+            return
+        new_capacity = max(self._capacity, _INITIAL_CAPACITY)
+        while new_capacity < required_rows:
+            new_capacity *= 2
+        new_capacity = min(new_capacity, self.max_entries)
+
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+        with open(self.vectors_path, "ab") as f:
+            f.truncate(new_capacity * self._dim * self.dtype.itemsize)
+        self._capacity = new_capacity
+        self._set_meta("capacity", new_capacity)
+        self._open_vectors()
+
+    def _allocate_slots(self, count: int) -> List[int]:
+        """为新条目分配行号：先扩展文件，达到容量上限后按 LRU 淘汰并复用其行号。"""
+        slots = []
+        next_slot = int(self._get_meta("next_slot") or 0)
+        while len(slots) < count and next_slot < self.max_entries:
+            slots.append(next_slot)
+            next_slot += 1
+        self._set_meta("next_slot", next_slot)
+        self._ensure_capacity(next_slot)
+
+        shortage = count - len(slots)
+        if shortage > 0:
+            # 缓存已满：淘汰最久未访问的条目，直接复用其行号
+            rows = self._conn.execute(
+                "SELECT text_hash, slot FROM embedding_cache ORDER BY last_access ASC LIMIT ?", (shortage,)
+            ).fetchall()
+            self._conn.executemany("DELETE FROM embedding_cache WHERE text_hash = ?", [(h,) for h, _ in rows])
+            slots.extend(slot for _, slot in rows)
+            self.evictions += len(rows)
+        return slots
+
+    # ------------------------------------------------------------------
+    # 读写接口
+    # ------------------------------------------------------------------
+    def get_many(self, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """批量查询文本对应的向量，未命中的位置返回 None。"""
+        hashes = [hash_text(t) for t in texts]
+        results: List[Optional[np.ndarray]] = [None] * len(texts)
+        with self._lock:
+            if self._vectors is None:
+                self.misses += len(texts)
+                return results
+
+            slot_by_hash = {}
+            unique_hashes = list(set(hashes))
+            # SQLite 默认最多 999 个绑定参数，分批查询
+            for start in range(0, len(unique_hashes), 900):
+                part = unique_hashes[start:start + 900]
+                placeholders = ", ".join(["?"] * len(part))
+                for text_hash, slot in self._conn.execute(
+                    f"SELECT text_hash, slot FROM embedding_cache WHERE text_hash IN ({placeholders})", part
+                ):
+                    slot_by_hash[text_hash] = slot
+
+            for i, text_hash in enumerate(hashes):
+                slot = slot_by_hash.get(text_hash)
+                if slot is None:
+                    self.misses += 1
+                else:
+                    results[i] = np.array(self._vectors[slot], dtype=np.float32)
+                    self.hits += 1
+
+            if slot_by_hash:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embedding_cache SET last_access = ? WHERE text_hash = ?",
+                    [(now, h) for h in slot_by_hash]
+                )
+                self._conn.commit()
+        return results
+
+    def put_many(self, texts: Sequence[str], vectors: np.ndarray):
+        """批量写入文本及其向量。"""
+        if len(texts) == 0:
+            return
+        vectors = np.asarray(vectors, dtype=self.dtype)
+        if vectors.ndim == 1:
+            vectors = vectors.reshape(1, -1)
+
+        # 同一批内重复的文本只写一次
+        unique = {}
+        for text, vector in zip(texts, vectors):
+            unique.setdefault(hash_text(text), vector)
+
+        with self._lock:
+            if self._dim is None:
+                self._dim = int(vectors.shape[1])
+                self._set_meta("dim", self._dim)
+            elif vectors.shape[1] != self._dim:
+                # 向量维度变化说明模型输出已改变，缓存作废
+                self._reset()
+                self._dim = int(vectors.shape[1])
+                self._set_meta("dim", self._dim)
+
+            existing = set()
+            hashes = list(unique)
+            for start in range(0, len(hashes), 900):
+                part = hashes[start:start + 900]
+                placeholders = ", ".join(["?"] * len(part))
+                existing.update(row[0] for row in self._conn.execute(
+                    f"SELECT text_hash FROM embedding_cache WHERE text_hash IN ({placeholders})", part
+                ))
+            new_hashes = [h for h in hashes if h not in existing]
+            if not new_hashes:
+                return
+
+            new_hashes = new_hashes[-self.max_entries:]
+            slots = self._allocate_slots(len(new_hashes))
+            for text_hash, slot in zip(new_hashes, slots):
+                self._vectors[slot] = unique[text_hash]
+            self._vectors.flush()
+
+            now = time.time()
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embedding_cache (text_hash, slot, last_access) VALUES (?, ?, ?)",
+                [(h, s, now) for h, s in zip(new_hashes, slots)]
+            )
+            self._conn.commit()
+
+    def get_stats(self) -> dict:
+        """返回命中率、条目数与磁盘占用等统计信息。"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "model_name": self.model_name,
+                "entries": entries,
+                "max_entries": self.max_entries,
+                "dim": self._dim,
+                "dtype": self.dtype.name,
+                "backend": self.backend,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "disk_bytes": self.vectors_path.stat().st_size if self.vectors_path.exists() else 0,
+            }
+
+    def close(self):
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors.flush()
+                self._vectors = None
+            self._conn.close()
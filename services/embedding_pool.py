@@ -0,0 +1,206 @@
+"""
+多进程嵌入工作池
+启动 N 个工作进程，每个进程通过 _load_embedding_model_from_local 加载一份模型，
+并各自限定 torch 线程数。文本经任务队列下发，向量结果写入每个工作进程专属的共享内存缓冲区，
+主进程直接从共享内存拷贝结果，避免大矩阵在进程间序列化。
+批量入库可以借此利用多核，而 API 进程中的模型继续负责在线查询。
+"""
+import os, queue, threading, uuid
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from typing import List, Optional
+
+import numpy as np
+
+# 单个任务包含的最大文本条数，同时决定共享内存缓冲区的初始大小
+DEFAULT_ROWS_PER_TASK = 256
+# 等待结果时检查工作进程存活状态的间隔（秒）
+RESULT_POLL_INTERVAL = 1.0
+
+
+def _pool_worker_main(worker_id: int, model_name: str, num_threads: int, task_queue, result_queue):
+    """工作进程入口：限定线程数、加载模型，然后循环处理编码任务。"""
+    # 必须在导入 torch 之前设置，否则 OpenMP/MKL 线程池已按全部核心初始化
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(num_threads)
+    os.environ["ACTIVE_MODEL_NAME"] = model_name
+
+    try:
+        import torch
+        torch.set_num_threads(num_threads)
+        from services.EmbServ import _load_embedding_model_from_local, encode_length_bucketed
+        model = _load_embedding_model_from_local()
+        dim = model.get_sentence_embedding_dimension()
+    except Exception as e:
+        result_queue.put(("failed", worker_id, None, str(e)))
+        return
+    result_queue.put(("ready", worker_id, None, dim))
+
+    attached = {}
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        task_id, texts, shm_name = task
+        try:
+            shm = attached.get(shm_name)
+            if shm is None:
+                # 主进程扩容后会换用新的缓冲区，旧的连接随之释放
+                for old in attached.values():
+                    old.close()
+                attached.clear()
+                shm = shared_memory.SharedMemory(name=shm_name)
+                attached[shm_name] = shm
+            vectors = encode_length_bucketed(model, texts)
+            out = np.ndarray((len(texts), dim), dtype=np.float32, buffer=shm.buf)
+            out[:] = vectors
+            del out
+            result_queue.put(("done", worker_id, task_id, len(texts)))
+        except Exception as e:
+            result_queue.put(("error", worker_id, task_id, str(e)))
+
+    for shm in attached.values():
+        shm.close()
+
+
+class EmbeddingPool:
+    """
+    嵌入工作进程池。
+    encode() 会把文本切分为多个任务分发给空闲的工作进程，并按原顺序拼回结果矩阵。
+    """
+
+    def __init__(self, model_name: str, num_workers: int, threads_per_worker: int,
+                 rows_per_task: int = DEFAULT_ROWS_PER_TASK, startup_timeout: float = 600.0):
+        self.model_name = model_name
+        self.num_workers = max(1, num_workers)
+        self.threads_per_worker = max(1, threads_per_worker)
+        self.rows_per_task = max(1, rows_per_task)
+        self.startup_timeout = startup_timeout
+
+        self.dim: Optional[int] = None
+        self._ctx = mp.get_context("spawn")
+        self._processes = []
+        self._task_queues = []
+        self._result_queue = None
+        self._buffers: List[Optional[shared_memory.SharedMemory]] = []
+        self._encode_lock = threading.Lock()
+        self._started = False
+
+    def start(self):
+        """启动所有工作进程，并等待模型加载完成。"""
+        if self._started:
+            return
+        self._result_queue = self._ctx.Queue()
+        for worker_id in range(self.num_workers):
+            task_queue = self._ctx.Queue()
+            process = self._ctx.Process(
+                target=_pool_worker_main,
+                args=(worker_id, self.model_name, self.threads_per_worker, task_queue, self._result_queue),
+                daemon=True,
+                name=f"embedding-pool-{worker_id}"
+            )
+            process.start()
+            self._task_queues.append(task_queue)
+            self._processes.append(process)
+            self._buffers.append(None)
+
+        ready = 0
+        while ready < self.num_workers:
+            try:
+                kind, worker_id, _, payload = self._result_queue.get(timeout=self.startup_timeout)
+            except queue.Empty:
+                self.shutdown()
+                raise RuntimeError("嵌入工作进程启动超时。")
+            if kind == "failed":
+                self.shutdown()
+                raise RuntimeError(f"嵌入工作进程 {worker_id} 加载模型失败: {payload}")
+            self.dim = payload
+            ready += 1
+        self._started = True
+
+    def _buffer_for(self, worker_id: int, rows: int) -> shared_memory.SharedMemory:
+        """返回工作进程专属的输出缓冲区，容量不足时重新分配。"""
+        needed = rows * self.dim * 4
+        shm = self._buffers[worker_id]
+        if shm is None or shm.size < needed:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+            size = max(needed, self.rows_per_task * self.dim * 4)
+            shm = shared_memory.SharedMemory(create=True, size=size, name=f"lm_emb_{uuid.uuid4().hex[:16]}")
+            self._buffers[worker_id] = shm
+        return shm
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """在工作池中编码文本，返回与输入顺序一致的 float32 矩阵。"""
+        if not self._started:
+            self.start()
+        if not texts:
+            return np.empty((0, self.dim), dtype=np.float32)
+
+        with self._encode_lock:
+            output = np.empty((len(texts), self.dim), dtype=np.float32)
+            pending = [(start, texts[start:start + self.rows_per_task])
+                       for start in range(0, len(texts), self.rows_per_task)]
+            pending.reverse()
+            idle = list(range(self.num_workers))
+            in_flight = {}
+
+            while pending or in_flight:
+                while pending and idle:
+                    worker_id = idle.pop()
+                    start, chunk = pending.pop()
+                    shm = self._buffer_for(worker_id, len(chunk))
+                    task_id = uuid.uuid4().hex
+                    in_flight[task_id] = (worker_id, start, len(chunk))
+                    self._task_queues[worker_id].put((task_id, chunk, shm.name))
+
+                try:
+                    kind, worker_id, task_id, payload = self._result_queue.get(timeout=RESULT_POLL_INTERVAL)
+                except queue.Empty:
+                    # 工作进程崩溃（OOM、本地代码段错误等）时不会再返回结果，不能无限等待
+                    dead = sorted({w for w, _, _ in in_flight.values() if not self._processes[w].is_alive()})
+                    if dead:
+                        raise RuntimeError(f"嵌入工作进程 {dead} 已意外退出，工作池将在下次使用时重建。")
+                    continue
+                if task_id not in in_flight:
+                    continue
+                _, start, rows = in_flight.pop(task_id)
+                if kind == "error":
+                    raise RuntimeError(f"嵌入工作进程 {worker_id} 编码失败: {payload}")
+                shm = self._buffers[worker_id]
+                output[start:start + rows] = np.ndarray((rows, self.dim), dtype=np.float32, buffer=shm.buf)
+                idle.append(worker_id)
+            return output
+
+    def is_alive(self) -> bool:
+        return self._started and all(p.is_alive() for p in self._processes)
+
+    def get_stats(self) -> dict:
+        return {
+            "model_name": self.model_name,
+            "num_workers": self.num_workers,
+            "threads_per_worker": self.threads_per_worker,
+            "alive_workers": sum(1 for p in self._processes if p.is_alive()),
+            "dim": self.dim,
+        }
+
+    def shutdown(self):
+        """停止工作进程并释放共享内存。"""
+        for task_queue in self._task_queues:
+            try:
+                task_queue.put(None)
+            except Exception:
+                pass
+        for process in self._processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        for shm in self._buffers:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+        self._processes = []
+        self._task_queues = []
+        self._buffers = []
+        self._started = False
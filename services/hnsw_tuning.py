@@ -0,0 +1,381 @@
+"""
+HNSW 参数调优
+Chroma 集合的 HNSW 参数（M / construction_ef / search_ef）只能在创建集合时指定，
+因此调优时把集合的全部文本块分页复制到一个使用新参数的候选集合，再用一组留出查询评估：
+    - 以 NumPy 精确暴力检索的前 k 条作为基准，计算候选集合 ANN 结果的 recall@k；
+    - 逐条查询计时，报告 p50 / p95 延迟。
+当前集合按同样方式评估一次作为对照。选择应用时候选集合替换原集合（名称与文本块 id 不变），
+所用参数与评估结果按集合保存在 SQLite 元数据库中。
+
+命令行用法（请先停止后端服务，避免两个进程同时写入向量库）：
+    python -m services.hnsw_tuning knowledge_base_small --m 32 --construction-ef 200 --search-ef 100 --apply
+"""
+import logging, time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from .config import DB_PATH, SEARCH_CONFIG
+from .secure_db import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+HNSW_PARAM_KEYS = {"m": "hnsw:M", "construction_ef": "hnsw:construction_ef", "search_ef": "hnsw:search_ef"}
+# 复制集合时每批读取 / 写入的条数
+COPY_BATCH_SIZE = 1000
+
+
+def iter_collection_pages(raw, include: List[str], batch_size: int = COPY_BATCH_SIZE):
+    """分页读取集合，逐页产出 Chroma get() 的返回结果，任何时候只有一页数据在内存中。"""
+    offset = 0
+    while True:
+        page = raw.get(include=include, limit=batch_size, offset=offset)
+        if not page["ids"]:
+            return
+        yield page
+        offset += batch_size
+
+
+def build_candidate_collection(client, raw, m: int, construction_ef: int, search_ef: int,
+                               batch_size: int = COPY_BATCH_SIZE):
+    """以新的 HNSW 参数创建候选集合，并分页写入原集合的全部文本块，返回候选集合。"""
+    metadata = {k: v for k, v in (raw.metadata or {}).items() if not k.startswith("hnsw:") or k == "hnsw:space"}
+    metadata.update({
+        HNSW_PARAM_KEYS["m"]: m,
+        HNSW_PARAM_KEYS["construction_ef"]: construction_ef,
+        HNSW_PARAM_KEYS["search_ef"]: search_ef,
+    })
+    candidate = client.create_collection(f"{raw.name}__hnsw_{int(time.time())}", metadata=metadata)
+    try:
+        for page in iter_collection_pages(raw, ["embeddings", "documents", "metadatas"], batch_size):
+            candidate.add(
+                ids=page["ids"],
+                embeddings=np.asarray(page["embeddings"], dtype=np.float32),
+                documents=page["documents"],
+                metadatas=page["metadatas"],
+            )
+    except Exception:
+        client.delete_collection(candidate.name)
+        raise
+    return candidate
+
+
+def sample_queries(raw, num_queries: int, seed: int = 0, batch_size: int = COPY_BATCH_SIZE):
+    """
+    从集合中抽取留出查询：以被抽中文本块自身的向量作为查询，
+    评估时在基准与 ANN 结果中都排除该文本块本身，避免自身命中抬高召回率。
+    只分页读取 id，被抽中文本块的向量再按 id 取回。
+    """
+    ids = [chunk_id for page in iter_collection_pages(raw, [], batch_size) for chunk_id in page["ids"]]
+    rng = np.random.default_rng(seed)
+    count = min(num_queries, len(ids))
+    chosen = [ids[i] for i in rng.choice(len(ids), size=count, replace=False)]
+    response = raw.get(ids=chosen, include=["embeddings"])
+    row_of = {chunk_id: i for i, chunk_id in enumerate(response["ids"])}
+    vectors = np.asarray(response["embeddings"], dtype=np.float32)
+    query_ids = [chunk_id for chunk_id in chosen if chunk_id in row_of]
+    return vectors[[row_of[chunk_id] for chunk_id in query_ids]], query_ids
+
+
+def exact_top_k(query_embeddings: np.ndarray, raw, k: int, space: str,
+                exclude_ids: Optional[List[Optional[str]]] = None,
+                batch_size: int = COPY_BATCH_SIZE) -> List[List[str]]:
+    """
+    NumPy 精确暴力检索，返回每条查询的前 k 个文本块 id。
+    分页读取集合的向量，每页计算距离后与已有的前 k 条合并，内存占用与集合大小无关。
+    """
+    from services.prefilter import exact_distances
+    num_queries = len(query_embeddings)
+    best_distances = np.full((num_queries, 0), np.inf, dtype=np.float32)
+    best_ids = np.empty((num_queries, 0), dtype=object)
+    for page in iter_collection_pages(raw, ["embeddings"], batch_size):
+        page_ids = np.asarray(page["ids"], dtype=object)
+        distances = exact_distances(query_embeddings, page["embeddings"], space).astype(np.float32)
+        if exclude_ids is not None:
+            row_of = {chunk_id: i for i, chunk_id in enumerate(page["ids"])}
+            for q, chunk_id in enumerate(exclude_ids):
+                if chunk_id in row_of:
+                    distances[q, row_of[chunk_id]] = np.inf
+        merged_distances = np.concatenate([best_distances, distances], axis=1)
+        merged_ids = np.concatenate([best_ids, np.broadcast_to(page_ids, distances.shape)], axis=1)
+        keep = min(k, merged_distances.shape[1])
+        top = np.argpartition(merged_distances, keep - 1, axis=1)[:, :keep]
+        best_distances = np.take_along_axis(merged_distances, top, axis=1)
+        best_ids = np.take_along_axis(merged_ids, top, axis=1)
+    order = best_distances.argsort(axis=1)
+    best_distances = np.take_along_axis(best_distances, order, axis=1)
+    best_ids = np.take_along_axis(best_ids, order, axis=1)
+    # 被排除的文本块距离为 inf，不计入基准
+    return [[chunk_id for chunk_id, d in zip(ids_row, d_row) if np.isfinite(d)]
+            for ids_row, d_row in zip(best_ids, best_distances)]
+
+
+def evaluate_collection(raw, query_embeddings: np.ndarray, truth: List[List[str]], k: int,
+                        exclude_ids: Optional[List[Optional[str]]] = None, warmup: int = 5) -> Dict[str, Any]:
+    """逐条执行 ANN 查询，统计相对精确基准的 recall@k 与延迟分位数。"""
+    extra = 1 if exclude_ids is not None else 0
+    n_results = min(k + extra, raw.count())
+    for query in query_embeddings[:warmup]:
+        raw.query(query_embeddings=query[None, :], n_results=n_results, include=["distances"])
+
+    latencies, recalls = [], []
+    for q, query in enumerate(query_embeddings):
+        start_time = time.perf_counter()
+        response = raw.query(query_embeddings=query[None, :], n_results=n_results, include=["distances"])
+        latencies.append((time.perf_counter() - start_time) * 1000)
+        found = [chunk_id for chunk_id in response["ids"][0]
+                 if exclude_ids is None or chunk_id != exclude_ids[q]][:k]
+        if truth[q]:
+            recalls.append(len(set(found) & set(truth[q])) / len(truth[q]))
+    latencies = np.asarray(latencies)
+    return {
+        "recall_at_k": round(float(np.mean(recalls)), 4) if recalls else None,
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3) if len(latencies) else None,
+        "p95_ms": round(float(np.percentile(latencies, 95)), 3) if len(latencies) else None,
+    }
+
+
+def current_hnsw_params(raw) -> Dict[str, Any]:
+    """读取集合当前的 HNSW 参数，未设置的参数为 None（即 Chroma 默认值）。"""
+    metadata = raw.metadata or {}
+    return {name: metadata.get(key) for name, key in HNSW_PARAM_KEYS.items()}
+
+
+def _repoint(holder, old_raw, replaced) -> bool:
+    """让持有旧集合的 LangChain Chroma 实例改为指向新集合；holder 不是这样的实例时返回 False。"""
+    if holder is None or holder is old_raw:
+        return False
+    if getattr(holder, "_collection", None) is old_raw or \
+            getattr(getattr(holder, "_collection", None), "name", None) == replaced.name:
+        holder._collection = replaced
+        return True
+    return False
+
+
+def refresh_collection_holders(old_raw, replaced, collections=(), app_state=None) -> int:
+    """
+    集合替换后刷新所有持有旧集合的对象：旧集合对象指向已删除的备份，继续使用会出错。
+        - collections 中的 LangChain Chroma 实例；
+        - app.state 上直接保存的集合（chroma_collection 等）；
+        - 搜索服务的 VectorStoreService 实例属性中保存的集合（含字典中的集合）。
+    按索引代号失效的缓存（结果缓存、父块缓存、预过滤覆盖检查等）由调用方递增索引代号处理。
+
+    Returns:
+        刷新的引用数量
+    """
+    refreshed = sum(_repoint(holder, old_raw, replaced) for holder in collections)
+    owners = []
+    if app_state is not None:
+        owners.append(app_state)
+        search_service = getattr(app_state, "search_service", None)
+        vector_store_service = getattr(search_service, "vector_store_service", None)
+        if vector_store_service is not None:
+            owners.append(vector_store_service)
+    for owner in owners:
+        # starlette 的 State 把属性保存在 _state 字典中，按字典中的集合处理
+        for attr, value in list(getattr(owner, "__dict__", {}).items()):
+            if value is old_raw:
+                setattr(owner, attr, replaced)
+                refreshed += 1
+            elif isinstance(value, dict):
+                for key, item in list(value.items()):
+                    if item is old_raw:
+                        value[key] = replaced
+                        refreshed += 1
+                    else:
+                        refreshed += _repoint(item, old_raw, replaced)
+            else:
+                refreshed += _repoint(value, old_raw, replaced)
+    return refreshed
+
+
+def replace_collection(client, collection, candidate, app_state=None) -> Any:
+    """
+    用候选集合替换原集合：先把原集合改名为备份，再把候选集合改为原名称，最后才删除备份。
+    候选集合改名失败时备份恢复为原名称，任何一步失败都不会丢失原集合。
+    传入的 LangChain Chroma 实例以及 app_state 下持有原集合的对象（见 refresh_collection_holders）
+    都会改为指向新的底层集合，已持有它们的服务无需重新创建。
+    """
+    from services.vector_ingest import get_raw_collection
+    raw = get_raw_collection(collection)
+    name = raw.name
+    backup_name = f"{name}__hnsw_backup_{int(time.time())}"
+    raw.modify(name=backup_name)
+    try:
+        candidate.modify(name=name)
+    except Exception:
+        client.get_collection(backup_name).modify(name=name)
+        raise
+    replaced = client.get_collection(name)
+    refreshed = refresh_collection_holders(raw, replaced, [collection], app_state)
+    logger.info(f"集合 {name} 已替换，刷新了 {refreshed} 处引用")
+    try:
+        client.delete_collection(backup_name)
+    except Exception as e:
+        logger.warning(f"删除备份集合 {backup_name} 失败，请手动清理: {e}")
+    return replaced
+
+
+class HnswParamsStore:
+    """按集合保存已应用的 HNSW 参数及其评估结果。"""
+
+    def __init__(self, db_path: str = DB_PATH):
+        self.db_path = db_path
+        self._init_db()
+
+    def _init_db(self):
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        with get_db_connection(self.db_path) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS hnsw_params (
+                    collection_name TEXT PRIMARY KEY,
+                    m INTEGER NOT NULL,
+                    construction_ef INTEGER NOT NULL,
+                    search_ef INTEGER NOT NULL,
+                    k INTEGER,
+                    recall_at_k REAL,
+                    p50_ms REAL,
+                    p95_ms REAL,
+                    applied_at TEXT
+                )
+            """)
+            conn.commit()
+
+    def save(self, collection_name: str, params: Dict[str, int], k: int, metrics: Dict[str, Any]):
+        with get_db_connection(self.db_path) as conn:
+            conn.execute("""
+                INSERT INTO hnsw_params (collection_name, m, construction_ef, search_ef, k, recall_at_k, p50_ms, p95_ms,
+                                         applied_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, datetime('now'))
+                ON CONFLICT(collection_name) DO UPDATE SET
+                    m = excluded.m, construction_ef = excluded.construction_ef, search_ef = excluded.search_ef,
+                    k = excluded.k, recall_at_k = excluded.recall_at_k, p50_ms = excluded.p50_ms,
+                    p95_ms = excluded.p95_ms, applied_at = excluded.applied_at
+            """, (collection_name, params["m"], params["construction_ef"], params["search_ef"], k,
+                  metrics.get("recall_at_k"), metrics.get("p50_ms"), metrics.get("p95_ms")))
+            conn.commit()
+
+    def get(self, collection_name: str) -> Optional[Dict[str, Any]]:
+        with get_db_connection(self.db_path) as conn:
+            row = conn.execute("""
+                SELECT m, construction_ef, search_ef, k, recall_at_k, p50_ms, p95_ms, applied_at
+                FROM hnsw_params WHERE collection_name = ?
+            """, (collection_name,)).fetchone()
+        if row is None:
+            return None
+        keys = ("m", "construction_ef", "search_ef", "k", "recall_at_k", "p50_ms", "p95_ms", "applied_at")
+        return dict(zip(keys, row))
+
+
+def tune_collection(client, collection, m: int, construction_ef: int, search_ef: int,
+                    k: Optional[int] = None, num_queries: Optional[int] = None,
+                    apply: bool = False, seed: int = 0, app_state=None) -> Dict[str, Any]:
+    """
+    以给定参数重建集合并评估 recall@k 与延迟。
+
+    Args:
+        client: chromadb 客户端（用于创建、删除与重命名集合）
+        collection: 待调优的集合（chromadb Collection 或 LangChain Chroma）
+        m / construction_ef / search_ef: 候选 HNSW 参数
+        k: recall@k 的 k
+        num_queries: 留出查询的数量
+        apply: 为 True 时用候选集合替换原集合并保存参数，否则评估后删除候选集合
+        seed: 抽取留出查询的随机种子
+        app_state: FastAPI 的 app.state；应用新参数时刷新其中持有原集合的对象
+
+    Returns:
+        当前集合与候选集合的参数、recall@k、p50 / p95 延迟及候选集合的构建耗时
+    """
+    from services.retrieval import get_distance_space
+    from services.vector_ingest import get_raw_collection
+    k = SEARCH_CONFIG["hnsw_tuning_k"] if k is None else k
+    num_queries = SEARCH_CONFIG["hnsw_tuning_queries"] if num_queries is None else num_queries
+    if min(m, construction_ef, search_ef, k, num_queries) < 1:
+        raise ValueError("HNSW 参数、k 与查询数必须为正整数。")
+
+    raw = get_raw_collection(collection)
+    num_chunks = raw.count()
+    if num_chunks < 2:
+        raise ValueError(f"集合 {raw.name} 中的文本块不足，无法评估。")
+    max_chunks = SEARCH_CONFIG["hnsw_tuning_max_chunks"]
+    if max_chunks and num_chunks > max_chunks:
+        # 调优需要完整复制集合并逐页暴力计算基准，耗时与磁盘占用都随集合大小增长
+        raise ValueError(f"集合 {raw.name} 有 {num_chunks} 个文本块，超过调优上限 {max_chunks}"
+                         f"（SEARCH_HNSW_TUNING_MAX_CHUNKS），请改用命令行离线调优或调高上限。")
+
+    from services.search_cache import index_generation
+    generation_before = index_generation.current()
+    space = get_distance_space(raw)
+    query_embeddings, query_ids = sample_queries(raw, num_queries, seed)
+    truth = exact_top_k(query_embeddings, raw, k, space, exclude_ids=query_ids)
+
+    params = {"m": m, "construction_ef": construction_ef, "search_ef": search_ef}
+    report = {
+        "collection": raw.name,
+        "num_chunks": num_chunks,
+        "num_queries": len(query_ids),
+        "k": k,
+        "space": space,
+        "current": {"params": current_hnsw_params(raw),
+                    **evaluate_collection(raw, query_embeddings, truth, k, exclude_ids=query_ids)},
+    }
+
+    start_time = time.perf_counter()
+    candidate = build_candidate_collection(client, raw, m, construction_ef, search_ef)
+    build_seconds = time.perf_counter() - start_time
+    try:
+        metrics = evaluate_collection(candidate, query_embeddings, truth, k, exclude_ids=query_ids)
+    except Exception:
+        client.delete_collection(candidate.name)
+        raise
+    report["candidate"] = {"params": params, "build_seconds": round(build_seconds, 3), **metrics}
+
+    if apply and raw.count() != num_chunks:
+        # 复制期间原集合有写入，候选集合缺少这些变化，不能用它替换原集合
+        client.delete_collection(candidate.name)
+        raise ValueError(f"集合 {raw.name} 在调优期间发生了变化，未应用新参数，请重新调优。")
+    if apply:
+        replace_collection(client, collection, candidate, app_state)
+        hnsw_params_store.save(raw.name, params, k, metrics)
+        # 集合已重建，缓存的检索结果与预过滤覆盖检查都需要失效；
+        # 文本块 id 与内容不变，词法索引与文本块计数在新代号下仍然可信
+        from services.chunk_counters import chunk_counter_service
+        from services.lexical_index import lexical_index
+        generation_after = index_generation.bump()
+        lexical_index.mark_synced(raw.name, generation_before, generation_after)
+        chunk_counter_service.mark_synced(generation_before, generation_after)
+        logger.info(f"集合 {raw.name} 已使用新的 HNSW 参数重建: {params}")
+    else:
+        client.delete_collection(candidate.name)
+    report["applied"] = apply
+    return report
+
+
+# --- 全局实例 ---
+hnsw_params_store = HnswParamsStore()
+
+
+if __name__ == "__main__":
+    import argparse, json
+    import chromadb
+    from .config import CHROMA_DB_CONFIG
+
+    parser = argparse.ArgumentParser(description="以给定的 HNSW 参数重建集合并评估 recall@k 与延迟")
+    parser.add_argument("collection", help="集合名称，例如 knowledge_base_small")
+    parser.add_argument("--m", type=int, default=16)
+    parser.add_argument("--construction-ef", type=int, default=100)
+    parser.add_argument("--search-ef", type=int, default=10)
+    parser.add_argument("--k", type=int, default=None)
+    parser.add_argument("--queries", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--apply", action="store_true", help="用新参数替换原集合并保存参数")
+    args = parser.parse_args()
+
+    chroma_client = chromadb.PersistentClient(path=CHROMA_DB_CONFIG["persist_directory"])
+    result = tune_collection(
+        chroma_client, chroma_client.get_collection(args.collection),
+        m=args.m, construction_ef=args.construction_ef, search_ef=args.search_ef,
+        k=args.k, num_queries=args.queries, apply=args.apply, seed=args.seed
+    )
+    print(json.dumps(result, ensure_ascii=False, indent=2))
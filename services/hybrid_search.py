@@ -0,0 +1,114 @@
+"""
+混合检索服务
+同时执行向量检索（Chroma ANN）与词法检索（SQLite FTS5 BM25），
+再用加权倒数排名融合（Reciprocal Rank Fusion）合并两路结果。
+两路检索都使用 build_where_clause 生成的同一组过滤条件。
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence
+
+from services.config import SEARCH_CONFIG
+from services.filter_utils import build_where_clause
+from services.lexical_index import lexical_index
+from services.retrieval import dense_query, fetch_chunks, get_default_embedder
+from services.vector_ingest import get_raw_collection
+
+# 两路检索并发执行所用的线程池
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="hybrid-search")
+
+
+def reciprocal_rank_fusion(ranked_lists: Sequence[Sequence[str]], weights: Optional[Sequence[float]] = None,
+                           k: int = 60) -> Dict[str, float]:
+    """
+    加权倒数排名融合：score(d) = Σ w_i / (k + rank_i(d))，rank 从 1 开始。
+
+    Args:
+        ranked_lists: 每个检索器按相关度排好序的 id 列表
+        weights: 每个检索器的权重，默认均为 1
+        k: 平滑常数，越大则排名靠后的结果与靠前的结果差距越小
+
+    Returns:
+        id -> 融合分数
+    """
+    weights = weights or [1.0] * len(ranked_lists)
+    scores: Dict[str, float] = {}
+    for ranked, weight in zip(ranked_lists, weights):
+        if weight <= 0:
+            continue
+        for rank, chunk_id in enumerate(ranked, start=1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + weight / (k + rank)
+    return scores
+
+
+def hybrid_search(collection, query: str, n_results: int = 10, filters: Optional[Dict[str, Any]] = None,
+                  dense_weight: Optional[float] = None, lexical_weight: Optional[float] = None,
+                  embedder=None, query_embedding=None) -> List[Dict[str, Any]]:
+    """
+    执行混合检索。
+
+    Args:
+        collection: 检索的集合（chromadb Collection 或 LangChain Chroma）
+        query: 查询文本
+        n_results: 返回的结果数
+        filters: 前端传入的过滤条件（SearchFilters 字典）
+        dense_weight / lexical_weight: 两路检索的融合权重，未指定时使用 SEARCH_CONFIG
+        embedder: 查询向量化使用的嵌入函数，默认使用跟随激活模型的 CustomEmbeddingFunction
+        query_embedding: 预先计算好的查询向量（批量检索时已统一编码），提供时不再调用 embedder
+
+    Returns:
+        按融合分数降序排列的结果列表，relevance_score 为融合分数相对于理论最大值的比例（0~1）。
+    """
+    dense_weight = SEARCH_CONFIG["hybrid_dense_weight"] if dense_weight is None else dense_weight
+    lexical_weight = SEARCH_CONFIG["hybrid_lexical_weight"] if lexical_weight is None else lexical_weight
+    k = SEARCH_CONFIG["rrf_k"]
+    candidates = max(n_results, n_results * SEARCH_CONFIG["hybrid_candidate_multiplier"])
+
+    raw = get_raw_collection(collection)
+    where = build_where_clause(filters) if filters else None
+    embedder = embedder or get_default_embedder()
+
+    def run_dense():
+        if dense_weight <= 0:
+            return []
+        vector = query_embedding if query_embedding is not None else embedder.embed_query_array(query)
+        return dense_query(raw, vector, candidates, where=where)[0]
+
+    def run_lexical():
+        if lexical_weight <= 0:
+            return []
+        # 其它进程写入后索引未对齐时在后台补齐，本次查询使用现有索引
+        lexical_index.schedule_catch_up(raw)
+        return lexical_index.search(query, raw.name, candidates, where=where)
+
+    dense_future = _executor.submit(run_dense)
+    lexical_future = _executor.submit(run_lexical)
+    dense_results = dense_future.result()
+    lexical_hits = lexical_future.result()
+
+    fused = reciprocal_rank_fusion(
+        [[r["chunk_id"] for r in dense_results], [chunk_id for chunk_id, _ in lexical_hits]],
+        [dense_weight, lexical_weight],
+        k=k,
+    )
+    top_ids = sorted(fused, key=fused.get, reverse=True)[:n_results]
+
+    # 仅被词法检索命中的文本块需要回表取内容
+    by_id = {r["chunk_id"]: r for r in dense_results}
+    dense_ids = set(by_id)
+    by_id.update(fetch_chunks(raw, [i for i in top_ids if i not in by_id]))
+
+    # 同时在两路中排第一即为理论最大分数
+    max_score = sum(w for w in (dense_weight, lexical_weight) if w > 0) / (k + 1)
+    lexical_scores = dict(lexical_hits)
+    results = []
+    for chunk_id in top_ids:
+        result = by_id.get(chunk_id)
+        if result is None:
+            # 词法索引中残留、向量库中已不存在的文本块
+            continue
+        result = dict(result)
+        result["dense_relevance"] = result["relevance_score"] if chunk_id in dense_ids else None
+        result["lexical_score"] = lexical_scores.get(chunk_id)
+        result["relevance_score"] = fused[chunk_id] / max_score if max_score > 0 else 0.0
+        results.append(result)
+    return results
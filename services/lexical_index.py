@@ -0,0 +1,352 @@
+"""
+词法索引服务
+基于 SQLite FTS5 为文本块建立全文索引，弥补纯向量检索对精确标识符、错误码和文件名的不敏感。
+本进程内对知识库集合的写入（包括已编译的向量存储服务经 LangChain 的入库）都经过
+services.vector_ingest 的入库钩子，索引随之增量更新，并把已对齐的索引代号推进到写入后的代号。
+其它进程的写入会使索引代号变化而未对齐，此时 schedule_catch_up() 在后台线程中执行 catch_up()：
+只分页读取 Chroma 的文本块 id 与索引比较，回表读取新增的文本块、删除已不存在的文本块，不阻塞查询。
+索引同时保存 build_where_clause 使用的文件级元数据，使词法检索同样遵守搜索过滤条件。
+"""
+import logging, sqlite3, threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from .config import LEXICAL_INDEX_DB_PATH
+
+logger = logging.getLogger(__name__)
+
+# 与 build_where_clause 生成的过滤字段一一对应
+FILTER_FIELDS = ("file_extension", "file_size", "last_modified", "creation_date")
+
+# where 子句中支持的比较运算符
+_SQL_OPERATORS = {"$eq": "=", "$ne": "!=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+
+
+def where_to_sql(where: Optional[Dict[str, Any]], allowed_fields=FILTER_FIELDS, alias: str = "") -> Tuple[str, list]:
+    """
+    将 Chroma 风格的 where 条件（$and / $or / $in / $nin / 比较运算）翻译为 SQL 条件与参数。
+    字段名只允许 allowed_fields 中的列，防止注入。
+    """
+    if not where:
+        return "1 = 1", []
+
+    prefix = f"{alias}." if alias else ""
+    clauses, params = [], []
+    for key, value in where.items():
+        if key in ("$and", "$or"):
+            parts = [where_to_sql(sub, allowed_fields, alias) for sub in value]
+            joiner = " AND " if key == "$and" else " OR "
+            clauses.append("(" + joiner.join(p[0] for p in parts) + ")")
+            for _, sub_params in parts:
+                params.extend(sub_params)
+            continue
+
+        if key not in allowed_fields:
+            raise ValueError(f"不支持的过滤字段: {key}")
+        column = f"{prefix}{key}"
+        conditions = value if isinstance(value, dict) else {"$eq": value}
+        for op, operand in conditions.items():
+            if op in ("$in", "$nin"):
+                if not operand:
+                    clauses.append("1 = 0" if op == "$in" else "1 = 1")
+                    continue
+                placeholders = ", ".join(["?"] * len(operand))
+                clauses.append(f"{column} {'IN' if op == '$in' else 'NOT IN'} ({placeholders})")
+                params.extend(operand)
+            elif op in _SQL_OPERATORS:
+                clauses.append(f"{column} {_SQL_OPERATORS[op]} ?")
+                params.append(operand)
+            else:
+                raise ValueError(f"不支持的过滤运算符: {op}")
+    return " AND ".join(clauses) if clauses else "1 = 1", params
+
+
+class LexicalIndex:
+    """SQLite FTS5 全文索引，按集合名称区分文本块。"""
+
+    def __init__(self, db_path: str = LEXICAL_INDEX_DB_PATH):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self.tokenizer = None
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        # 集合名称 -> 已与 Chroma 对齐时的索引代号
+        self._synced_generations: Dict[str, int] = {}
+        self._catch_up_lock = threading.Lock()
+        # 正在后台补齐的集合
+        self._pending_catch_ups = set()
+        self._init_db()
+
+    def _init_db(self):
+        c = self._conn.cursor()
+        # chunk_meta 的 rowid 同时作为 chunk_fts 的 rowid，两表通过它关联
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS chunk_meta (
+                rowid INTEGER PRIMARY KEY,
+                chunk_id TEXT NOT NULL,
+                collection_name TEXT NOT NULL,
+                file_id TEXT,
+                source_file TEXT,
+                file_extension TEXT,
+                file_size INTEGER,
+                last_modified REAL,
+                creation_date REAL,
+                UNIQUE (collection_name, chunk_id)
+            )
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_chunk_meta_file ON chunk_meta (collection_name, file_id)")
+        # 元数据预过滤（services.prefilter）按这些字段筛选候选文本块
+        for field in FILTER_FIELDS:
+            c.execute(f"CREATE INDEX IF NOT EXISTS idx_chunk_meta_{field} ON chunk_meta (collection_name, {field})")
+        # trigram 分词可以匹配标识符和中文的任意子串；较旧的 SQLite 不支持时退回 unicode61
+        try:
+            c.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS chunk_fts USING fts5(content, tokenize = 'trigram')
+            """)
+            self.tokenizer = "trigram"
+        except sqlite3.OperationalError:
+            c.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS chunk_fts USING fts5(content, tokenize = 'unicode61')
+            """)
+            self.tokenizer = "unicode61"
+        row = c.execute("SELECT sql FROM sqlite_master WHERE name = 'chunk_fts'").fetchone()
+        if row and "trigram" not in row[0]:
+            self.tokenizer = "unicode61"
+        self._conn.commit()
+
+    # ------------------------------------------------------------------
+    # 写入
+    # ------------------------------------------------------------------
+    def upsert(self, collection_name: str, ids: List[str], documents: List[str],
+               metadatas: Optional[List[Dict[str, Any]]] = None):
+        """写入（或覆盖）文本块的全文索引与过滤元数据。"""
+        metadatas = metadatas or [{}] * len(ids)
+        with self._lock:
+            c = self._conn.cursor()
+            self._delete_rows(c, collection_name, ids)
+            for chunk_id, document, meta in zip(ids, documents, metadatas):
+                meta = meta or {}
+                c.execute("""
+                    INSERT INTO chunk_meta
+                        (chunk_id, collection_name, file_id, source_file, file_extension, file_size, last_modified, creation_date)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """, (chunk_id, collection_name, meta.get("file_id"), meta.get("source_file") or meta.get("source"),
+                      *[meta.get(field) for field in FILTER_FIELDS]))
+                c.execute("INSERT INTO chunk_fts (rowid, content) VALUES (?, ?)", (c.lastrowid, document or ""))
+            self._conn.commit()
+
+    @staticmethod
+    def _delete_rows(c, collection_name: str, ids: List[str]):
+        rowids = []
+        for start in range(0, len(ids), 900):
+            part = ids[start:start + 900]
+            placeholders = ", ".join(["?"] * len(part))
+            rowids.extend(row[0] for row in c.execute(
+                f"SELECT rowid FROM chunk_meta WHERE collection_name = ? AND chunk_id IN ({placeholders})",
+                [collection_name, *part]
+            ))
+        c.executemany("DELETE FROM chunk_fts WHERE rowid = ?", [(r,) for r in rowids])
+        c.executemany("DELETE FROM chunk_meta WHERE rowid = ?", [(r,) for r in rowids])
+
+    def count(self, collection_name: str) -> int:
+        """返回集合在索引中的文本块数量。"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM chunk_meta WHERE collection_name = ?", (collection_name,)
+            ).fetchone()[0]
+
+    def match_filter(self, collection_name: str, where: Optional[Dict[str, Any]],
+                     limit: Optional[int] = None) -> Tuple[int, List[str], List[str]]:
+        """
+        按 Chroma 风格的 where 条件筛选文本块。
+
+        Returns:
+            (命中的文本块总数, 命中的文本块 id（总数不超过 limit 时才返回）, 命中的文件 id)
+        """
+        where_sql, where_params = where_to_sql(where)
+        base = f"FROM chunk_meta WHERE collection_name = ? AND {where_sql}"
+        params = [collection_name, *where_params]
+        with self._lock:
+            total = self._conn.execute(f"SELECT COUNT(*) {base}", params).fetchone()[0]
+            chunk_ids, file_ids = [], []
+            if total and (limit is None or total <= limit):
+                chunk_ids = [row[0] for row in self._conn.execute(f"SELECT chunk_id {base}", params)]
+                file_ids = [row[0] for row in self._conn.execute(
+                    f"SELECT DISTINCT file_id {base} AND file_id IS NOT NULL", params)]
+        return total, chunk_ids, file_ids
+
+    def delete(self, collection_name: str, ids: Optional[List[str]] = None, file_id: Optional[str] = None):
+        """按文本块 id 或文件 id 删除索引。"""
+        with self._lock:
+            c = self._conn.cursor()
+            if file_id is not None:
+                ids = [row[0] for row in c.execute(
+                    "SELECT chunk_id FROM chunk_meta WHERE collection_name = ? AND file_id = ?",
+                    (collection_name, file_id)
+                )]
+            if not ids:
+                return
+            self._delete_rows(c, collection_name, ids)
+            self._conn.commit()
+
+    def clear(self, collection_name: Optional[str] = None):
+        """清空指定集合（或全部集合）的索引。"""
+        with self._catch_up_lock:
+            if collection_name is None:
+                self._synced_generations.clear()
+            else:
+                self._synced_generations.pop(collection_name, None)
+        with self._lock:
+            c = self._conn.cursor()
+            if collection_name is None:
+                c.execute("DELETE FROM chunk_fts")
+                c.execute("DELETE FROM chunk_meta")
+            else:
+                c.execute(
+                    "DELETE FROM chunk_fts WHERE rowid IN (SELECT rowid FROM chunk_meta WHERE collection_name = ?)",
+                    (collection_name,)
+                )
+                c.execute("DELETE FROM chunk_meta WHERE collection_name = ?", (collection_name,))
+            self._conn.commit()
+
+    def rebuild_from_collection(self, collection, collection_name: str, page_size: int = 1000) -> int:
+        """从 Chroma 集合全量重建索引，用于为已有知识库补建词法索引。"""
+        from services.vector_ingest import get_raw_collection
+        raw = get_raw_collection(collection)
+        self.clear(collection_name)
+        offset, total = 0, 0
+        while True:
+            page = raw.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+            if not page["ids"]:
+                break
+            self.upsert(collection_name, page["ids"], page["documents"], page["metadatas"])
+            total += len(page["ids"])
+            offset += page_size
+        return total
+
+    def mark_synced(self, collection_name: str, from_generation: int, to_generation: int):
+        """
+        入库钩子写入并递增索引代号后调用：写入前已对齐的索引已包含本次写入，推进到新代号。
+        写入前就未对齐的索引保持未对齐，由后台补齐。
+        """
+        with self._catch_up_lock:
+            if self._synced_generations.get(collection_name) == from_generation:
+                self._synced_generations[collection_name] = to_generation
+
+    def is_synced(self, collection_name: str, generation: int) -> bool:
+        """索引是否已与 generation 这一索引代号下的 Chroma 集合对齐。"""
+        return self._synced_generations.get(collection_name) == generation
+
+    def schedule_catch_up(self, collection) -> bool:
+        """
+        索引已与当前索引代号对齐时返回 True；否则在后台线程中执行 catch_up() 并返回 False，
+        调用方直接使用现有索引，不在请求路径上扫描 Chroma。
+        """
+        from services.search_cache import index_generation
+        from services.vector_ingest import get_raw_collection
+        raw = get_raw_collection(collection)
+        if self.is_synced(raw.name, index_generation.current()):
+            return True
+        with self._catch_up_lock:
+            if raw.name in self._pending_catch_ups:
+                return False
+            self._pending_catch_ups.add(raw.name)
+
+        def _run():
+            try:
+                self.catch_up(raw)
+            except Exception as e:
+                logger.warning(f"集合 {raw.name} 的词法索引补齐失败: {e}")
+            finally:
+                with self._catch_up_lock:
+                    self._pending_catch_ups.discard(raw.name)
+
+        threading.Thread(target=_run, name=f"lexical-catch-up-{raw.name}", daemon=True).start()
+        return False
+
+    def catch_up(self, collection, page_size: int = 5000) -> Dict[str, int]:
+        """
+        使索引与 Chroma 集合的文本块 id 保持一致（当前索引代号已对齐时直接返回）。
+        只分页读取 id，回表读取索引中缺少的文本块，删除 Chroma 中已不存在的文本块。
+        同一 id 的原地修改由入库钩子同步；其它进程的原地修改需通过 /lexical-index/rebuild 重建。
+
+        Returns:
+            {"added": 写入的文本块数, "removed": 删除的文本块数}
+        """
+        from services.search_cache import index_generation
+        from services.vector_ingest import get_raw_collection
+        raw = get_raw_collection(collection)
+        generation = index_generation.current()
+        if self.is_synced(raw.name, generation):
+            return {"added": 0, "removed": 0}
+
+        remote_ids: List[str] = []
+        offset = 0
+        while True:
+            page = raw.get(include=[], limit=page_size, offset=offset)
+            if not page["ids"]:
+                break
+            remote_ids.extend(page["ids"])
+            offset += page_size
+        with self._lock:
+            local_ids = {row[0] for row in self._conn.execute(
+                "SELECT chunk_id FROM chunk_meta WHERE collection_name = ?", (raw.name,)
+            )}
+
+        remote = set(remote_ids)
+        added = [chunk_id for chunk_id in remote_ids if chunk_id not in local_ids]
+        removed = [chunk_id for chunk_id in local_ids if chunk_id not in remote]
+        for start in range(0, len(added), 500):
+            page = raw.get(ids=added[start:start + 500], include=["documents", "metadatas"])
+            self.upsert(raw.name, page["ids"], page["documents"], page["metadatas"])
+        if removed:
+            self.delete(raw.name, ids=removed)
+        with self._catch_up_lock:
+            # 扫描期间入库钩子已推进的代号不回退；期间若有其它进程写入，代号已变化，下次查询会再次补齐
+            current = self._synced_generations.get(raw.name)
+            if current is None or current < generation:
+                self._synced_generations[raw.name] = generation
+        return {"added": len(added), "removed": len(removed)}
+
+    # ------------------------------------------------------------------
+    # 查询
+    # ------------------------------------------------------------------
+    def _build_match_expression(self, query: str) -> Optional[str]:
+        """把用户输入转换为 FTS5 MATCH 表达式：每个词作为短语引用，词之间取 OR。"""
+        terms = [t for t in query.split() if t]
+        if self.tokenizer == "trigram":
+            # trigram 分词要求每个词至少 3 个字符
+            terms = [t for t in terms if len(t) >= 3]
+        if not terms:
+            return None
+        return " OR ".join('"' + t.replace('"', '""') + '"' for t in terms)
+
+    def search(self, query: str, collection_name: str, n_results: int,
+               where: Optional[Dict[str, Any]] = None) -> List[Tuple[str, float]]:
+        """
+        执行 BM25 全文检索，返回 (chunk_id, bm25 分数) 列表，分数越大越相关。
+        where 使用与 Chroma 相同的过滤条件。
+        """
+        match = self._build_match_expression(query)
+        if match is None:
+            return []
+        where_sql, where_params = where_to_sql(where, alias="m")
+        sql = f"""
+            SELECT m.chunk_id, bm25(chunk_fts) AS score
+            FROM chunk_fts
+            JOIN chunk_meta m ON m.rowid = chunk_fts.rowid
+            WHERE chunk_fts MATCH ? AND m.collection_name = ? AND {where_sql}
+            ORDER BY score
+            LIMIT ?
+        """
+        with self._lock:
+            try:
+                rows = self._conn.execute(sql, [match, collection_name, *where_params, n_results]).fetchall()
+            except sqlite3.OperationalError:
+                return []
+        # SQLite 的 bm25() 越小越相关，这里取反
+        return [(chunk_id, -score) for chunk_id, score in rows]
+
+
+# --- 全局实例 ---
+lexical_index = LexicalIndex()
@@ -0,0 +1,145 @@
+"""
+最大边际相关性（MMR）多样化
+在 ANN 候选集合上按 λ·sim(q, d) - (1-λ)·max sim(d, 已选) 贪心选取结果，
+减少同一文件中近似重复的文本块占用结果名额。
+相似度全部以 NumPy 矩阵运算批量计算，不存在逐对的 Python 循环。
+通过 SearchFilters.RelevanceSorting = "mmr" 启用。
+"""
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from services.config import SEARCH_CONFIG
+from services.retrieval import fetch_chunks
+
+MMR_SORTING = "mmr"
+
+
+def is_mmr_requested(filters: Optional[Dict[str, Any]]) -> bool:
+    """前端过滤条件中 RelevanceSorting 为 "mmr" 时启用多样化。"""
+    return bool(filters) and str(filters.get("RelevanceSorting") or "").lower() == MMR_SORTING
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def mmr_select(query_embedding: np.ndarray, candidate_embeddings: np.ndarray, k: int,
+               lambda_mult: float = 0.5) -> List[int]:
+    """
+    返回按 MMR 选出的候选下标（按选中顺序排列）。
+
+    每轮只做一次矩阵-向量乘法，用新选中的候选更新所有候选的“与已选集合的最大相似度”，
+    总开销为 O(k·n·d)，且全部在 NumPy 内完成。
+    """
+    candidates = np.asarray(candidate_embeddings, dtype=np.float32)
+    n = len(candidates)
+    if n == 0 or k <= 0:
+        return []
+    k = min(k, n)
+    candidates = _normalize_rows(candidates)
+    query = _normalize_rows(np.asarray(query_embedding, dtype=np.float32).reshape(1, -1))[0]
+
+    relevance = candidates @ query
+    max_similarity = np.full(n, -np.inf, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    selected: List[int] = []
+
+    for step in range(k):
+        if step == 0:
+            scores = relevance
+        else:
+            scores = lambda_mult * relevance - (1.0 - lambda_mult) * max_similarity
+        scores = np.where(available, scores, -np.inf)
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_similarity, candidates @ candidates[best], out=max_similarity)
+    return selected
+
+
+def mmr_rerank(collection, results: List[Dict[str, Any]], query_embedding: np.ndarray, n_results: int,
+               lambda_mult: Optional[float] = None) -> List[Dict[str, Any]]:
+    """
+    对候选结果执行 MMR，返回 n_results 条结果（不含向量字段）。
+    候选中缺少 "embedding" 的结果会按 id 从集合中补取。
+    """
+    if not results:
+        return []
+    lambda_mult = SEARCH_CONFIG["mmr_lambda"] if lambda_mult is None else lambda_mult
+
+    missing = [r["chunk_id"] for r in results if r.get("embedding") is None]
+    if missing:
+        fetched = fetch_chunks(collection, missing, include_embeddings=True)
+        results = [dict(r, embedding=fetched[r["chunk_id"]]["embedding"])
+                   if r.get("embedding") is None and r["chunk_id"] in fetched else r for r in results]
+    results = [r for r in results if r.get("embedding") is not None]
+    if not results:
+        return []
+
+    order = mmr_select(query_embedding, np.stack([r["embedding"] for r in results]), n_results, lambda_mult)
+    return [strip_embedding(results[i]) for i in order]
+
+
+def strip_embedding(result: Dict[str, Any]) -> Dict[str, Any]:
+    """去掉结果中的向量字段（ndarray 无法序列化为 JSON）。"""
+    if "embedding" not in result:
+        return result
+    result = dict(result)
+    result.pop("embedding")
+    return result
+
+
+def _mmr_select_loop(query_embedding: np.ndarray, candidate_embeddings: np.ndarray, k: int,
+                     lambda_mult: float = 0.5) -> List[int]:
+    """逐对计算相似度的参考实现，仅用于基准测试对比。"""
+    candidates = _normalize_rows(np.asarray(candidate_embeddings, dtype=np.float32))
+    query = _normalize_rows(np.asarray(query_embedding, dtype=np.float32).reshape(1, -1))[0]
+    relevance = [float(np.dot(c, query)) for c in candidates]
+    selected: List[int] = []
+    while len(selected) < min(k, len(candidates)):
+        best, best_score = -1, -np.inf
+        for i in range(len(candidates)):
+            if i in selected:
+                continue
+            redundancy = max((float(np.dot(candidates[i], candidates[j])) for j in selected), default=0.0)
+            score = relevance[i] if not selected else lambda_mult * relevance[i] - (1 - lambda_mult) * redundancy
+            if score > best_score:
+                best, best_score = i, score
+        selected.append(best)
+    return selected
+
+
+def benchmark_mmr(candidate_counts: Sequence[int] = (50, 200, 1000), dim: int = 1024, k: int = 10,
+                  repeats: int = 20, include_loop: bool = True) -> List[dict]:
+    """测量向量化 MMR 在不同候选数量下的延迟，并与逐对循环的参考实现对比。"""
+    rng = np.random.default_rng(0)
+    rows = []
+    for n in candidate_counts:
+        candidates = rng.standard_normal((n, dim), dtype=np.float32)
+        query = rng.standard_normal(dim, dtype=np.float32)
+
+        mmr_select(query, candidates, k)
+        start_time = time.perf_counter()
+        for _ in range(repeats):
+            vectorized = mmr_select(query, candidates, k)
+        vectorized_ms = (time.perf_counter() - start_time) * 1000 / repeats
+
+        row = {"candidates": n, "dim": dim, "k": k, "vectorized_ms": round(vectorized_ms, 3)}
+        if include_loop:
+            start_time = time.perf_counter()
+            reference = _mmr_select_loop(query, candidates, k)
+            loop_ms = (time.perf_counter() - start_time) * 1000
+            row["loop_ms"] = round(loop_ms, 3)
+            row["speedup"] = round(loop_ms / vectorized_ms, 1) if vectorized_ms > 0 else None
+            row["same_selection"] = reference == vectorized
+        rows.append(row)
+    return rows
+
+
+if __name__ == "__main__":
+    for row in benchmark_mmr():
+        print(row)
@@ -0,0 +1,154 @@
+"""
+父块上下文扩展（由细到粗检索）
+先在 knowledge_base_small 中检索以保证精度，再根据分块偏移量把命中的小块映射到同一文件中
+覆盖它的大块（knowledge_base_large），返回去重后的父块作为更完整的上下文。
+父块按 id 直接读取，不需要第二次 ANN 查询；文件的大块布局与父块内容都缓存在有界 LRU 中。
+"""
+import bisect, threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from services.config import SEARCH_CONFIG
+from services.retrieval import fetch_chunks
+from services.search_cache import index_generation
+
+SMALL_COLLECTION_NAME = "knowledge_base_small"
+LARGE_COLLECTION_NAME = "knowledge_base_large"
+
+
+class _LRU:
+    """带索引代号的简单 LRU，代号变化时整体失效。"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Any, Any]" = OrderedDict()
+        self._generation: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+
+    def sync(self, generation: int):
+        if generation != self._generation:
+            self._entries.clear()
+            self._generation = generation
+
+    def get(self, key):
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ParentChunkResolver:
+    """把小块命中解析为父块，并缓存文件分块布局与父块内容。"""
+
+    def __init__(self, max_parent_chunks: int = 1024, max_file_layouts: int = 256):
+        self._lock = threading.Lock()
+        self._parents = _LRU(max_parent_chunks)
+        # file_id -> (大块起始偏移列表, 大块 (chunk_uuid, offset, chunk_size) 列表, 小块 chunk_uuid -> offset)
+        self._layouts = _LRU(max_file_layouts)
+
+    def _load_layout(self, file_id: str) -> Tuple[List[int], List[Tuple[str, int, int]], Dict[str, int]]:
+        from services.db_service import DBService
+        chunks = DBService().get_chunks_by_file_id(file_id) or []
+        large = sorted(
+            ((c["chunk_uuid"], c["offset"], c["chunk_size"]) for c in chunks
+             if c.get("collection_name") == LARGE_COLLECTION_NAME),
+            key=lambda item: item[1]
+        )
+        small_offsets = {c["chunk_uuid"]: c["offset"] for c in chunks
+                         if c.get("collection_name") == SMALL_COLLECTION_NAME}
+        return [offset for _, offset, _ in large], large, small_offsets
+
+    def _get_layout(self, file_id: str):
+        with self._lock:
+            layout = self._layouts.get(file_id)
+        if layout is None:
+            layout = self._load_layout(file_id)
+            with self._lock:
+                self._layouts.put(file_id, layout)
+        return layout
+
+    def find_parent_id(self, small_result: Dict[str, Any]) -> Optional[str]:
+        """根据小块的文件 id 与偏移量找到覆盖它的大块 id。"""
+        metadata = small_result.get("metadata") or {}
+        file_id = metadata.get("file_id")
+        if not file_id:
+            return None
+        starts, large, small_offsets = self._get_layout(file_id)
+        if not large:
+            return None
+        offset = metadata.get("offset")
+        if offset is None:
+            offset = small_offsets.get(small_result.get("chunk_id"))
+        if offset is None:
+            return None
+        # 起始偏移不大于小块偏移的最后一个大块即为其父块
+        position = max(0, bisect.bisect_right(starts, offset) - 1)
+        return large[position][0]
+
+    def expand(self, results: List[Dict[str, Any]], large_collection) -> List[Dict[str, Any]]:
+        """
+        把小块结果替换为去重后的父块结果，按父块下最佳小块的相关度排序。
+        无法定位父块的结果保持原样返回。
+        """
+        generation = index_generation.current()
+        with self._lock:
+            self._parents.sync(generation)
+            self._layouts.sync(generation)
+
+        parent_ids = [self.find_parent_id(result) for result in results]
+
+        with self._lock:
+            parents = {pid: self._parents.get(pid) for pid in set(parent_ids) if pid is not None}
+        missing = [pid for pid, parent in parents.items() if parent is None]
+        if missing:
+            fetched = fetch_chunks(large_collection, missing)
+            with self._lock:
+                for pid, parent in fetched.items():
+                    self._parents.put(pid, parent)
+            parents.update(fetched)
+
+        expanded: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        for result, parent_id in zip(results, parent_ids):
+            parent = parents.get(parent_id) if parent_id is not None else None
+            if parent is None:
+                expanded.setdefault(result.get("chunk_id"), dict(result))
+                continue
+            entry = expanded.get(parent_id)
+            if entry is None:
+                entry = dict(parent)
+                entry["relevance_score"] = result.get("relevance_score")
+                entry["matched_chunks"] = []
+                expanded[parent_id] = entry
+            entry["matched_chunks"].append({
+                "chunk_id": result.get("chunk_id"),
+                "content": result.get("content"),
+                "relevance_score": result.get("relevance_score"),
+            })
+        # 输入已按相关度降序排列，第一次出现的小块决定父块的相关度与顺序
+        return list(expanded.values())
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "parent_chunks": len(self._parents),
+                "parent_hits": self._parents.hits,
+                "parent_misses": self._parents.misses,
+                "file_layouts": len(self._layouts),
+            }
+
+
+# --- 全局实例 ---
+parent_chunk_resolver = ParentChunkResolver(SEARCH_CONFIG["parent_cache_max_chunks"])
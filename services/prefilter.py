@@ -0,0 +1,135 @@
+"""
+元数据预过滤
+带过滤条件的检索先在 SQLite 侧索引（词法索引的 chunk_meta 表，字段与 build_where_clause 一致）
+中计算候选文件与文本块集合，再决定检索策略：
+    - 没有任何文本块满足条件：直接返回空结果，不访问 Chroma；
+    - 候选文本块数量不超过阈值：按 id 取回这些文本块的向量，用 NumPy 精确暴力打分；
+    - 其它情况：交给 Chroma 在 ANN 查询中按 where 过滤。
+只有侧索引已与当前索引代号对齐、且其文本块数量与 Chroma 集合一致时才使用侧索引规划，否则退回 Chroma 过滤。
+侧索引落后时在后台补齐（不在请求路径上扫描 Chroma）；覆盖结论按 (集合, 索引代号) 缓存，
+索引代号不变时规划不再读取 Chroma。
+"""
+import threading
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from services.config import SEARCH_CONFIG
+from services.lexical_index import lexical_index
+
+
+@dataclass
+class FilterPlan:
+    """过滤检索的执行计划"""
+    strategy: str  # "empty" / "brute_force" / "ann"
+    matched_chunks: int = 0
+    chunk_ids: List[str] = field(default_factory=list)
+    file_ids: List[str] = field(default_factory=list)
+
+
+class FilterPlanner:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = Counter()
+        # 集合名 -> (索引代号, 侧索引是否覆盖该集合)
+        self._coverage: Dict[str, Tuple[int, bool]] = {}
+
+    def _is_covered(self, raw) -> bool:
+        from services.search_cache import index_generation
+        # 读取索引代号时会感知其它进程对 Chroma 的写入，代号不变则覆盖结论不变
+        generation = index_generation.current()
+        with self._lock:
+            cached = self._coverage.get(raw.name)
+        if cached is not None and cached[0] == generation:
+            return cached[1]
+        if not lexical_index.is_synced(raw.name, generation):
+            # 侧索引落后：本次交给 Chroma 过滤，补齐在后台进行，结论不缓存
+            lexical_index.schedule_catch_up(raw)
+            return False
+        covered = lexical_index.count(raw.name) == raw.count()
+        with self._lock:
+            self._coverage[raw.name] = (generation, covered)
+        return covered
+
+    def plan(self, raw, where: Optional[Dict[str, Any]]) -> FilterPlan:
+        """为带 where 条件的检索生成执行计划。"""
+        if not where or not self._is_covered(raw):
+            return self._record(FilterPlan("ann"))
+        try:
+            matched, chunk_ids, file_ids = lexical_index.match_filter(
+                raw.name, where, limit=SEARCH_CONFIG["prefilter_brute_force_max_chunks"]
+            )
+        except ValueError:
+            # 侧索引不支持的过滤字段，交给 Chroma 处理
+            return self._record(FilterPlan("ann"))
+        if matched == 0:
+            return self._record(FilterPlan("empty"))
+        if chunk_ids:
+            return self._record(FilterPlan("brute_force", matched, chunk_ids, file_ids))
+        return self._record(FilterPlan("ann", matched))
+
+    def _record(self, plan: FilterPlan) -> FilterPlan:
+        with self._lock:
+            self._stats[plan.strategy] += 1
+        return plan
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "brute_force_max_chunks": SEARCH_CONFIG["prefilter_brute_force_max_chunks"],
+                "strategies": dict(self._stats),
+            }
+
+
+def exact_distances(query_embeddings: np.ndarray, vectors: np.ndarray, space: str = "l2") -> np.ndarray:
+    """
+    精确计算每条查询与每个向量的距离矩阵 (查询数, 向量数)。
+    与 Chroma 的距离定义保持一致：l2 为平方欧氏距离，cosine 为 1 - cos，ip 为 1 - 内积。
+    """
+    queries = np.asarray(query_embeddings, dtype=np.float32)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if space == "l2":
+        return (
+            (queries ** 2).sum(axis=1, keepdims=True)
+            - 2.0 * queries @ vectors.T
+            + (vectors ** 2).sum(axis=1)[None, :]
+        )
+    if space == "cosine":
+        q = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        v = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return 1.0 - q @ v.T
+    return 1.0 - queries @ vectors.T
+
+
+def brute_force_query(raw, query_embeddings: np.ndarray, chunk_ids: List[str], n_results: int,
+                      include_embeddings: bool = False) -> List[List[Dict[str, Any]]]:
+    """在给定的文本块集合上精确计算距离，返回与 dense_query 相同结构的结果。"""
+    from services.retrieval import distance_to_relevance, format_result, get_distance_space
+
+    response = raw.get(ids=chunk_ids, include=["documents", "metadatas", "embeddings"])
+    if not response["ids"]:
+        return [[] for _ in range(len(query_embeddings))]
+    vectors = np.asarray(response["embeddings"], dtype=np.float32)
+    space = get_distance_space(raw)
+    distances = exact_distances(query_embeddings, vectors, space)
+
+    k = min(n_results, len(response["ids"]))
+    all_results = []
+    for row in distances:
+        top = np.argpartition(row, k - 1)[:k] if k < len(row) else np.arange(len(row))
+        top = top[np.argsort(row[top])]
+        results = []
+        for i in top:
+            result = format_result(response["ids"][i], response["documents"][i], response["metadatas"][i],
+                                   distance_to_relevance(float(row[i]), space))
+            if include_embeddings:
+                result["embedding"] = vectors[i]
+            results.append(result)
+        all_results.append(results)
+    return all_results
+
+
+# --- 全局实例 ---
+filter_planner = FilterPlanner()
@@ -0,0 +1,78 @@
+"""
+进度发布器
+后台线程（模型下载、模型热切换等）推送进度状态，SSE 订阅者通过 asyncio.Queue 被动接收，
+等待期间不需要任何轮询。每个订阅队列只保留最新的若干条状态，慢速客户端不会拖累发布方。
+"""
+import asyncio, threading, copy
+from typing import Any, Dict, Optional
+
+
+class ProgressPublisher:
+    """线程安全的进度发布器，按 key（例如模型名称）区分不同任务。"""
+
+    def __init__(self, queue_size: int = 16):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._states: Dict[str, dict] = {}
+        # key -> {asyncio.Queue: 事件循环}
+        self._subscribers: Dict[str, Dict[asyncio.Queue, asyncio.AbstractEventLoop]] = {}
+
+    def get(self, key: str, default: Optional[dict] = None) -> Optional[dict]:
+        """返回指定任务的最新状态副本。"""
+        with self._lock:
+            state = self._states.get(key)
+            return copy.deepcopy(state) if state is not None else default
+
+    def publish(self, key: str, state: dict):
+        """保存最新状态并推送给所有订阅者，可在任意线程中调用。"""
+        snapshot = copy.deepcopy(state)
+        with self._lock:
+            self._states[key] = snapshot
+            subscribers = list(self._subscribers.get(key, {}).items())
+        for subscriber_queue, loop in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._offer, subscriber_queue, snapshot)
+            except RuntimeError:
+                # 事件循环已关闭，订阅者会在断开时自行注销
+                continue
+
+    def update(self, key: str, **fields: Any) -> dict:
+        """在最新状态基础上更新部分字段并发布。"""
+        with self._lock:
+            state = copy.deepcopy(self._states.get(key, {}))
+        state.update(fields)
+        self.publish(key, state)
+        return state
+
+    @staticmethod
+    def _offer(subscriber_queue: asyncio.Queue, state: dict):
+        # 队列已满时丢弃最旧的状态，订阅者总能拿到最新进度
+        while subscriber_queue.full():
+            try:
+                subscriber_queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+        subscriber_queue.put_nowait(state)
+
+    def subscribe(self, key: str) -> asyncio.Queue:
+        """在当前事件循环中订阅指定任务，当前状态（如有）会立即放入队列。"""
+        loop = asyncio.get_running_loop()
+        subscriber_queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._subscribers.setdefault(key, {})[subscriber_queue] = loop
+            current = self._states.get(key)
+            if current is not None:
+                subscriber_queue.put_nowait(copy.deepcopy(current))
+        return subscriber_queue
+
+    def unsubscribe(self, key: str, subscriber_queue: asyncio.Queue):
+        with self._lock:
+            subscribers = self._subscribers.get(key)
+            if subscribers is not None:
+                subscribers.pop(subscriber_queue, None)
+                if not subscribers:
+                    del self._subscribers[key]
+
+    def subscriber_count(self, key: str) -> int:
+        with self._lock:
+            return len(self._subscribers.get(key, {}))
@@ -0,0 +1,227 @@
+"""
+交叉编码器重排
+对检索得到的前 K 条候选用本地缓存的交叉编码器（CPU）重新打分。
+候选按文本长度排序后分批推理以减少补齐开销；每个请求有硬性的时间预算，
+预算用尽时返回部分重排的结果。重排分数按 (查询哈希, 文本块 id) 缓存。
+
+模型在后台线程中预加载，加载完成前的请求不重排（统计信息中 model_loading 为 True），
+加载耗时不会落在任何请求上。重排后 rerank_score 为交叉编码器的原始 logit，
+relevance_score 为其 sigmoid（0~1，与向量检索的相关度同一量纲），dense_relevance 保留重排前的相关度。
+"""
+import hashlib, inspect, logging, math, threading, time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from services.config import SEARCH_CONFIG
+from services.search_cache import normalize_query
+
+logger = logging.getLogger(__name__)
+
+
+def _query_hash(query: str) -> str:
+    return hashlib.sha256(normalize_query(query).encode("utf-8")).hexdigest()
+
+
+def _chunk_key(result: Dict[str, Any]) -> str:
+    # SearchService 返回的结果可能没有 chunk_id，此时以内容哈希代替
+    chunk_id = result.get("chunk_id")
+    if chunk_id:
+        return chunk_id
+    return "sha256:" + hashlib.sha256((result.get("content") or "").encode("utf-8")).hexdigest()
+
+
+def _sigmoid(logit: float) -> float:
+    if logit >= 0:
+        return 1.0 / (1.0 + math.exp(-logit))
+    z = math.exp(logit)
+    return z / (1.0 + z)
+
+
+class CrossEncoderReranker:
+    """懒加载的 CPU 交叉编码器，附带重排分数缓存与统计。"""
+
+    def __init__(self, model_name: str, batch_size: int = 8, cache_max_entries: int = 20000):
+        self.model_name = model_name
+        self.batch_size = max(1, batch_size)
+        self.cache_max_entries = cache_max_entries
+        self._model = None
+        self._predict_kwargs: Dict[str, Any] = {}
+        self._load_lock = threading.Lock()
+        self._load_thread: Optional[threading.Thread] = None
+        self._load_error: Optional[str] = None
+        # 交叉编码器推理本身不是线程安全的，同一时间只允许一个请求打分
+        self._predict_lock = threading.Lock()
+        self._cache_lock = threading.Lock()
+        self._cache: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._stats = {"requests": 0, "partial": 0, "scored": 0, "cache_hits": 0, "cache_misses": 0,
+                       "skipped_loading": 0, "lock_timeouts": 0}
+
+    def preload(self):
+        """在后台线程中加载模型（重复调用无副作用）。"""
+        with self._load_lock:
+            if self._model is not None or self._load_error is not None or self._load_thread is not None:
+                return
+            self._load_thread = threading.Thread(target=self._load_model, name="reranker-preload", daemon=True)
+            self._load_thread.start()
+
+    def _load_model(self):
+        try:
+            from sentence_transformers import CrossEncoder
+            import torch
+            # 只使用本地已缓存的模型，搜索请求中不触发下载
+            model = CrossEncoder(self.model_name, device="cpu", local_files_only=True)
+            # 单输出的交叉编码器默认会套一层 sigmoid；这里取原始 logit，由 rerank() 统一换算
+            parameters = inspect.signature(model.predict).parameters
+            for name in ("activation_fn", "activation_fct"):
+                if name in parameters:
+                    self._predict_kwargs = {name: torch.nn.Identity()}
+                    break
+            self._model = model
+        except Exception as e:
+            self._load_error = str(e)
+            logger.warning("交叉编码器 %s 加载失败，重排已停用: %s", self.model_name, e)
+
+    def _ready_model(self):
+        """返回已加载的模型；尚未加载完成（或加载失败）时返回 None 并确保后台加载已开始。"""
+        if self._model is None:
+            self.preload()
+        return self._model
+
+    def _cache_get(self, key: Tuple[str, str]) -> Optional[float]:
+        with self._cache_lock:
+            score = self._cache.get(key)
+            if score is not None:
+                self._cache.move_to_end(key)
+            return score
+
+    def _cache_put(self, key: Tuple[str, str], score: float):
+        with self._cache_lock:
+            self._cache[key] = score
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_max_entries:
+                self._cache.popitem(last=False)
+
+    def rerank(self, query: str, results: List[Dict[str, Any]], top_k: Optional[int] = None,
+               budget_ms: Optional[float] = None) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        重排前 top_k 条结果。
+
+        已打分的候选在它们原本占据的位置之间按重排分数重新排列，未能在预算内打分的候选保持原位，
+        因此部分重排不会把未打分的结果挤到末尾。
+
+        Returns:
+            (重排后的结果列表, 本次重排的统计信息)
+        """
+        start_time = time.perf_counter()
+        top_k = SEARCH_CONFIG["rerank_top_k"] if top_k is None else top_k
+        budget_ms = SEARCH_CONFIG["rerank_budget_ms"] if budget_ms is None else budget_ms
+        deadline = start_time + budget_ms / 1000.0
+
+        head, tail = [dict(r) for r in results[:top_k]], results[top_k:]
+        query_hash = _query_hash(query)
+        keys = [(query_hash, _chunk_key(r)) for r in head]
+
+        scores: Dict[int, float] = {}
+        for i, key in enumerate(keys):
+            cached = self._cache_get(key)
+            if cached is not None:
+                scores[i] = cached
+        cache_hits = len(scores)
+
+        # 按文本长度排序后分批，同一批内补齐长度接近
+        pending = sorted((i for i in range(len(head)) if i not in scores),
+                         key=lambda i: len(head[i].get("content") or ""))
+        last_batch_seconds = 0.0
+        model = self._ready_model() if pending else None
+        model_loading = bool(pending) and model is None and self._load_error is None
+        lock_timeout = False
+        if model is not None:
+            # 等待其它请求释放模型的时间同样计入预算，等不到时本次不再打分
+            locked = self._predict_lock.acquire(timeout=max(0.0, deadline - time.perf_counter()))
+            lock_timeout = not locked
+        else:
+            locked = False
+        if locked:
+            try:
+                for start in range(0, len(pending), self.batch_size):
+                    now = time.perf_counter()
+                    # 以上一批的耗时预估下一批，预计超出预算时提前停止
+                    if now >= deadline or now + last_batch_seconds > deadline:
+                        break
+                    batch = pending[start:start + self.batch_size]
+                    batch_start = time.perf_counter()
+                    batch_scores = model.predict(
+                        [(query, head[i].get("content") or "") for i in batch],
+                        batch_size=len(batch),
+                        show_progress_bar=False,
+                        **self._predict_kwargs
+                    )
+                    last_batch_seconds = time.perf_counter() - batch_start
+                    for i, score in zip(batch, batch_scores):
+                        scores[i] = float(score)
+                        self._cache_put(keys[i], float(score))
+            finally:
+                self._predict_lock.release()
+
+        slots = sorted(scores)
+        ranked = sorted(slots, key=lambda i: scores[i], reverse=True)
+        reordered = list(head)
+        for slot, i in zip(slots, ranked):
+            item = head[i]
+            # 混合检索的结果已带有纯向量相关度，保留它
+            item.setdefault("dense_relevance", item.get("relevance_score"))
+            item["rerank_score"] = scores[i]
+            item["relevance_score"] = _sigmoid(scores[i])
+            reordered[slot] = item
+
+        partial = len(scores) < len(head)
+        info = {
+            "candidates": len(head),
+            "reranked": len(scores),
+            "cache_hits": cache_hits,
+            "partial": partial,
+            "model_loading": model_loading,
+            "lock_timeout": lock_timeout,
+            "elapsed_ms": round((time.perf_counter() - start_time) * 1000, 2),
+        }
+        with self._cache_lock:
+            self._stats["requests"] += 1
+            self._stats["partial"] += int(partial)
+            self._stats["scored"] += len(scores) - cache_hits
+            self._stats["cache_hits"] += cache_hits
+            self._stats["cache_misses"] += len(head) - cache_hits
+            self._stats["skipped_loading"] += int(model_loading)
+            self._stats["lock_timeouts"] += int(lock_timeout)
+        return reordered + list(tail), info
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cache_lock:
+            return {
+                "model_name": self.model_name,
+                "loaded": self._model is not None,
+                "load_error": self._load_error,
+                "cache_entries": len(self._cache),
+                **self._stats,
+            }
+
+
+_reranker: Optional[CrossEncoderReranker] = None
+_reranker_lock = threading.Lock()
+
+
+def get_reranker() -> CrossEncoderReranker:
+    """返回全局重排器（首次调用时创建并开始在后台加载模型）。"""
+    global _reranker
+    with _reranker_lock:
+        if _reranker is None:
+            _reranker = CrossEncoderReranker(
+                SEARCH_CONFIG["rerank_model"],
+                batch_size=SEARCH_CONFIG["rerank_batch_size"],
+                cache_max_entries=SEARCH_CONFIG["rerank_cache_max_entries"]
+            )
+            _reranker.preload()
+        return _reranker
+
+
+def get_reranker_stats() -> Optional[Dict[str, Any]]:
+    return _reranker.get_stats() if _reranker is not None else None
@@ -0,0 +1,166 @@
+"""
+检索辅助函数
+直接基于底层 chromadb Collection 执行向量查询，并把结果整理为与 SearchService.semantic_search
+一致的字典结构（content / source_file / relevance_score / heading_trail 等），供各种检索模式复用。
+"""
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from services.vector_ingest import get_raw_collection
+
+
+def get_distance_space(raw_collection) -> str:
+    """读取集合的 HNSW 距离空间（l2 / cosine / ip），未设置时为 Chroma 默认的 l2。"""
+    metadata = getattr(raw_collection, "metadata", None) or {}
+    return metadata.get("hnsw:space", "l2")
+
+
+def distance_to_relevance(distance: float, space: str = "l2") -> float:
+    """
+    将 Chroma 返回的距离换算为 0~1 的相关度。
+    向量均已归一化：cosine / ip 距离为 1 - cos，l2 距离为平方欧氏距离 2 - 2cos。
+    """
+    if distance is None:
+        return 0.0
+    if space == "l2":
+        similarity = 1.0 - distance / 2.0
+    else:
+        similarity = 1.0 - distance
+    return float(max(0.0, min(1.0, similarity)))
+
+
+def format_result(chunk_id: str, document: str, metadata: Optional[Dict[str, Any]], relevance: float) -> Dict[str, Any]:
+    """把单条命中整理为搜索接口返回的结果结构。"""
+    metadata = metadata or {}
+    return {
+        "chunk_id": chunk_id,
+        "content": document,
+        "source_file": metadata.get("source_file") or metadata.get("source"),
+        "heading_trail": metadata.get("heading_trail"),
+        "relevance_score": relevance,
+        "metadata": metadata,
+    }
+
+
+def dense_query(collection, query_embeddings, n_results: int, where: Optional[Dict[str, Any]] = None,
+                include_embeddings: bool = False, use_prefilter: bool = True) -> List[List[Dict[str, Any]]]:
+    """
+    对一条或多条查询向量执行一次 ANN 查询。
+
+    Args:
+        collection: chromadb Collection 或 LangChain Chroma
+        query_embeddings: 二维 ndarray（每行一条查询）
+        n_results: 每条查询返回的结果数
+        where: Chroma where 过滤条件
+        include_embeddings: 是否在结果中附带命中文本块的向量（键为 "embedding"）
+        use_prefilter: 带 where 条件时是否先经元数据侧索引规划（空结果直接返回，高选择性条件改为精确暴力打分）
+
+    Returns:
+        每条查询对应一个结果列表，按相关度降序排列。
+    """
+    raw = get_raw_collection(collection)
+    query_embeddings = np.asarray(query_embeddings, dtype=np.float32)
+    if query_embeddings.ndim == 1:
+        query_embeddings = query_embeddings.reshape(1, -1)
+
+    if where and use_prefilter:
+        from services.prefilter import brute_force_query, filter_planner
+        plan = filter_planner.plan(raw, where)
+        if plan.strategy == "empty":
+            return [[] for _ in range(len(query_embeddings))]
+        if plan.strategy == "brute_force":
+            return brute_force_query(raw, query_embeddings, plan.chunk_ids, n_results, include_embeddings)
+
+    include = ["documents", "metadatas", "distances"]
+    if include_embeddings:
+        include.append("embeddings")
+    response = raw.query(
+        query_embeddings=query_embeddings,
+        n_results=max(1, n_results),
+        where=where,
+        include=include,
+    )
+
+    space = get_distance_space(raw)
+    all_results = []
+    for q in range(len(query_embeddings)):
+        ids = response["ids"][q]
+        documents = response["documents"][q]
+        metadatas = response["metadatas"][q]
+        distances = response["distances"][q]
+        embeddings = response["embeddings"][q] if include_embeddings else None
+        results = []
+        for i, chunk_id in enumerate(ids):
+            result = format_result(chunk_id, documents[i], metadatas[i], distance_to_relevance(distances[i], space))
+            if embeddings is not None:
+                result["embedding"] = np.asarray(embeddings[i], dtype=np.float32)
+            results.append(result)
+        all_results.append(results)
+    return all_results
+
+
+def fetch_chunks(collection, ids: List[str], include_embeddings: bool = False) -> Dict[str, Dict[str, Any]]:
+    """按 id 取回文本块，返回 id -> 结果字典（相关度为 0，由调用方填写）。"""
+    if not ids:
+        return {}
+    include = ["documents", "metadatas"]
+    if include_embeddings:
+        include.append("embeddings")
+    response = get_raw_collection(collection).get(ids=list(ids), include=include)
+    chunks = {}
+    for i, chunk_id in enumerate(response["ids"]):
+        result = format_result(chunk_id, response["documents"][i], response["metadatas"][i], 0.0)
+        if include_embeddings:
+            result["embedding"] = np.asarray(response["embeddings"][i], dtype=np.float32)
+        chunks[chunk_id] = result
+    return chunks
+
+
+_default_embedder = None
+
+
+def get_default_embedder():
+    """返回跟随当前激活模型的共享 CustomEmbeddingFunction（热切换后无需重建）。"""
+    global _default_embedder
+    if _default_embedder is None:
+        from services.EmbServ import CustomEmbeddingFunction
+        _default_embedder = CustomEmbeddingFunction()
+    return _default_embedder
+
+
+def compare_filtered_search(search_service, query: str, filters: Dict[str, Any], n_results: int = 10,
+                            embedder=None) -> Dict[str, Any]:
+    """
+    带过滤条件时比较 SearchService.semantic_search 与直接查询（dense_query，经元数据预过滤规划）的结果。
+    两条路径的结果没有统一的 id，按 (source_file, content) 对齐。
+
+    Returns:
+        overlap 为两边前 n_results 条结果的交集占较大一边的比例（两边都为空时为 1.0），
+        max_score_delta 为共同结果的相关度最大差值，rank_mismatches 为共同结果中排名不同的条数。
+    """
+    from services.filter_utils import build_where_clause
+
+    legacy = search_service.semantic_search(query=query, n_results=n_results, filters=filters)
+    collection = search_service.vector_store_service.get_collection("knowledge_base_small")
+    query_embedding = (embedder or get_default_embedder()).embed_query_array(query)
+    direct = dense_query(collection, query_embedding, n_results, where=build_where_clause(filters))[0]
+
+    def keyed(results):
+        return {(r.get("source_file"), r.get("content")): (rank, r.get("relevance_score"))
+                for rank, r in enumerate(results[:n_results])}
+
+    legacy_keyed, direct_keyed = keyed(legacy), keyed(direct)
+    common = legacy_keyed.keys() & direct_keyed.keys()
+    largest = max(len(legacy_keyed), len(direct_keyed))
+    score_deltas = [
+        abs(float(legacy_keyed[k][1]) - float(direct_keyed[k][1])) for k in common
+        if legacy_keyed[k][1] is not None and direct_keyed[k][1] is not None
+    ]
+    return {
+        "legacy_count": len(legacy_keyed),
+        "direct_count": len(direct_keyed),
+        "overlap": len(common) / largest if largest else 1.0,
+        "max_score_delta": max(score_deltas, default=0.0),
+        "rank_mismatches": sum(1 for k in common if legacy_keyed[k][0] != direct_keyed[k][0]),
+    }
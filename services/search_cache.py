@@ -0,0 +1,180 @@
+"""
+搜索结果缓存
+按 (规范化查询, 过滤条件, n_results, 激活模型, 索引代号) 缓存搜索结果，LRU 淘汰。
+每次向量库写入或删除都会递增索引代号，旧代号的缓存项不会再被命中，因此不会返回过期结果。
+入库与删除主要经由已编译的向量存储服务完成，因此索引代号还会在每次读取时
+检查 Chroma 持久化目录中 SQLite 文件的修改时间与大小，发现外部写入即自动递增。
+"""
+import json, os, re, sqlite3, threading, time, unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from .config import CHROMA_DB_CONFIG, LEXICAL_INDEX_DB_PATH, SEARCH_CONFIG
+
+# Chroma 的每次写入（新增、更新、删除、删除集合）都会修改这些文件之一
+_CHROMA_WRITE_FILES = ("chroma.sqlite3", "chroma.sqlite3-wal")
+
+
+def normalize_query(query: str) -> str:
+    """规范化查询文本：统一 Unicode 表示并折叠连续空白。"""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", query)).strip()
+
+
+def chroma_write_stamp(persist_directory: Optional[str] = None) -> Tuple:
+    """返回 Chroma 持久化 SQLite 文件（及其 WAL）的 (文件名, 修改时间, 大小)，只需几次 stat。"""
+    persist_directory = persist_directory or CHROMA_DB_CONFIG["persist_directory"]
+    stamp = []
+    for name in _CHROMA_WRITE_FILES:
+        try:
+            st = os.stat(os.path.join(persist_directory, name))
+        except OSError:
+            continue
+        stamp.append((name, st.st_mtime_ns, st.st_size))
+    return tuple(stamp)
+
+
+class IndexGeneration:
+    """
+    单调递增的索引代号。
+    保存在与词法索引相同的 SQLite 文件中，入库流程与 API 进程即使不在同一进程也能看到同一代号。
+    current() 会比较 Chroma 的写入戳，任何绕过 services.vector_ingest 的写入同样会使代号递增。
+    """
+
+    def __init__(self, db_path: str = LEXICAL_INDEX_DB_PATH, stamp_fn=chroma_write_stamp):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._stamp_fn = stamp_fn
+        self._stamp = stamp_fn()
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS index_generation (id INTEGER PRIMARY KEY CHECK (id = 1), generation INTEGER NOT NULL)")
+        self._conn.execute("INSERT OR IGNORE INTO index_generation (id, generation) VALUES (1, 0)")
+        self._conn.commit()
+
+    def current(self) -> int:
+        """返回当前索引代号；Chroma 自上次检查以来有过写入时先递增。"""
+        with self._lock:
+            stamp = self._stamp_fn()
+            if stamp != self._stamp:
+                self._stamp = stamp
+                return self._bump_locked()
+            return self._conn.execute("SELECT generation FROM index_generation WHERE id = 1").fetchone()[0]
+
+    def bump(self) -> int:
+        """递增并返回新的索引代号。"""
+        with self._lock:
+            # 本次递增已覆盖此前的全部写入，记录写入戳避免下次读取时重复递增
+            self._stamp = self._stamp_fn()
+            return self._bump_locked()
+
+    def _bump_locked(self) -> int:
+        self._conn.execute("UPDATE index_generation SET generation = generation + 1 WHERE id = 1")
+        self._conn.commit()
+        return self._conn.execute("SELECT generation FROM index_generation WHERE id = 1").fetchone()[0]
+
+
+class SearchResultCache:
+    """有界的 LRU 搜索结果缓存，并统计命中率与节省的检索耗时。"""
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple, Tuple[List[Dict[str, Any]], float]]" = OrderedDict()
+        self._generation: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    @staticmethod
+    def make_key(query: str, filters: Optional[Dict[str, Any]], n_results: int, model_name: str,
+                 generation: int, **options: Any) -> Tuple:
+        """构造缓存键；options 用于区分检索模式、融合权重等其它影响结果的参数。"""
+        return (
+            normalize_query(query),
+            json.dumps(filters or {}, sort_keys=True, ensure_ascii=False),
+            n_results,
+            model_name,
+            generation,
+            json.dumps(options, sort_keys=True, ensure_ascii=False),
+        )
+
+    def _sync_generation(self, generation: int):
+        # 索引代号变化后旧条目不可能再命中，直接清空以释放内存
+        if generation != self._generation:
+            self._entries.clear()
+            self._generation = generation
+
+    def get(self, key: Tuple) -> Optional[List[Dict[str, Any]]]:
+        if self.max_entries <= 0:
+            return None
+        with self._lock:
+            self._sync_generation(key[4])
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            results, elapsed = entry
+            self.hits += 1
+            self.saved_seconds += elapsed
+        return [dict(r) for r in results]
+
+    def put(self, key: Tuple, results: List[Dict[str, Any]], elapsed: float):
+        """保存结果以及本次检索的耗时（命中时计入节省的耗时）。"""
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            if self._generation is not None and key[4] < self._generation:
+                # 检索期间索引已更新，结果可能已过期，不再缓存
+                return
+            self._sync_generation(key[4])
+            self._entries[key] = ([dict(r) for r in results], elapsed)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.max_entries > 0,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "generation": self._generation,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "saved_latency_seconds": round(self.saved_seconds, 3),
+            }
+
+
+# --- 全局实例 ---
+index_generation = IndexGeneration()
+search_result_cache = SearchResultCache(SEARCH_CONFIG["result_cache_max_entries"])
+
+
+def make_search_key(query: str, filters: Optional[Dict[str, Any]], n_results: int, **options: Any) -> Tuple:
+    """按当前激活模型与索引代号构造缓存键。"""
+    from services.EmbServ import get_active_model_name
+    return SearchResultCache.make_key(query, filters, n_results, get_active_model_name(),
+                                      index_generation.current(), **options)
+
+
+def cached_search(query: str, filters: Optional[Dict[str, Any]], n_results: int, search_fn, **options: Any):
+    """
+    带缓存地执行一次搜索：命中时直接返回缓存结果，否则调用 search_fn() 并写入缓存。
+    缓存键包含当前激活模型与索引代号。
+    """
+    key = make_search_key(query, filters, n_results, **options)
+    results = search_result_cache.get(key)
+    if results is not None:
+        return results
+    start_time = time.perf_counter()
+    results = search_fn()
+    search_result_cache.put(key, results, time.perf_counter() - start_time)
+    return results
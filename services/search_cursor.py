@@ -0,0 +1,146 @@
+"""
+搜索结果游标分页
+第一页执行一次较宽的候选检索，把排好序的完整结果（含重排分数、混合检索分项、父块匹配信息等）
+保存在短期有效的游标下；后续页面直接切片，只按 id 确认文本块仍然存在，不再重新编码查询或执行 ANN 检索。
+游标数量与全部游标保存的结果总大小（按文本与元数据估算）都有上限（LRU 淘汰），并在 TTL 到期后失效。
+游标字符串为 "<token>:<offset>"，offset 表示下一页在排序列表中的起始位置。
+"""
+import secrets, threading, time
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from services.config import SEARCH_CONFIG
+
+
+@dataclass
+class CursorState:
+    """一次宽检索的排序结果"""
+    # 每条结果所在的集合（父块上下文模式下大块、小块结果可能混合出现）
+    collection_names: List[str]
+    results: List[Dict[str, Any]]
+    expires_at: float
+    # 估算的内存占用（字节）
+    size_bytes: int = 0
+
+
+def _estimate_size(result: Dict[str, Any]) -> int:
+    """粗略估算一条结果占用的字节数：文本与元数据的 UTF-8 长度加上字典本身的固定开销。"""
+    size = 512
+    for value in (result.get("content"), result.get("metadata")):
+        if value:
+            size += len(str(value).encode("utf-8"))
+    return size
+
+
+class SearchCursorStore:
+    def __init__(self, max_cursors: int = 256, ttl_seconds: float = 300.0, max_total_mb: float = 64.0):
+        self.max_cursors = max_cursors
+        self.ttl_seconds = ttl_seconds
+        self.max_total_bytes = int(max_total_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+        self._cursors: "OrderedDict[str, CursorState]" = OrderedDict()
+        self._total_bytes = 0
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def _remove(self, token: str):
+        self._total_bytes -= self._cursors.pop(token).size_bytes
+
+    def _purge_expired(self, now: float):
+        expired = [token for token, state in self._cursors.items() if state.expires_at <= now]
+        for token in expired:
+            self._remove(token)
+        self.expired += len(expired)
+
+    def create(self, results: List[Dict[str, Any]], collection_of: Callable[[Dict[str, Any]], str]) -> str:
+        """保存排序后的结果（不含向量）及其所在集合，返回游标令牌。"""
+        from services.mmr import strip_embedding
+        now = time.monotonic()
+        stored = [strip_embedding(r) for r in results]
+        state = CursorState(
+            collection_names=[collection_of(r) for r in results],
+            results=stored,
+            expires_at=now + self.ttl_seconds,
+            size_bytes=sum(_estimate_size(r) for r in stored),
+        )
+        token = secrets.token_urlsafe(12)
+        with self._lock:
+            self._purge_expired(now)
+            self._cursors[token] = state
+            self._total_bytes += state.size_bytes
+            # 超出数量或总大小上限时淘汰最久未使用的游标（至少保留刚创建的这一个）
+            while len(self._cursors) > 1 and (len(self._cursors) > self.max_cursors
+                                              or self._total_bytes > self.max_total_bytes):
+                self._remove(next(iter(self._cursors)))
+                self.evicted += 1
+            self.created += 1
+        return token
+
+    def get(self, token: str) -> Optional[CursorState]:
+        """返回未过期的游标状态，过期或不存在时返回 None。"""
+        now = time.monotonic()
+        with self._lock:
+            state = self._cursors.get(token)
+            if state is None:
+                return None
+            if state.expires_at <= now:
+                self._remove(token)
+                self.expired += 1
+                return None
+            self._cursors.move_to_end(token)
+            return state
+
+    @staticmethod
+    def encode(token: str, offset: int) -> str:
+        return f"{token}:{offset}"
+
+    @staticmethod
+    def decode(cursor: str) -> Tuple[str, int]:
+        token, _, offset = cursor.rpartition(":")
+        if not token or not offset.isdigit():
+            raise ValueError("无效的游标。")
+        return token, int(offset)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "active": len(self._cursors),
+                "max_cursors": self.max_cursors,
+                "total_mb": round(self._total_bytes / (1024 * 1024), 2),
+                "max_total_mb": round(self.max_total_bytes / (1024 * 1024), 2),
+                "ttl_seconds": self.ttl_seconds,
+                "created": self.created,
+                "expired": self.expired,
+                "evicted": self.evicted,
+            }
+
+
+def page_from_cursor(get_collection: Callable[[str], Any], state: CursorState, offset: int,
+                     page_size: int) -> List[Dict[str, Any]]:
+    """
+    从游标保存的结果中切出一页（返回副本）；
+    每个集合一次按 id 确认文本块仍然存在，游标创建后已被删除的文本块会被跳过；
+    没有文本块 id 的结果无法确认，原样保留。
+    """
+    from services.vector_ingest import get_raw_collection
+    end = offset + page_size
+    entries = list(zip(state.collection_names[offset:end], state.results[offset:end]))
+    ids_by_collection = defaultdict(list)
+    for collection_name, result in entries:
+        if result.get("chunk_id"):
+            ids_by_collection[collection_name].append(result["chunk_id"])
+    existing = {
+        collection_name: set(get_raw_collection(get_collection(collection_name)).get(ids=ids, include=[])["ids"])
+        for collection_name, ids in ids_by_collection.items()
+    }
+    return [
+        dict(result) for collection_name, result in entries
+        if not result.get("chunk_id") or result["chunk_id"] in existing.get(collection_name, ())
+    ]
+
+
+# --- 全局实例 ---
+search_cursor_store = SearchCursorStore(SEARCH_CONFIG["cursor_max_entries"], SEARCH_CONFIG["cursor_ttl_seconds"],
+                                        SEARCH_CONFIG["cursor_max_total_mb"])
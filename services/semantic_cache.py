@@ -0,0 +1,128 @@
+"""
+语义查询缓存
+把最近的查询向量保存在一个小的内存矩阵中。新查询与某条缓存查询的余弦相似度超过阈值、
+且其余检索条件（过滤条件、n_results、检索选项、激活模型）完全相同时，直接复用其结果。
+查找只需一次 NumPy 矩阵-向量乘法；条目按 LRU 淘汰，索引代号变化时全部丢弃。
+默认关闭；混合检索的词法部分依赖查询的字面内容（如 "E1234" 与 "E1235"），不使用本缓存。
+"""
+import json, threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from services.config import SEARCH_CONFIG
+
+
+class SemanticQueryCache:
+    def __init__(self, max_entries: int = 256, threshold: float = 0.95):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._generation: Optional[int] = None
+        self._matrix: Optional[np.ndarray] = None  # (max_entries, dim)，行已归一化
+        self._contexts: List[Optional[str]] = [None] * max_entries
+        # 条件字符串的哈希，与相似度一起在向量化的掩码中比较
+        self._context_hashes = np.zeros(max_entries, dtype=np.int64)
+        self._results: List[Optional[List[Dict[str, Any]]]] = [None] * max_entries
+        self._last_used = np.zeros(max_entries, dtype=np.int64)
+        self._valid = np.zeros(max_entries, dtype=bool)
+        self._clock = 0
+        self.hits = 0
+        self.misses = 0
+        self._similarity_sum = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @staticmethod
+    def make_context(filters: Optional[Dict[str, Any]], n_results: int, model_name: str, **options: Any) -> str:
+        """除查询文本以外影响结果的全部条件。"""
+        return json.dumps({"filters": filters or {}, "n_results": n_results, "model": model_name, **options},
+                          sort_keys=True, ensure_ascii=False, default=str)
+
+    def _reset(self, dim: Optional[int] = None):
+        self._matrix = np.zeros((self.max_entries, dim), dtype=np.float32) if dim else None
+        self._contexts = [None] * self.max_entries
+        self._results = [None] * self.max_entries
+        self._context_hashes[:] = 0
+        self._valid[:] = False
+        self._last_used[:] = 0
+
+    def _sync(self, generation: int, dim: int):
+        # 索引代号变化后缓存的结果可能已过期；向量维度变化说明模型已切换
+        if generation != self._generation or self._matrix is None or self._matrix.shape[1] != dim:
+            self._reset(dim)
+            self._generation = generation
+
+    @staticmethod
+    def _normalize(vector: np.ndarray) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def get(self, query_embedding: np.ndarray, context: str, generation: int) -> Optional[List[Dict[str, Any]]]:
+        """查找相似查询的缓存结果，未命中时返回 None。"""
+        if not self.enabled:
+            return None
+        query = self._normalize(query_embedding)
+        with self._lock:
+            self._sync(generation, len(query))
+            if not self._valid.any():
+                self.misses += 1
+                return None
+            similarities = self._matrix @ query
+            context_mask = self._context_hashes == hash(context)
+            similarities = np.where(self._valid & context_mask, similarities, -np.inf)
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold or self._contexts[best] != context:
+                self.misses += 1
+                return None
+            self._clock += 1
+            self._last_used[best] = self._clock
+            self.hits += 1
+            self._similarity_sum += float(similarities[best])
+            results = self._results[best]
+        return [dict(r) for r in results]
+
+    def put(self, query_embedding: np.ndarray, context: str, generation: int, results: List[Dict[str, Any]]):
+        if not self.enabled:
+            return
+        query = self._normalize(query_embedding)
+        with self._lock:
+            if self._generation is not None and generation < self._generation:
+                # 检索期间索引已更新，结果可能已过期
+                return
+            self._sync(generation, len(query))
+            # 优先使用空槽位，否则淘汰最久未使用的条目
+            free = np.flatnonzero(~self._valid)
+            slot = int(free[0]) if len(free) else int(np.argmin(self._last_used))
+            self._clock += 1
+            self._matrix[slot] = query
+            self._contexts[slot] = context
+            self._context_hashes[slot] = hash(context)
+            self._results[slot] = [dict(r) for r in results]
+            self._last_used[slot] = self._clock
+            self._valid[slot] = True
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": int(self._valid.sum()),
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+                "generation": self._generation,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "avg_hit_similarity": round(self._similarity_sum / self.hits, 4) if self.hits else None,
+            }
+
+
+# --- 全局实例 ---
+semantic_query_cache = SemanticQueryCache(
+    SEARCH_CONFIG["semantic_cache_max_entries"],
+    SEARCH_CONFIG["semantic_cache_threshold"]
+)
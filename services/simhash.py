@@ -0,0 +1,112 @@
+"""
+近重复文本块折叠（SimHash）
+入库时为每个文本块计算 64 位 SimHash 指纹，以 16 位十六进制字符串存入元数据的 "simhash" 字段
+（Chroma 的整数元数据为有符号 64 位，无法直接保存无符号指纹）。
+检索时把候选结果的指纹打包为 uint64 数组，用异或与按位计数一次算出两两汉明距离，
+按相关度顺序保留结果，并折叠与已保留结果距离不超过阈值的近重复结果。
+缺少指纹的旧文本块在检索时按内容现算。
+"""
+import hashlib, re
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from services.config import SEARCH_CONFIG
+
+SIMHASH_METADATA_KEY = "simhash"
+# 特征为字符 n-gram，对中文与英文都适用，且不依赖分词
+SHINGLE_SIZE = 3
+
+_BIT_SHIFTS = np.arange(64, dtype=np.uint64)
+# 按字节查表计算 popcount，兼容没有 np.bitwise_count 的 NumPy 版本
+_BYTE_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _features(text: str) -> Counter:
+    normalized = re.sub(r"\s+", " ", (text or "").lower()).strip()
+    if len(normalized) <= SHINGLE_SIZE:
+        return Counter([normalized]) if normalized else Counter()
+    return Counter(normalized[i:i + SHINGLE_SIZE] for i in range(len(normalized) - SHINGLE_SIZE + 1))
+
+
+def simhash64(text: str) -> int:
+    """计算文本的 64 位 SimHash 指纹（以 Python int 返回，取值范围 0 ~ 2^64-1）。"""
+    features = _features(text)
+    if not features:
+        return 0
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(f.encode("utf-8"), digest_size=8).digest(), "little") for f in features),
+        dtype=np.uint64, count=len(features)
+    )
+    weights = np.fromiter(features.values(), dtype=np.float64, count=len(features))
+    # (特征数, 64) 的位矩阵，每一位按特征权重投票
+    bits = ((hashes[:, None] >> _BIT_SHIFTS) & np.uint64(1)).astype(np.float64)
+    votes = weights @ (2.0 * bits - 1.0)
+    return int(((votes > 0).astype(np.uint64) << _BIT_SHIFTS).sum(dtype=np.uint64))
+
+
+def format_simhash(fingerprint: int) -> str:
+    return f"{fingerprint:016x}"
+
+
+def add_simhash_metadata(documents: List[str], metadatas: Optional[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """返回附带 simhash 字段的元数据列表（不修改传入的字典）。"""
+    metadatas = metadatas if metadatas is not None else [None] * len(documents)
+    return [
+        {**(metadata or {}), SIMHASH_METADATA_KEY: format_simhash(simhash64(document))}
+        for document, metadata in zip(documents, metadatas)
+    ]
+
+
+def result_fingerprints(results: List[Dict[str, Any]]) -> np.ndarray:
+    """取出结果的指纹并打包为 uint64 数组；元数据中没有指纹时按内容计算。"""
+    fingerprints = np.empty(len(results), dtype=np.uint64)
+    for i, result in enumerate(results):
+        stored = (result.get("metadata") or {}).get(SIMHASH_METADATA_KEY)
+        try:
+            fingerprints[i] = int(stored, 16)
+        except (TypeError, ValueError):
+            fingerprints[i] = simhash64(result.get("content") or "")
+    return fingerprints
+
+
+def hamming_distances(fingerprints: np.ndarray) -> np.ndarray:
+    """两两汉明距离矩阵 (n, n)。"""
+    xor = fingerprints[:, None] ^ fingerprints[None, :]
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(xor).astype(np.int32)
+    return _BYTE_POPCOUNT[xor.view(np.uint8)].reshape(*xor.shape, 8).sum(axis=-1, dtype=np.int32)
+
+
+def collapse_near_duplicates(results: List[Dict[str, Any]], threshold: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    按输入顺序（相关度降序）保留结果，折叠与已保留结果的指纹汉明距离不超过 threshold 的近重复结果。
+    被保留的结果在 collapsed_duplicates 中记录折叠掉的结果数。
+    """
+    threshold = SEARCH_CONFIG["simhash_hamming_threshold"] if threshold is None else threshold
+    if len(results) < 2:
+        return results
+    near = hamming_distances(result_fingerprints(results)) <= threshold
+
+    kept: List[int] = []
+    collapsed = np.zeros(len(results), dtype=np.int32)
+    suppressed = np.zeros(len(results), dtype=bool)
+    for i in range(len(results)):
+        if suppressed[i]:
+            continue
+        kept.append(i)
+        # 排在后面的近重复结果都归入当前结果
+        duplicates = near[i] & ~suppressed
+        duplicates[:i + 1] = False
+        collapsed[i] = int(duplicates.sum())
+        suppressed |= duplicates
+
+    collapsed_results = []
+    for i in kept:
+        result = results[i]
+        if collapsed[i]:
+            result = dict(result)
+            result["collapsed_duplicates"] = int(collapsed[i])
+        collapsed_results.append(result)
+    return collapsed_results
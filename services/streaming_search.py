@@ -0,0 +1,123 @@
+"""
+流式搜索服务
+以事件流的形式产出搜索结果：每条结果通过路径安全验证后立即发送，
+检索完成后再发送一次相关度 / 排名更新（后续的重排阶段也通过该事件下发最终分数）。
+
+事件类型：
+    {"type": "result", "rank": int, "result": {...}}      单条已验证的结果
+    {"type": "scores", "results": [{"chunk_id", "rank", "relevance_score"}, ...]}   最终排名与分数
+    {"type": "rerank", "results": [...], "info": {...}}   交叉编码器重排后的排名与分数（可选）
+    {"type": "done", "count": int, "elapsed_ms": float, "cached": bool}
+    {"type": "error", "detail": str}
+"""
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from services.config import SEARCH_CONFIG
+from services.filter_utils import build_where_clause
+from services.hybrid_search import hybrid_search
+from services.mmr import is_mmr_requested, mmr_rerank
+from services.retrieval import dense_query, get_default_embedder
+from services.search_cache import make_search_key, search_result_cache
+from services.simhash import collapse_near_duplicates
+from services.vector_ingest import get_raw_collection
+
+
+def _score_event(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {
+        "type": "scores",
+        "results": [
+            {"chunk_id": r.get("chunk_id"), "rank": rank, "relevance_score": r.get("relevance_score")}
+            for rank, r in enumerate(results)
+        ],
+    }
+
+
+def stream_search_events(collection, query: str, n_results: int, filters: Optional[Dict[str, Any]],
+                         validate: Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]],
+                         mode: Optional[str] = None, dense_weight: Optional[float] = None,
+                         lexical_weight: Optional[float] = None, embedder=None,
+                         expand: Optional[Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]]] = None,
+                         rerank: bool = False, collapse_duplicates: bool = False) -> Iterator[Dict[str, Any]]:
+    """
+    产出流式搜索事件。
+
+    语义检索分两个阶段：先取前 stream_first_batch_size 条结果立即验证并发送，
+    再用同一个查询向量取完整的 n_results 条，只发送尚未发送过的部分。
+    前一阶段只需读取少量文档与元数据，首条结果的等待时间不再随 n_results 增长。
+    启用 MMR（RelevanceSorting = "mmr"）或近重复折叠时结果取决于完整候选集合，因此不分阶段。
+
+    Args:
+        validate: 路径安全验证函数，接收结果列表，返回通过验证的结果
+        expand: 可选的父块上下文扩展函数；提供时在完整检索后统一扩展，不再分阶段发送
+        rerank: 是否在发送全部结果后执行交叉编码器重排，并以 rerank 事件下发新的排名
+        collapse_duplicates: 是否折叠近重复结果（SimHash），与非流式搜索的同名选项一致
+    """
+    start_time = time.perf_counter()
+    # 流式检索有自己的实现（两阶段发送、缓存未经路径验证的原始结果），使用独立的缓存键命名空间，
+    # 不与 /search、/batch 的缓存条目互相读写
+    options = {"source": "stream", "mode": mode or "semantic", "dense_weight": dense_weight, "lexical_weight": lexical_weight,
+               "parent_context": expand is not None, "collapse_duplicates": collapse_duplicates}
+    key = make_search_key(query, filters, n_results, **options)
+    cached = search_result_cache.get(key)
+
+    sent: List[Dict[str, Any]] = []
+    sent_ids = set()
+
+    def emit(results):
+        for result in validate(results):
+            if result.get("chunk_id") in sent_ids:
+                continue
+            sent_ids.add(result.get("chunk_id"))
+            sent.append(result)
+            yield {"type": "result", "rank": len(sent) - 1, "result": result}
+
+    if cached is not None:
+        yield from emit(cached)
+        all_results = cached
+    else:
+        raw = get_raw_collection(collection)
+        where = build_where_clause(filters) if filters else None
+        query_embedding = (embedder or get_default_embedder()).embed_query_array(query)
+        use_mmr = is_mmr_requested(filters)
+        target = n_results * SEARCH_CONFIG["simhash_candidate_multiplier"] if collapse_duplicates else n_results
+        candidates = target * SEARCH_CONFIG["mmr_candidate_multiplier"] if use_mmr else target
+
+        if mode == "hybrid":
+            all_results = hybrid_search(raw, query, candidates, filters, dense_weight=dense_weight,
+                                        lexical_weight=lexical_weight, query_embedding=query_embedding)
+        else:
+            first_batch = SEARCH_CONFIG["stream_first_batch_size"]
+            if expand is None and not use_mmr and not collapse_duplicates and 0 < first_batch < n_results:
+                yield from emit(dense_query(raw, query_embedding, first_batch, where=where)[0])
+            all_results = dense_query(raw, query_embedding, candidates, where=where, include_embeddings=use_mmr)[0]
+        if use_mmr:
+            all_results = mmr_rerank(raw, all_results, query_embedding, target)
+        if collapse_duplicates:
+            all_results = collapse_near_duplicates(all_results)[:n_results]
+        if expand is not None:
+            all_results = expand(all_results)
+        yield from emit(all_results)
+
+    if cached is None:
+        search_result_cache.put(key, all_results, time.perf_counter() - start_time)
+
+    # 两阶段发送时先发的首批结果不一定在最终排名的前列，这里按流水线输出顺序（含 MMR 选择顺序）下发一次排名更新
+    by_id = {r.get("chunk_id"): r for r in sent}
+    final = [by_id.pop(r.get("chunk_id")) for r in all_results if r.get("chunk_id") in by_id]
+    final.extend(by_id.values())
+    yield _score_event(final)
+
+    if rerank and final:
+        from services.reranker import get_reranker
+        reranked, info = get_reranker().rerank(query, final)
+        event = _score_event(reranked)
+        event["type"] = "rerank"
+        event["info"] = info
+        yield event
+    yield {
+        "type": "done",
+        "count": len(sent),
+        "elapsed_ms": round((time.perf_counter() - start_time) * 1000, 2),
+        "cached": cached is not None,
+    }
@@ -0,0 +1,274 @@
+"""
+向量入库辅助
+直接以 ndarray 形式把文本块向量写入 Chroma 集合，绕过 LangChain 的 List[List[float]] 接口，
+批量入库时不会为每个向量分量创建 Python float 对象。
+
+实际的入库与删除由已编译的 VectorStoreService 经 LangChain Chroma 完成，无法直接修改，
+因此 install_ingest_hooks() 在 chromadb Collection 的写入方法上挂载钩子：
+知识库集合（TRACKED_COLLECTIONS）的每次 add / upsert / update / delete 都经过这里：
+    - 向量在写入前合并为一个 float32 矩阵（CustomEmbeddingFunction.embed_documents 返回的是各行的 ndarray 视图）；
+    - 同时写入文本与元数据时，元数据在写入前附带文本的 SimHash 指纹，供检索时折叠近重复结果；
+    - 写入后同步词法索引与文本块计数并递增索引代号，二者都无需再从 Chroma 全量补齐；
+    - 删除后只使被删文本块所属路径的验证备忘失效。
+"""
+import functools, inspect, logging, threading, time, tracemalloc
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 每次写入 Chroma 的条数
+DEFAULT_UPSERT_BATCH_SIZE = 512
+
+# 由入库钩子维护的知识库集合；调优候选集合、基准测试集合等其它集合的写入不受影响
+TRACKED_COLLECTIONS = ("knowledge_base_small", "knowledge_base_large")
+# 挂载钩子的 chromadb Collection 写入方法
+_HOOKED_METHODS = ("add", "upsert", "update", "delete")
+_hooks_lock = threading.Lock()
+# 钩子内部（及 chromadb 内部互相调用的写入方法）不再重复同步
+_hook_state = threading.local()
+
+
+def get_raw_collection(collection):
+    """接受 chromadb Collection 或 LangChain Chroma 实例，返回底层的 chromadb Collection。"""
+    return getattr(collection, "_collection", collection)
+
+
+def as_embedding_matrix(embeddings):
+    """把 ndarray 行组成的列表合并为一个二维 float32 矩阵；其它形式（列表的列表、None 等）原样返回。"""
+    if isinstance(embeddings, list) and embeddings and all(isinstance(row, np.ndarray) for row in embeddings):
+        return np.stack(embeddings).astype(np.float32, copy=False)
+    return embeddings
+
+
+def _as_list(ids) -> Optional[List[str]]:
+    if ids is None:
+        return None
+    return [ids] if isinstance(ids, str) else list(ids)
+
+
+def _file_ids(metadatas) -> List[Optional[str]]:
+    return [(m or {}).get("file_id") for m in metadatas or []]
+
+
+def _record_counts(collection_name: str, generation_before: int, generation_after: int,
+                   added: List[Optional[str]], removed: List[Optional[str]]):
+    """更新文本块计数；失败时计数停留在写入前的索引代号上，调用方会回退为读取 Chroma。"""
+    try:
+        from services.chunk_counters import chunk_counter_service
+        chunk_counter_service.apply_delta(collection_name, added=added, removed=removed)
+        chunk_counter_service.mark_synced(generation_before, generation_after)
+    except Exception as e:
+        logger.warning(f"集合 {collection_name} 的文本块计数更新失败，计数在下次 reconcile 前不可信: {e}")
+
+
+def _record_write(collection_name: str, generation_before: int, ids: List[str], documents: List[Optional[str]],
+                  metadatas: List[Optional[Dict[str, Any]]], replaced_file_ids: List[Optional[str]]):
+    """写入完成后的同步：更新词法索引与文本块计数并递增索引代号。"""
+    from services.lexical_index import lexical_index
+    from services.search_cache import index_generation
+    lexical_index.upsert(collection_name, ids, documents, metadatas)
+    generation_after = index_generation.bump()
+    lexical_index.mark_synced(collection_name, generation_before, generation_after)
+    _record_counts(collection_name, generation_before, generation_after, _file_ids(metadatas), replaced_file_ids)
+
+
+def _record_delete(collection_name: str, generation_before: int, ids: List[str],
+                   removed_file_ids: List[Optional[str]]):
+    """删除完成后的同步：从词法索引移除、更新文本块计数并递增索引代号。"""
+    from services.lexical_index import lexical_index
+    from services.search_cache import index_generation
+    lexical_index.delete(collection_name, ids=ids)
+    generation_after = index_generation.bump()
+    lexical_index.mark_synced(collection_name, generation_before, generation_after)
+    _record_counts(collection_name, generation_before, generation_after, [], removed_file_ids)
+
+
+def _observed_write(method_name: str, raw, original, bound):
+    from services.search_cache import index_generation
+    arguments = bound.arguments
+    if "embeddings" in arguments:
+        arguments["embeddings"] = as_embedding_matrix(arguments["embeddings"])
+    ids = _as_list(arguments.get("ids"))
+    if not ids:
+        return original(*bound.args, **bound.kwargs)
+    if arguments.get("documents") is not None and arguments.get("metadatas") is not None:
+        # 只提供文本时不补元数据：update 会用它覆盖文本块原有的元数据
+        from services.simhash import add_simhash_metadata
+        documents = arguments["documents"] = _as_list(arguments["documents"])
+        metadatas = arguments["metadatas"]
+        metadatas = [metadatas] if isinstance(metadatas, dict) else metadatas
+        arguments["metadatas"] = add_simhash_metadata([d or "" for d in documents], metadatas)
+    generation_before = index_generation.current()
+    # 写入前已存在的文本块及其文件归属：覆盖写入时计数只需把旧归属换成新的，add 跳过的 id 前后抵消
+    previous = raw.get(ids=ids, include=["metadatas"])
+    result = original(*bound.args, **bound.kwargs)
+
+    documents, metadatas = arguments.get("documents"), arguments.get("metadatas")
+    if method_name == "upsert" and documents is not None and metadatas is not None:
+        # 完整覆盖写入时，写入的内容就是集合中的最新状态
+        written_ids, documents, metadatas = ids, list(documents), list(metadatas)
+    else:
+        # add 会跳过已存在的 id，update 只修改部分字段，以写入后的实际内容为准
+        written = raw.get(ids=ids, include=["documents", "metadatas"])
+        written_ids, documents, metadatas = written["ids"], written["documents"], written["metadatas"]
+    _record_write(raw.name, generation_before, written_ids, documents, metadatas,
+                  _file_ids(previous["metadatas"]))
+    return result
+
+
+def _observed_delete(raw, original, bound):
+    from services.search_cache import index_generation
+    arguments = bound.arguments
+    ids, where, where_document = arguments.get("ids"), arguments.get("where"), arguments.get("where_document")
+    if ids is None and where is None and where_document is None:
+        return original(*bound.args, **bound.kwargs)
+    generation_before = index_generation.current()
+    # 先取出实际会被删除的文本块，以便同步词法索引
+    existing = raw.get(ids=_as_list(ids), where=where, where_document=where_document, include=["metadatas"])
+    result = original(*bound.args, **bound.kwargs)
+    if existing["ids"]:
+        _record_delete(raw.name, generation_before, existing["ids"], _file_ids(existing["metadatas"]))
+        # 文件被删除或移动后会先删除旧文本块，只有这些文本块所属路径的验证结果随之失效
+        from services.config import invalidate_validated_paths
+        invalidate_validated_paths({
+            (m or {}).get("source_file") or (m or {}).get("source") for m in existing["metadatas"]
+        })
+    return result
+
+
+def _hook_write(method_name: str, original):
+    signature = inspect.signature(original)
+
+    @functools.wraps(original)
+    def hooked(self, *args, **kwargs):
+        if getattr(self, "name", None) not in TRACKED_COLLECTIONS or getattr(_hook_state, "active", False):
+            return original(self, *args, **kwargs)
+        bound = signature.bind(self, *args, **kwargs)
+        _hook_state.active = True
+        try:
+            if method_name == "delete":
+                return _observed_delete(self, original, bound)
+            return _observed_write(method_name, self, original, bound)
+        finally:
+            _hook_state.active = False
+
+    hooked._local_mind_original = original
+    return hooked
+
+
+def install_ingest_hooks() -> bool:
+    """
+    在 chromadb Collection 的写入方法上挂载入库钩子（重复调用无副作用）。
+    未安装 chromadb 时返回 False。
+    """
+    try:
+        from chromadb.api.models.Collection import Collection
+    except ImportError:
+        return False
+    with _hooks_lock:
+        for method_name in _HOOKED_METHODS:
+            original = getattr(Collection, method_name, None)
+            if original is None or hasattr(original, "_local_mind_original"):
+                continue
+            setattr(Collection, method_name, _hook_write(method_name, original))
+    return True
+
+
+def upsert_chunks(collection, ids: List[str], documents: List[str], metadatas: Optional[List[Dict[str, Any]]],
+                  embedder, batch_size: int = DEFAULT_UPSERT_BATCH_SIZE) -> int:
+    """
+    编码文本块并写入集合（已存在的 id 会被覆盖）。
+
+    Args:
+        collection: 目标集合（chromadb Collection 或 LangChain Chroma）
+        ids: 文本块 id 列表
+        documents: 文本块内容列表
+        metadatas: 文本块元数据列表（可选）
+        embedder: 提供 embed_documents_array 的嵌入函数，通常为 CustomEmbeddingFunction
+        batch_size: 每批编码与写入的条数
+
+    Returns:
+        int: 写入的文本块数量
+    """
+    if len(ids) != len(documents) or (metadatas is not None and len(metadatas) != len(ids)):
+        raise ValueError("ids、documents 与 metadatas 的长度必须一致。")
+
+    # SimHash 指纹、词法索引、文本块计数与索引代号由写入钩子同步
+    install_ingest_hooks()
+    raw = get_raw_collection(collection)
+    # 写入钩子只在同时提供元数据时附带指纹
+    metadatas = metadatas if metadatas is not None else [{} for _ in ids]
+    written = 0
+    for start in range(0, len(ids), batch_size):
+        end = min(start + batch_size, len(ids))
+        vectors = np.asarray(embedder.embed_documents_array(documents[start:end]), dtype=np.float32)
+        raw.upsert(
+            ids=ids[start:end],
+            embeddings=vectors,
+            documents=documents[start:end],
+            metadatas=metadatas[start:end],
+        )
+        written += end - start
+    return written
+
+
+def delete_chunks(collection, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None):
+    """按 id 或元数据条件从集合中删除文本块（词法索引、计数与路径验证备忘由写入钩子同步）。"""
+    if ids is None and where is None:
+        raise ValueError("删除文本块时必须指定 ids 或 where 条件。")
+    install_ingest_hooks()
+    get_raw_collection(collection).delete(ids=ids, where=where)
+
+
+def benchmark_ndarray_ingest(num_chunks: int = 100_000, dim: int = 1024, batch_size: int = DEFAULT_UPSERT_BATCH_SIZE,
+                             use_chroma: bool = True) -> List[dict]:
+    """
+    对比 list 路径（.tolist() 后交给向量库）与 ndarray 路径入库 num_chunks 条向量的耗时与内存峰值。
+    模型输出以随机矩阵代替，两条路径的编码开销相同，因此只衡量转换与写入本身。
+    未安装 chromadb 或 use_chroma 为 False 时，只统计转换开销。
+    """
+    rng = np.random.default_rng(0)
+    client = None
+    if use_chroma:
+        try:
+            import chromadb
+            client = chromadb.EphemeralClient()
+        except Exception:
+            client = None
+
+    results = []
+    for path in ("list", "ndarray"):
+        collection = client.create_collection(f"bench_{path}_{int(time.time())}") if client is not None else None
+        tracemalloc.start()
+        start_time = time.perf_counter()
+        for start in range(0, num_chunks, batch_size):
+            rows = min(batch_size, num_chunks - start)
+            vectors = rng.standard_normal((rows, dim), dtype=np.float32)
+            embeddings = vectors.tolist() if path == "list" else vectors
+            if collection is not None:
+                collection.add(
+                    ids=[f"chunk-{start + i}" for i in range(rows)],
+                    embeddings=embeddings,
+                )
+        elapsed = time.perf_counter() - start_time
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results.append({
+            "path": path,
+            "num_chunks": num_chunks,
+            "dim": dim,
+            "with_chroma": collection is not None,
+            "seconds": round(elapsed, 3),
+            "chunks_per_second": round(num_chunks / elapsed, 1) if elapsed > 0 else None,
+            "peak_traced_mb": round(peak / (1024 ** 2), 2),
+        })
+        if collection is not None:
+            client.delete_collection(collection.name)
+    return results
+
+
+if __name__ == "__main__":
+    for row in benchmark_ndarray_ingest():
+        print(row)
@@ -0,0 +1,38 @@
+"""
+推理后端一致性测试：各后端与 fp32 torch 路径的输出向量逐条比较余弦相似度。
+需要 sentence-transformers 与本地已下载的激活模型，缺少时跳过。
+"""
+import pytest
+
+pytest.importorskip("sentence_transformers")
+
+from services.EmbServ import ModelNotFoundError, check_backend_parity
+
+# 最小余弦相似度允许偏离 1 的幅度：ONNX fp32 只有算子实现差异，int8 量化允许稍大的误差
+TOLERANCES = {
+    "onnx": 1e-3,
+    "torch-int8": 2e-2,
+    "onnx-int8": 2e-2,
+}
+
+TEXTS = [
+    "本地知识库语义检索预热文本。",
+    "Local Mind embeds document chunks and queries into the same vector space for semantic search.",
+    "如何在不重启后端的情况下切换嵌入模型？",
+    "The embedding cache stores vectors keyed by model name and normalized text hash.",
+    "错误码 E1234 表示索引文件损坏，需要重新构建知识库。",
+    "short",
+]
+
+
+@pytest.mark.parametrize("backend", sorted(TOLERANCES))
+def test_backend_matches_fp32_torch(backend):
+    try:
+        report = check_backend_parity(TEXTS, backend)
+    except ModelNotFoundError as e:
+        pytest.skip(f"激活模型未下载: {e}")
+    except ImportError as e:
+        pytest.skip(f"{backend} 后端的依赖未安装: {e}")
+
+    assert report["num_texts"] == len(TEXTS)
+    assert report["min_cosine_similarity"] >= 1.0 - TOLERANCES[backend]
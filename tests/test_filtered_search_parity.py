@@ -0,0 +1,50 @@
+"""
+过滤搜索一致性测试：带过滤条件时 /search 直接查询集合（经元数据预过滤规划），
+与原先的 SearchService.semantic_search 路径比较结果与相关度。
+需要完整的后端环境（chromadb、已编译的服务模块、已下载的激活模型）与非空知识库，缺少时跳过。
+"""
+import pytest
+
+pytest.importorskip("chromadb")
+pytest.importorskip("fastapi.testclient")
+
+from fastapi.testclient import TestClient
+
+from services.retrieval import compare_filtered_search
+from services.vector_ingest import get_raw_collection
+
+# 暴力打分是精确结果，HNSW 为近似结果，允许少量差异
+MIN_OVERLAP = 0.8
+MAX_SCORE_DELTA = 1e-3
+
+QUERIES = ["如何配置知识库", "error log", "项目计划"]
+
+
+@pytest.fixture(scope="module")
+def search_service():
+    try:
+        from main import app
+    except ImportError as e:
+        pytest.skip(f"后端模块无法导入: {e}")
+    with TestClient(app):
+        service = getattr(app.state, "search_service", None)
+        if service is None:
+            pytest.skip("搜索服务未初始化")
+        yield service
+
+
+def _sample_filters(service):
+    raw = get_raw_collection(service.vector_store_service.get_collection("knowledge_base_small"))
+    sample = raw.get(limit=50, include=["metadatas"])
+    extensions = sorted({m.get("file_extension") for m in sample["metadatas"] if m and m.get("file_extension")})
+    if not extensions:
+        pytest.skip("知识库为空或文本块缺少 file_extension 元数据")
+    return [{"fileType": [extensions[0]]}, {"fileType": extensions}, {"fileSize": "s"}]
+
+
+def test_filtered_direct_query_matches_semantic_search(search_service):
+    for filters in _sample_filters(search_service):
+        for query in QUERIES:
+            report = compare_filtered_search(search_service, query, filters, n_results=10)
+            assert report["overlap"] >= MIN_OVERLAP, (query, filters, report)
+            assert report["max_score_delta"] <= MAX_SCORE_DELTA, (query, filters, report)